@@ -1,27 +1,45 @@
 import json
 import logging
+from functools import partial
 import threading
 import time
 from pathlib import Path
+from typing import Iterable, NoReturn
 
 import click
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
 from subtitles_ocr.models import Frame, FrameAnalysis, FrameGroup, SubtitleEvent, VideoInfo
-from subtitles_ocr.pipeline.extract import extract_frames
-from subtitles_ocr.pipeline.filter import compute_groups
-from subtitles_ocr.pipeline.prefilter import prefilter_groups
-from subtitles_ocr.pipeline.analyze import analyze_groups
+from subtitles_ocr.pipeline.extract import (
+    StreamConfig, extract_frames, extract_representatives, get_video_info, iter_representatives, prepare_frames_dir,
+    stream_kept_strips,
+)
+from subtitles_ocr.pipeline.filter import (
+    DECODE_SCALES, DEFAULT_DECODE_SCALE, SIDECAR_RANGE, DiffRecorder, DiffSidecar,
+    compute_groups, compute_stream_groups, frame_edge_maps, scaled_threshold,
+)
+from subtitles_ocr.pipeline.segments import (
+    EdgeMapSource, compute_groups_segmented, split_frames, split_time_range, stream_segment_edge_maps,
+)
+from subtitles_ocr.pipeline.prefilter import THUMBNAIL_MAX_WIDTH, prefilter_as_completed
+from subtitles_ocr.pipeline.local_prefilter import local_prefilter_groups
+from subtitles_ocr.pipeline.analyze import ANALYZE_DECODING, analyze_as_completed
+from subtitles_ocr.pipeline.fingerprint import TextMaskIndex
 from subtitles_ocr.pipeline.group import group_events
 from subtitles_ocr.pipeline.fuzzy_group import fuzzy_group_events
-from subtitles_ocr.pipeline.reconcile import reconcile_groups
+from subtitles_ocr.pipeline.reconcile import reconcile_as_completed
 from subtitles_ocr.pipeline.serialize import build_ass_content
 from subtitles_ocr.pipeline.retry import RetryConfig
 from subtitles_ocr.pipeline.resume import resume_from_jsonl
-from subtitles_ocr.vlm.client import OllamaClient
-from subtitles_ocr.vlm.prompt import SYSTEM_PROMPT, PREFILTER_PROMPT
-from subtitles_ocr.litellm_config import get_workers_from_litellm
+from subtitles_ocr.vlm.cache import DEFAULT_MAX_ENTRIES, InferenceCache
+from subtitles_ocr.vlm.client import DecodingConfig, OllamaClient
+from subtitles_ocr.vlm.concurrency import AdaptiveConcurrency, AdaptiveConfig
+from subtitles_ocr.vlm.router import Backend
+from subtitles_ocr.vlm.prompt import (
+    SYSTEM_PROMPT, STRIP_SYSTEM_PROMPT, PREFILTER_PROMPT, SUBTITLES_SCHEMA, STRIP_SUBTITLES_SCHEMA,
+)
+from subtitles_ocr.litellm_config import get_backends_from_litellm, get_workers_from_litellm
 from subtitles_ocr.pipeline.skip import parse_skip_range, normalize_ranges, filter_frames, format_time
 
 
@@ -31,10 +49,70 @@ def _read_jsonl(path: Path) -> list[str]:
     return [s for line in path.read_text(encoding="utf-8").splitlines() if (s := line.strip())]
 
 
+def _write_groups(path: Path, groups: list[FrameGroup]) -> None:
+    with path.open("w", encoding="utf-8") as f:
+        for g in groups:
+            f.write(g.model_dump_json() + "\n")
+
+
 FILTER_WORKERS_DEFAULT = 4
 ANALYZE_WORKERS_DEFAULT = 1
 RECONCILE_WORKERS_DEFAULT = 8
 
+# Seconds one request may take, per step: a few answer tokens, a frame's subtitles (possibly after
+# reasoning), a subtitle line
+FILTER_TIMEOUT_DEFAULT = 60.0
+ANALYZE_TIMEOUT_DEFAULT = 300.0
+RECONCILE_TIMEOUT_DEFAULT = 60.0
+
+# Elements a step still failed after retrying them at its end, written before the run stops
+FAILURES_FILE = "failures.jsonl"
+
+
+def _close_cache(cache: InferenceCache) -> None:
+    stats = cache.stats()
+    if stats:
+        click.echo(f"Inference cache {cache.path}:")
+        for stage, s in stats.items():
+            click.echo(f"      {stage}: {s.hits}/{s.hits + s.misses} hits ({s.hit_rate:.0%})")
+    cache.close()
+
+
+def _echo_concurrency(client: OllamaClient) -> None:
+    limiter = client.limiter
+    if limiter is not None and limiter.completed_requests:
+        click.echo(
+            f"      {client.model}: concurrency settled at {limiter.limit} (peak {limiter.peak}), "
+            f"{limiter.throughput:.2f} requests/s."
+        )
+    if client.hedged:
+        click.echo(
+            f"      {client.model}: {client.hedged} request(s) hedged past {client.latency.p95:.1f}s, "
+            f"{client.hedges_won} answered by the duplicate first."
+        )
+    if len(client.router.stats) > 1:
+        for stats in client.router.stats:
+            ejected = f", ejected {stats.ejections} time(s)" if stats.ejections else ""
+            click.echo(
+                f"      {stats.url}: {stats.completed} requests, {stats.throughput:.2f} requests/s, "
+                f"{stats.failed} failed{ejected}."
+            )
+
+
+def _abort_with_failures(
+    workdir: Path, step: int, stage: str, what: str, ids: list[str], models: list[str | None],
+) -> NoReturn:
+    """Stop the run over elements a step failed twice, listed in FAILURES_FILE with the models tried."""
+    models = list(dict.fromkeys(model for model in models if model is not None))
+    path = workdir / FAILURES_FILE
+    with path.open("w", encoding="utf-8") as f:
+        for element_id in ids:
+            f.write(json.dumps({"step": step, "stage": stage, "id": element_id, "models": models}) + "\n")
+    raise click.ClickException(
+        f"[{step}/9] {len(ids)} {what} after max retries, also when retried at the end of the step "
+        f"(listed in {path}). Resume to retry."
+    )
+
 
 def _resolve_workers(model: str, explicit: int | None, config: Path | None, default: int) -> int:
     if explicit is not None:
@@ -54,57 +132,168 @@ def _resolve_workers(model: str, explicit: int | None, config: Path | None, defa
               help="Path to the output .ass file (default: <video>.ass)")
 @click.option("--workdir", "-w", type=click.Path(path_type=Path), default=None,
               help="Working directory for intermediate files")
+@click.option("--extract-mode", type=click.Choice(["frames", "stream"]), default="frames",
+              help="frames: write every frame as a JPEG; stream: pipe only the subtitle strips into "
+                   "grouping and decode group representatives afterwards (default: frames)")
+@click.option("--decimate", is_flag=True, default=False,
+              help="Stream mode only: let ffmpeg drop strips that are near-duplicates of the previous kept one "
+                   "(mpdecimate)")
+@click.option("--sample-fps", default=None, type=click.FloatRange(min=0, min_open=True),
+              help="Frames mode only: compare frames at this rate, then binary-search each change "
+                   "for the exact frame (default: every frame); step 1 still extracts every frame, "
+                   "so this only saves decoding the skipped JPEGs for grouping")
+@click.option("--decode-scale", default=None, type=click.Choice([str(s) for s in DECODE_SCALES]),
+              help="Frames mode only: decode frames at 1/N size for grouping, faster; --edge-diff-threshold "
+                   "is rescaled to approximate its full-resolution meaning, so groups may differ slightly "
+                   f"(default: {DEFAULT_DECODE_SCALE})")
+@click.option("--segments", default=1, type=click.IntRange(min=1),
+              help="Split grouping (and extraction in stream mode) into this many time segments "
+                   "processed in parallel (default: 1)")
 @click.option("--filter-model", default="llava:7b",
               help="Model for pre-filtering (default: llava:7b)")
+@click.option("--filter-fallback-model", default=None,
+              help="Model the groups pre-filtering failed for are retried on at the end of the step "
+                   "(default: --filter-model)")
 @click.option("--filter-workers", default=None, type=click.IntRange(min=1),
-              help="Parallel workers for pre-filtering (default: 4)")
+              help="Requests in flight at once for pre-filtering (default: 4)")
+@click.option("--filter-timeout", default=FILTER_TIMEOUT_DEFAULT, type=click.FloatRange(min=0.0, min_open=True),
+              help=f"Seconds a pre-filter request may take before it is retried (default: {FILTER_TIMEOUT_DEFAULT:g})")
+@click.option("--filter-batch-size", default=8, type=click.IntRange(min=1),
+              help="Groups asked about per pre-filter request, tiled into one image; "
+                   "malformed batch answers fall back to one request per group (default: 8)")
+@click.option("--filter-image-width", default=THUMBNAIL_MAX_WIDTH, type=click.IntRange(min=64),
+              help="Width the subtitle strips are shrunk to at most before being sent to the "
+                   f"pre-filter model (default: {THUMBNAIL_MAX_WIDTH})")
+@click.option("--local-prefilter/--no-local-prefilter", default=True,
+              help="Decide clear-cut groups with a local outlined-text detector and send only the "
+                   "unsure ones to the pre-filter model (default: on)")
 @click.option("--analyze-model", default="qwen3-vl:4b",
               help="Model for VLM analysis (default: qwen3-vl:4b)")
+@click.option("--analyze-fallback-model", default=None,
+              help="Model the groups analysis failed for are retried on at the end of the step "
+                   "(default: --analyze-model)")
 @click.option("--analyze-workers", default=None, type=click.IntRange(min=1),
-              help="Parallel workers for VLM analysis (default: 1).")
+              help="Requests in flight at once for VLM analysis (default: 1).")
+@click.option("--analyze-timeout", default=ANALYZE_TIMEOUT_DEFAULT, type=click.FloatRange(min=0.0, min_open=True),
+              help=f"Seconds an analysis request may take before it is retried (default: {ANALYZE_TIMEOUT_DEFAULT:g})")
+@click.option("--analyze-strips/--no-analyze-strips", default=False,
+              help="Send the analysis model only the top/bottom strips the local detector flags, "
+                   "one request each, and take subtitle positions from the strip (default: off)")
+@click.option("--analyze-schema/--no-analyze-schema", default=False,
+              help="Constrain analysis answers to the subtitles JSON schema; off by default as some "
+                   "Ollama versions mis-handle it with qwen2.5vl (default: off)")
+@click.option("--analyze-max-tokens", default=ANALYZE_DECODING.max_tokens, type=click.IntRange(min=16),
+              help="Tokens an analysis answer is cut off at, reasoning included "
+                   f"(default: {ANALYZE_DECODING.max_tokens})")
+@click.option("--dedup-text/--no-dedup-text", default=False,
+              help="Reuse the analysis of a group whose subtitle glyph mask matches an analyzed group's, "
+                   "instead of sending a new request (default: off)")
 @click.option("--reconcile-model", default="gemma3:1b-it-qat",
               help="Model for text reconciliation (default: gemma3:1b-it-qat)")
+@click.option("--reconcile-fallback-model", default=None,
+              help="Model the clusters reconciliation failed for are retried on at the end of the step "
+                   "(default: --reconcile-model)")
 @click.option("--reconcile-workers", default=None, type=click.IntRange(min=1),
-              help="Parallel workers for reconciliation (default: 8)")
+              help="Requests in flight at once for reconciliation (default: 8)")
+@click.option("--reconcile-timeout", default=RECONCILE_TIMEOUT_DEFAULT, type=click.FloatRange(min=0.0, min_open=True),
+              help="Seconds a reconciliation request may take before it is retried "
+                   f"(default: {RECONCILE_TIMEOUT_DEFAULT:g})")
 @click.option("--edge-diff-threshold", default=8.0, type=click.FloatRange(min=0.0),
               help="Edge difference threshold for frame grouping (default: 8.0)")
+@click.option("--sweep", "sweep_raw", default=None, metavar="T1,T2,...",
+              help="Report the group count at each of these edge difference thresholds after grouping, "
+                   "then stop; reuses the recorded edge differences when they cover the thresholds")
+@click.option("--record-diffs/--no-record-diffs", default=False,
+              help="Record the edge differences grouping measures, so that a new --edge-diff-threshold "
+                   "regroups without decoding; costs extra comparisons (default: off, on with --sweep)")
+@click.option("--adaptive-concurrency/--fixed-concurrency", default=True,
+              help="Start each model at its --*-workers value and adjust it from throughput, latency and "
+                   "overload errors, or keep it fixed (default: adaptive)")
+@click.option("--max-concurrency", default=AdaptiveConfig.maximum, type=click.IntRange(min=1),
+              help=f"Most requests in flight at once to one model when adaptive (default: {AdaptiveConfig.maximum})")
 @click.option("--similarity-threshold", default=0.75, type=click.FloatRange(min=0.0, max=1.0),
               help="Trigram similarity threshold for fuzzy grouping (default: 0.75)")
 @click.option("--gap-tolerance", default=0.5, type=click.FloatRange(min=0.0),
               help="Gap tolerance (seconds) between similar events (default: 0.5)")
-@click.option("--inference-url", default="http://localhost:11434",
-              help="Base URL of the OpenAI-compatible inference server (default: http://localhost:11434)")
+@click.option("--inference-url", multiple=True, default=["http://localhost:11434"],
+              help="Base URL of the OpenAI-compatible inference server; repeat it to spread requests over "
+                   "several servers, least busy first (default: http://localhost:11434)")
 @click.option("--litellm-config", default=None, type=click.Path(exists=True, dir_okay=False, path_type=Path),
               help="Path to a litellm.yaml; auto-derives worker counts per model")
+@click.option("--litellm-backends/--no-litellm-backends", default=False,
+              help="Send each model's requests straight to the api_base servers --litellm-config lists for it, "
+                   "within their max_parallel_requests, instead of to --inference-url (default: off)")
+@click.option("--hedge/--no-hedge", default=False,
+              help="With several servers for a model, send a request again to another one when it is not back "
+                   "by the model's 95th percentile latency so far, and keep the first answer (default: off)")
+@click.option("--cache-file", default=None, type=click.Path(dir_okay=False, path_type=Path),
+              help="SQLite file caching model answers by request (image, model, prompt, parameters); "
+                   "can be shared between runs and videos (default: no cache)")
+@click.option("--cache-max-entries", default=DEFAULT_MAX_ENTRIES, type=click.IntRange(min=1),
+              help=f"Answers kept in --cache-file, least recently used evicted first (default: {DEFAULT_MAX_ENTRIES})")
 @click.option("--skip", "skip_ranges_raw", multiple=True, metavar="START-END",
               help="Skip frames in this time range (HH:MM:SS, MM:SS, or SS). Can be repeated.")
 @click.option("--retry-max-attempts", default=10, type=click.IntRange(min=1),
               help="Max retry attempts per element for LLM calls (default: 10)")
 @click.option("--retry-base-delay", default=1.0, type=click.FloatRange(min=0.0),
-              help="Base delay in seconds for exponential backoff (default: 1.0)")
+              help="Base delay in seconds for jittered exponential backoff (default: 1.0)")
 @click.option("--retry-max-delay", default=30.0, type=click.FloatRange(min=0.0),
               help="Maximum delay cap in seconds for retry backoff (default: 30.0)")
+@click.option("--retry-budget", default=RetryConfig.budget_ratio, type=click.FloatRange(min=0.0),
+              help=f"Retries a step may make in all, per element, on top of {RetryConfig.budget} "
+                   f"(default: {RetryConfig.budget_ratio})")
+@click.option("--breaker-threshold", default=RetryConfig.breaker_threshold, type=click.IntRange(min=1),
+              help="Connection errors or 5xx in a row that pause a step's requests until a probe request "
+                   f"gets an answer (default: {RetryConfig.breaker_threshold})")
 @click.option("--debug", is_flag=True, default=False,
               help="Enable debug logging (VLM model outputs, etc.)")
 def cli(
     video: Path,
     output: Path | None,
     workdir: Path | None,
+    extract_mode: str,
+    decimate: bool,
+    sample_fps: float | None,
+    decode_scale: str | None,
+    segments: int,
     analyze_model: str,
     filter_model: str,
+    filter_fallback_model: str | None,
     filter_workers: int | None,
+    filter_timeout: float,
+    filter_batch_size: int,
+    filter_image_width: int,
+    local_prefilter: bool,
+    analyze_fallback_model: str | None,
     analyze_workers: int | None,
+    analyze_timeout: float,
+    analyze_strips: bool,
+    analyze_schema: bool,
+    analyze_max_tokens: int,
+    dedup_text: bool,
     edge_diff_threshold: float,
+    sweep_raw: str | None,
+    record_diffs: bool,
+    adaptive_concurrency: bool,
+    max_concurrency: int,
     similarity_threshold: float,
     gap_tolerance: float,
     reconcile_model: str,
+    reconcile_fallback_model: str | None,
     reconcile_workers: int | None,
-    inference_url: str,
+    reconcile_timeout: float,
+    inference_url: tuple[str, ...],
     litellm_config: Path | None,
+    litellm_backends: bool,
+    hedge: bool,
+    cache_file: Path | None,
+    cache_max_entries: int,
     skip_ranges_raw: tuple[str, ...],
     retry_max_attempts: int,
     retry_base_delay: float,
     retry_max_delay: float,
+    retry_budget: float,
+    breaker_threshold: int,
     debug: bool,
 ) -> None:
     """Extract hardcoded subtitles from an anime video and produce a .ass file."""
@@ -122,6 +311,34 @@ def cli(
             raise click.BadParameter(str(e), param_hint="'--skip'") from e
     skip_ranges = normalize_ranges(skip_ranges)
 
+    if decimate and extract_mode != "stream":
+        raise click.UsageError("--decimate requires --extract-mode stream")
+    stream_config = StreamConfig(decimate=decimate)
+    if sample_fps is not None and extract_mode != "frames":
+        raise click.UsageError("--sample-fps requires --extract-mode frames")
+    if sample_fps is not None and segments > 1:
+        raise click.UsageError("--sample-fps cannot be combined with --segments")
+    if decode_scale is not None and extract_mode != "frames":
+        raise click.UsageError("--decode-scale requires --extract-mode frames")
+    if extract_mode == "stream":
+        scale = 1
+    else:
+        scale = DEFAULT_DECODE_SCALE if decode_scale is None else int(decode_scale)
+
+    sweep: list[float] = []
+    if sweep_raw is not None:
+        try:
+            sweep = sorted(float(t) for t in sweep_raw.split(","))
+        except ValueError as e:
+            raise click.BadParameter(f"Invalid threshold list {sweep_raw!r}", param_hint="'--sweep'") from e
+        if sample_fps is not None or segments > 1:
+            raise click.UsageError("--sweep cannot be combined with --sample-fps or --segments")
+    if record_diffs and (sample_fps is not None or segments > 1):
+        raise click.UsageError("--record-diffs cannot be combined with --sample-fps or --segments")
+
+    if litellm_backends and litellm_config is None:
+        raise click.UsageError("--litellm-backends needs --litellm-config")
+
     if output is None:
         output = video.with_suffix(".ass")
     if workdir is None:
@@ -135,8 +352,41 @@ def cli(
         max_attempts=retry_max_attempts,
         base_delay=retry_base_delay,
         max_delay=retry_max_delay,
+        budget_ratio=retry_budget,
+        breaker_threshold=breaker_threshold,
     )
 
+    # Read up front, so that a model missing from the config fails the run before step 1
+    models = {filter_model, analyze_model, reconcile_model}
+    models |= {m for m in (filter_fallback_model, analyze_fallback_model, reconcile_fallback_model) if m is not None}
+    backends_by_model = {
+        model: [Backend(*backend) for backend in get_backends_from_litellm(litellm_config, model)]
+        for model in models
+    } if litellm_backends else {}
+
+    def stage_client(model: str, stage: str, workers: int, timeout: float) -> tuple[OllamaClient, int]:
+        """The stage's client, and how many of its requests the stage may start at once."""
+        backends = backends_by_model.get(model) or [Backend(url) for url in inference_url]
+        options = dict(cache=cache, stage=stage, backends=backends, timeout=timeout, hedge=hedge)
+        if not adaptive_concurrency:
+            return OllamaClient(model=model, **options), workers
+        limiter = AdaptiveConcurrency(AdaptiveConfig(initial=workers, maximum=max_concurrency), name=stage)
+        return OllamaClient(model=model, limiter=limiter, **options), max_concurrency
+
+    def deferred_client(
+        client: OllamaClient, concurrency: int, fallback_model: str | None, stage: str, workers: int, timeout: float,
+    ) -> tuple[OllamaClient, int]:
+        """The client to retry a step's failed elements with at its end: the step's, keeping its backends'
+        health, or the fallback model's."""
+        if fallback_model is None or fallback_model == client.model:
+            return client, concurrency
+        return stage_client(fallback_model, stage, workers, timeout)
+
+    cache = None
+    if cache_file is not None:
+        cache = InferenceCache(cache_file, cache_max_entries)
+        click.get_current_context().call_on_close(lambda: _close_cache(cache))
+
     workdir.mkdir(parents=True, exist_ok=True)
     step = 0
 
@@ -145,7 +395,14 @@ def cli(
     frames_dir = workdir / f"{step:03d}-frames"
     manifest_path = workdir / f"{step:03d}-manifest.json"
     video_info_path = workdir / f"{step:03d}-video_info.json"
-    if manifest_path.exists() and video_info_path.exists():
+    if extract_mode == "stream":
+        if video_info_path.exists():
+            video_info = VideoInfo.model_validate_json(video_info_path.read_text(encoding="utf-8"))
+        else:
+            video_info = get_video_info(video)
+            video_info_path.write_text(video_info.model_dump_json(indent=2), encoding="utf-8")
+        click.echo("[1/9] Extraction streamed into grouping (no frames written).")
+    elif manifest_path.exists() and video_info_path.exists():
         click.echo("[1/9] Extraction skipped (resuming).")
         frames = [Frame.model_validate(f) for f in json.loads(manifest_path.read_text(encoding="utf-8"))]
         video_info = VideoInfo.model_validate_json(video_info_path.read_text(encoding="utf-8"))
@@ -155,7 +412,7 @@ def cli(
 
         def _run_extract() -> None:
             try:
-                result_holder["frames"], result_holder["video_info"] = extract_frames(video, frames_dir)
+                result_holder["frames"], result_holder["video_info"] = extract_frames(video, frames_dir, skip_ranges)
             except Exception as e:
                 exc_holder["exc"] = e
 
@@ -176,11 +433,18 @@ def cli(
         )
         video_info_path.write_text(video_info.model_dump_json(indent=2), encoding="utf-8")
         click.echo(f"      {len(frames)} frames extracted.")
+        if skip_ranges:
+            click.echo(f"      {len(skip_ranges)} skip range(s) excluded during extraction.")
 
     # Step 2: frame filtering
     step += 1
     filtered_manifest_path = workdir / f"{step:03d}-filtered_manifest.json"
-    if filtered_manifest_path.exists():
+    if extract_mode == "stream":
+        if skip_ranges:
+            click.echo(f"[2/9] Frame filtering — {len(skip_ranges)} range(s) seeked over while streaming.")
+        else:
+            click.echo("[2/9] Frame filtering — no ranges specified.")
+    elif filtered_manifest_path.exists():
         click.echo("[2/9] Frame filtering skipped (resuming).")
         frames = [Frame.model_validate(f) for f in json.loads(filtered_manifest_path.read_text(encoding="utf-8"))]
     else:
@@ -202,19 +466,131 @@ def cli(
     # Step 3: edge-similarity grouping
     step += 1
     groups_path = workdir / f"{step:03d}-groups.jsonl"
+    partial_groups_path = workdir / f"{step:03d}-groups.jsonl.partial"
+    partial_params_path = workdir / f"{step:03d}-groups.partial.json"
+    diffs_path = workdir / f"{step:03d}-diffs.npz"
+    sidecar = DiffSidecar.load(diffs_path) if diffs_path.exists() else None
+    if sidecar is not None and not sidecar.recorded_with(scale, extract_mode, skip_ranges, decimate):
+        sidecar = None
     if groups_path.exists():
         click.echo("[3/9] Grouping skipped (resuming).")
         groups = [FrameGroup.model_validate_json(line) for line in _read_jsonl(groups_path)]
+    elif sidecar is not None and sidecar.covers(edge_diff_threshold):
+        click.echo(f"[3/9] Regrouping from {diffs_path.name} at threshold {edge_diff_threshold}.")
+        groups = sidecar.groups(edge_diff_threshold)
+        if extract_mode == "stream":
+            prepare_frames_dir(frames_dir)
+            click.echo(f"      Decoding {len(groups)} representative frames...")
+            extract_representatives(video, video_info, groups)
+        _write_groups(groups_path, groups)
+        partial_groups_path.unlink(missing_ok=True)
+        partial_params_path.unlink(missing_ok=True)
+        click.echo(f"      {len(groups)} groups found.")
     else:
-        groups = compute_groups(
-            tqdm(frames, desc="[3/9] Grouping", total=len(frames), unit="frame"),
-            diff_threshold=edge_diff_threshold,
-        )
-        with groups_path.open("w", encoding="utf-8") as f:
-            for g in groups:
-                f.write(g.model_dump_json() + "\n")
+        # Closed groups are appended as they come; a crash resumes after the last one,
+        # since grouping from that group's next frame onwards does not depend on the past.
+        # Only if it groups the same way: the settings the checkpoint was made with are kept next to it.
+        grouping_params = {
+            "edge_diff_threshold": edge_diff_threshold,
+            "decode_scale": scale,
+            "extract_mode": extract_mode,
+            "decimate": decimate,
+            "sample_fps": sample_fps,
+            "skip_ranges": [list(r) for r in skip_ranges],
+        }
+        if partial_groups_path.exists():
+            recorded_params = (
+                json.loads(partial_params_path.read_text(encoding="utf-8")) if partial_params_path.exists() else None
+            )
+            if recorded_params != grouping_params:
+                click.echo(f"[3/9] Grouping settings changed since {partial_groups_path.name}, discarding it.")
+                partial_groups_path.unlink()
+        partial_params_path.write_text(json.dumps(grouping_params, indent=2), encoding="utf-8")
+        closed = [FrameGroup.model_validate_json(line) for line in _read_jsonl(partial_groups_path)]
+        pending_frames = frames if extract_mode == "frames" else []
+        stream_start = 0.0
+        recorder: DiffRecorder | None = None
+        if closed:
+            resume_after = closed[-1].end_time
+            click.echo(f"[3/9] Resuming grouping after {format_time(resume_after)} ({len(closed)} groups closed).")
+            pending_frames = [f for f in pending_frames if f.timestamp > resume_after]
+            stream_start = resume_after + 0.5 / video_info.fps
+        elif record_diffs or sweep:
+            low, high = (edge_diff_threshold * m for m in SIDECAR_RANGE)
+            recorder = DiffRecorder(
+                min([low, *sweep]), max([high, *sweep]), scale, extract_mode, skip_ranges, decimate,
+            )
+        if extract_mode == "stream" and segments > 1 and video_info.duration is None:
+            click.echo("      Video duration unknown, grouping in a single segment.")
+            segments = 1
+        if extract_mode == "stream" and not closed:
+            prepare_frames_dir(frames_dir)
+        new_groups: Iterable[FrameGroup]
+        if segments > 1:
+            sources: list[EdgeMapSource]
+            threshold = edge_diff_threshold
+            if extract_mode == "stream":
+                assert video_info.duration is not None
+                sources = [
+                    partial(
+                        stream_segment_edge_maps, video, video_info, frames_dir, start, end, skip_ranges, stream_config,
+                    )
+                    for start, end in split_time_range(video_info.duration, segments, stream_start)
+                ]
+            else:
+                sources = [partial(frame_edge_maps, chunk, scale) for chunk in split_frames(pending_frames, segments)]
+                threshold = scaled_threshold(edge_diff_threshold, scale)
+            click.echo(f"[3/9] Grouping in {segments} parallel segments...")
+            new_groups = compute_groups_segmented(sources, threshold, workers=segments)
+        elif extract_mode == "stream":
+            streamed = stream_kept_strips(
+                video, video_info, frames_dir, skip_ranges, start=stream_start, config=stream_config,
+            )
+            new_groups = compute_stream_groups(
+                tqdm(streamed, desc="[3/9] Streaming and grouping", unit="frame"),
+                diff_threshold=edge_diff_threshold,
+                recorder=recorder,
+            )
+        elif sample_fps is not None:
+            sample_step = max(1, round(video_info.fps / sample_fps))
+            click.echo(f"[3/9] Grouping, sampling every {sample_step} frames...")
+            new_groups = compute_groups(
+                pending_frames, diff_threshold=edge_diff_threshold, sample_step=sample_step, decode_scale=scale,
+            )
+        else:
+            new_groups = compute_groups(
+                tqdm(pending_frames, desc="[3/9] Grouping", total=len(pending_frames), unit="frame"),
+                diff_threshold=edge_diff_threshold,
+                decode_scale=scale,
+                recorder=recorder,
+            )
+        if extract_mode == "stream":
+            new_groups = iter_representatives(video, video_info, new_groups)
+        with partial_groups_path.open("a", encoding="utf-8") as f:
+            for group in new_groups:
+                f.write(group.model_dump_json() + "\n")
+                f.flush()
+                closed.append(group)
+        if recorder is not None:
+            sidecar = recorder.sidecar()
+            sidecar.save(diffs_path)
+        partial_groups_path.replace(groups_path)
+        partial_params_path.unlink()
+        groups = closed
         click.echo(f"      {len(groups)} groups found.")
 
+    if sweep:
+        if sidecar is None:
+            raise click.ClickException(f"No recorded edge differences; delete {groups_path.name} to regroup")
+        click.echo("      Threshold sweep:")
+        for threshold in sweep:
+            if sidecar.covers(threshold):
+                click.echo(f"      {threshold:>8g}: {len(sidecar.groups(threshold))} groups")
+            else:
+                click.echo(f"      {threshold:>8g}: outside the recorded range "
+                           f"[{sidecar.min_threshold:g}, {sidecar.max_threshold:g}]")
+        return
+
     # Step 4: VLM pre-filtering
     step += 1
     filter_path = workdir / f"{step:03d}-filter.jsonl"
@@ -224,27 +600,67 @@ def cli(
     filter_results: list[bool] = [json.loads(line)["has_text"] for line in filter_lines]
 
     if remaining_for_filter:
-        filter_client = OllamaClient(model=filter_model, host=inference_url)
         mode = "a" if filter_path.exists() else "w"
-        failed_filter = 0
+        failed_filter: list[FrameGroup] = []
         with filter_path.open(mode, encoding="utf-8") as f, logging_redirect_tqdm():
-            for group, has_text in zip(
-                remaining_for_filter,
-                tqdm(
-                    prefilter_groups(remaining_for_filter, filter_client, PREFILTER_PROMPT, filter_workers, retry_config),
-                    total=len(remaining_for_filter),
-                    desc=f"[4/9] Pre-filtering ({filter_model})",
+            unsure = remaining_for_filter
+            if local_prefilter:
+                unsure = []
+                for group, has_text in zip(
+                    remaining_for_filter,
+                    tqdm(
+                        local_prefilter_groups(remaining_for_filter),
+                        total=len(remaining_for_filter),
+                        desc="[4/9] Pre-filtering (local)",
+                        unit="group",
+                    ),
+                ):
+                    if has_text is None:
+                        unsure.append(group)
+                    else:
+                        f.write(json.dumps({"id": str(group.frame), "has_text": has_text, "engine": "local"}) + "\n")
+                        filter_results.append(has_text)
+                click.echo(
+                    f"      {len(remaining_for_filter) - len(unsure)} group(s) decided locally, "
+                    f"{len(unsure)} left to {filter_model}."
+                )
+
+            def prefilter_pass(todo: list[FrameGroup], client: OllamaClient, concurrency: int) -> list[FrameGroup]:
+                """Pre-filter todo, writing results as they come; the groups that failed."""
+                failed = []
+                for index, has_text in tqdm(
+                    prefilter_as_completed(
+                        todo, client, PREFILTER_PROMPT, concurrency, retry_config,
+                        batch_size=filter_batch_size, thumbnail_width=filter_image_width,
+                    ),
+                    total=len(todo),
+                    desc=f"[4/9] Pre-filtering ({client.model})",
                     unit="group",
-                ),
-            ):
-                if has_text is None:
-                    failed_filter += 1
-                else:
-                    f.write(json.dumps({"id": str(group.frame), "has_text": has_text}) + "\n")
-                    filter_results.append(has_text)
+                ):
+                    group = todo[index]
+                    if has_text is None:
+                        failed.append(group)
+                    else:
+                        f.write(json.dumps({"id": str(group.frame), "has_text": has_text, "engine": "vlm"}) + "\n")
+                        filter_results.append(has_text)
+                _echo_concurrency(client)
+                return failed
+
+            if unsure:
+                filter_client, filter_concurrency = stage_client(
+                    filter_model, "prefilter", filter_workers, filter_timeout,
+                )
+                failed_filter = prefilter_pass(unsure, filter_client, filter_concurrency)
+                if failed_filter:
+                    click.echo(f"      {len(failed_filter)} group(s) failed, retrying them with a fresh retry budget.")
+                    failed_filter = prefilter_pass(failed_filter, *deferred_client(
+                        filter_client, filter_concurrency, filter_fallback_model, "prefilter", filter_workers,
+                        filter_timeout,
+                    ))
         if failed_filter:
-            raise click.ClickException(
-                f"[4/9] {failed_filter} group(s) failed pre-filter after max retries. Resume to retry."
+            _abort_with_failures(
+                workdir, step, "prefilter", "group(s) failed pre-filter", [str(g.frame) for g in failed_filter],
+                [filter_model, filter_fallback_model],
             )
         kept = sum(filter_results)
         click.echo(f"      {kept}/{len(groups)} groups kept for analysis.")
@@ -259,33 +675,63 @@ def cli(
         groups, analysis_path, lambda g: str(g.frame)
     )
     analyses: list[FrameAnalysis] = [FrameAnalysis.model_validate_json(line) for line in analysis_lines]
-    remaining_filter = [filter_by_id[str(g.frame)] for g in remaining_groups]
 
     if remaining_groups:
-        client = OllamaClient(model=analyze_model, host=inference_url)
+        client, analyze_concurrency = stage_client(analyze_model, "analyze", analyze_workers, analyze_timeout)
+        dedup = None
+        if dedup_text:
+            dedup = TextMaskIndex()
+            groups_by_id = {str(g.frame): g for g in groups}
+            dedup.add_analyses(
+                (groups_by_id[json.loads(line)["id"]], analysis) for line, analysis in zip(analysis_lines, analyses)
+            )
+        analyze_decoding = DecodingConfig(
+            schema=(STRIP_SUBTITLES_SCHEMA if analyze_strips else SUBTITLES_SCHEMA) if analyze_schema else None,
+            max_tokens=analyze_max_tokens,
+        )
         mode = "a" if analysis_path.exists() else "w"
-        failed_analyze = 0
         with analysis_path.open(mode, encoding="utf-8") as f, logging_redirect_tqdm():
-            for group, analysis in zip(
-                remaining_groups,
-                tqdm(
-                    analyze_groups(remaining_groups, remaining_filter, client, SYSTEM_PROMPT, analyze_workers, retry_config),
-                    total=len(remaining_groups),
-                    desc=f"[5/9] VLM analysis ({analyze_model})",
+            def analyze_pass(
+                todo: list[FrameGroup], client: OllamaClient, concurrency: int, dedup: TextMaskIndex | None,
+            ) -> list[FrameGroup]:
+                """Analyze todo, writing analyses as they come; the groups that failed."""
+                failed = []
+                for index, analysis in tqdm(
+                    analyze_as_completed(
+                        todo, [filter_by_id[str(g.frame)] for g in todo], client,
+                        STRIP_SYSTEM_PROMPT if analyze_strips else SYSTEM_PROMPT, concurrency, retry_config,
+                        crop_strips=analyze_strips, dedup=dedup, decoding=analyze_decoding,
+                    ),
+                    total=len(todo),
+                    desc=f"[5/9] VLM analysis ({client.model})",
                     unit="group",
-                ),
-            ):
-                if analysis is None:
-                    failed_analyze += 1
-                else:
-                    data = analysis.model_dump(mode="json")
-                    data["id"] = str(group.frame)
-                    f.write(json.dumps(data) + "\n")
-                    analyses.append(analysis)
+                ):
+                    if analysis is None:
+                        failed.append(todo[index])
+                    else:
+                        data = analysis.model_dump(mode="json")
+                        data["id"] = str(todo[index].frame)
+                        f.write(json.dumps(data) + "\n")
+                _echo_concurrency(client)
+                return failed
+
+            failed_analyze = analyze_pass(remaining_groups, client, analyze_concurrency, dedup)
+            if dedup is not None and dedup.reused:
+                click.echo(f"      {dedup.reused} group(s) reused the analysis of a group with the same subtitle.")
+            if failed_analyze:
+                click.echo(f"      {len(failed_analyze)} group(s) failed, retrying them with a fresh retry budget.")
+                # The index refers to the first pass's groups by position: start another
+                failed_analyze = analyze_pass(failed_analyze, *deferred_client(
+                    client, analyze_concurrency, analyze_fallback_model, "analyze", analyze_workers, analyze_timeout,
+                ), TextMaskIndex() if dedup_text else None)
         if failed_analyze:
-            raise click.ClickException(
-                f"[5/9] {failed_analyze} group(s) failed analysis after max retries. Resume to retry."
+            _abort_with_failures(
+                workdir, step, "analyze", "group(s) failed analysis", [str(g.frame) for g in failed_analyze],
+                [analyze_model, analyze_fallback_model],
             )
+        # Analyses were written as they completed: read them back in group order
+        analysis_lines, _ = resume_from_jsonl(groups, analysis_path, lambda g: str(g.frame))
+        analyses = [FrameAnalysis.model_validate_json(line) for line in analysis_lines]
     else:
         click.echo("[5/9] Analysis skipped (resuming).")
 
@@ -337,30 +783,48 @@ def cli(
     reconciled: list[SubtitleEvent] = [SubtitleEvent.model_validate_json(line) for line in reconciled_lines]
 
     if remaining_clusters:
-        reconcile_client = OllamaClient(model=reconcile_model, host=inference_url)
+        reconcile_client, reconcile_concurrency = stage_client(
+            reconcile_model, "reconcile", reconcile_workers, reconcile_timeout,
+        )
         mode = "a" if reconciled_path.exists() else "w"
-        failed_reconcile = 0
         with reconciled_path.open(mode, encoding="utf-8") as f, logging_redirect_tqdm():
-            for cluster, event in zip(
-                remaining_clusters,
-                tqdm(
-                    reconcile_groups(remaining_clusters, reconcile_client, reconcile_workers, retry_config),
-                    total=len(remaining_clusters),
-                    desc=f"[8/9] Reconciliation ({reconcile_model})",
+            def reconcile_pass(
+                todo: list[list[SubtitleEvent]], client: OllamaClient, concurrency: int,
+            ) -> list[list[SubtitleEvent]]:
+                """Reconcile todo, writing events as they come; the clusters that failed."""
+                failed = []
+                for index, event in tqdm(
+                    reconcile_as_completed(todo, client, concurrency, retry_config),
+                    total=len(todo),
+                    desc=f"[8/9] Reconciliation ({client.model})",
                     unit="group",
-                ),
-            ):
-                if event is None:
-                    failed_reconcile += 1
-                else:
-                    data = event.model_dump(mode="json")
-                    data["id"] = str(cluster[0].start_time)
-                    f.write(json.dumps(data) + "\n")
-                    reconciled.append(event)
+                ):
+                    if event is None:
+                        failed.append(todo[index])
+                    else:
+                        data = event.model_dump(mode="json")
+                        data["id"] = str(todo[index][0].start_time)
+                        f.write(json.dumps(data) + "\n")
+                _echo_concurrency(client)
+                return failed
+
+            failed_reconcile = reconcile_pass(remaining_clusters, reconcile_client, reconcile_concurrency)
+            if failed_reconcile:
+                click.echo(f"      {len(failed_reconcile)} cluster(s) failed, retrying them with a fresh retry budget.")
+                failed_reconcile = reconcile_pass(failed_reconcile, *deferred_client(
+                    reconcile_client, reconcile_concurrency, reconcile_fallback_model, "reconcile", reconcile_workers,
+                    reconcile_timeout,
+                ))
         if failed_reconcile:
-            raise click.ClickException(
-                f"[8/9] {failed_reconcile} cluster(s) failed reconciliation after max retries. Resume to retry."
+            _abort_with_failures(
+                workdir, step, "reconcile", "cluster(s) failed reconciliation",
+                [str(cluster[0].start_time) for cluster in failed_reconcile], [reconcile_model, reconcile_fallback_model],
             )
+        # Events were written as they completed: read them back in cluster order
+        reconciled_lines, _ = resume_from_jsonl(
+            fuzzy_groups, reconciled_path, lambda cluster: str(cluster[0].start_time)
+        )
+        reconciled = [SubtitleEvent.model_validate_json(line) for line in reconciled_lines]
     else:
         click.echo("[8/9] Reconciliation skipped (resuming).")
 
@@ -369,4 +833,5 @@ def cli(
     ass_content = build_ass_content(reconciled, video_info)
     output.write_text(ass_content, encoding="utf-8")
 
+    (workdir / FAILURES_FILE).unlink(missing_ok=True)
     click.echo(f"\nDone. Intermediate files in: {workdir}")
@@ -3,7 +3,8 @@ from pathlib import Path
 import yaml
 
 
-def get_workers_from_litellm(config_path: Path, model_name: str) -> int:
+def _backend_params(config_path: Path, model_name: str) -> list[dict]:
+    """The litellm_params of each backend serving model_name, with a valid max_parallel_requests."""
     data = yaml.safe_load(config_path.read_text(encoding="utf-8"))
     if not isinstance(data, dict):
         raise ValueError(f"litellm config at '{config_path}' is empty or not a YAML mapping")
@@ -15,7 +16,7 @@ def get_workers_from_litellm(config_path: Path, model_name: str) -> int:
         raise ValueError(
             f"No backends found for model '{model_name}' in litellm config"
         )
-    total = 0
+    backends = []
     for entry in matches:
         params = entry.get("litellm_params", {})
         if "max_parallel_requests" not in params:
@@ -29,5 +30,32 @@ def get_workers_from_litellm(config_path: Path, model_name: str) -> int:
             raise ValueError(
                 f"Backend at '{api_base}' for model '{model_name}' has invalid max_parallel_requests: {value!r} (must be a positive integer)"
             )
-        total += value
-    return total
+        backends.append(params)
+    return backends
+
+
+def get_workers_from_litellm(config_path: Path, model_name: str) -> int:
+    return sum(params["max_parallel_requests"] for params in _backend_params(config_path, model_name))
+
+
+def get_backends_from_litellm(config_path: Path, model_name: str) -> list[tuple[str, int, str | None]]:
+    """(api_base, max_parallel_requests, model) of each backend serving model_name.
+
+    model is the name the server itself knows the model by: litellm_params.model without its provider prefix,
+    if any ("ollama/llava:7b" is "llava:7b"), since model_name is only LiteLLM's alias for it. None when the
+    entry names no model, leaving requests on model_name.
+    """
+    backends = []
+    for params in _backend_params(config_path, model_name):
+        api_base = params.get("api_base")
+        if not isinstance(api_base, str) or not api_base:
+            raise ValueError(f"A backend for model '{model_name}' has no api_base")
+        model = params.get("model")
+        if model is not None and (not isinstance(model, str) or not model.split("/", 1)[-1]):
+            raise ValueError(f"Backend at '{api_base}' for model '{model_name}' has invalid model: {model!r}")
+        backends.append((
+            api_base.rstrip("/").removesuffix("/v1"),
+            params["max_parallel_requests"],
+            model.split("/", 1)[-1] if model is not None else None,
+        ))
+    return backends
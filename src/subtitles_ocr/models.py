@@ -12,12 +12,21 @@ SUBTITLE_PALETTE: dict[str, str] = {
 class Frame(BaseModel):
     path: Path
     timestamp: float
+    # Set when identical following frames were dropped at extraction: the
+    # timestamp of the last frame this one stands for.
+    held_until: float | None = None
+
+    @property
+    def end_timestamp(self) -> float:
+        return self.timestamp if self.held_until is None else self.held_until
 
 
 class VideoInfo(BaseModel):
     width: int
     height: int
     fps: float = Field(gt=0.0)
+    start_time: float = 0.0
+    duration: float | None = None
 
 
 class FrameGroup(BaseModel):
@@ -1,14 +1,30 @@
 # src/subtitles_ocr/pipeline/analyze.py
+import asyncio
+import io
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import Generator
+from pathlib import Path
+from typing import Awaitable, Callable, Generator, Iterator, TypeVar
+
+import numpy as np
+from PIL import Image
 
 from subtitles_ocr.models import FrameGroup, FrameAnalysis, SubtitleElement
-from subtitles_ocr.vlm.client import OllamaClient
-from subtitles_ocr.pipeline.retry import RetryConfig, RetryExhausted, NonRetryable, with_retry
+from subtitles_ocr.vlm.client import DecodingConfig, OllamaClient
+from subtitles_ocr.pipeline.filter import stack_strips, strip_height
+from subtitles_ocr.pipeline.fingerprint import TextMaskIndex
+from subtitles_ocr.pipeline.local_prefilter import TextDetectorConfig, strip_verdicts
+from subtitles_ocr.pipeline.repair import Escalation, loads_repaired
+from subtitles_ocr.pipeline.retry import (
+    RetryConfig, RetryCoordinator, RetryExhausted, NonRetryable, with_retry_async,
+)
+from subtitles_ocr.pipeline.runner import in_order, run_stage_unordered
 
 log = logging.getLogger(__name__)
+T = TypeVar("T")
+
+# A frame's subtitles take a few hundred tokens at most; the rest is room for a thinking model's reasoning
+ANALYZE_DECODING = DecodingConfig(max_tokens=2048)
 
 
 def _strip_code_fence(raw: str) -> str:
@@ -19,9 +35,10 @@ def _strip_code_fence(raw: str) -> str:
     return raw
 
 
-def parse_elements(raw: str) -> list[SubtitleElement]:
+def parse_elements(raw: str, repair: bool = False) -> list[SubtitleElement]:
+    """The elements of an analysis answer; with repair, of one that is nearly JSON too (see repair_json)."""
     raw = _strip_code_fence(raw)
-    data = json.loads(raw)
+    data = loads_repaired(raw) if repair else json.loads(raw)
     if not isinstance(data, dict):
         raise ValueError(f"expected JSON object, got {type(data).__name__}: {raw!r}")
     if not data:
@@ -40,14 +57,11 @@ def parse_elements(raw: str) -> list[SubtitleElement]:
     return result
 
 
-def analyze_group(
-    group: FrameGroup,
-    client: OllamaClient,
-    prompt: str,
-) -> FrameAnalysis:
-    raw = client.analyze(group.frame, system=prompt)
-    log.debug("analyze [%s] raw → %r", group.frame.name, raw)
-    elements = parse_elements(raw)
+def _parse_repaired(raw: str) -> list[SubtitleElement]:
+    return parse_elements(raw, repair=True)
+
+
+def _log_elements(group: FrameGroup, elements: list[SubtitleElement]) -> None:
     if not elements:
         log.info("analyze [%s] (no elements)", group.frame.name)
     for el in elements:
@@ -57,6 +71,18 @@ def analyze_group(
             el.position, el.color, el.style,
             el.text,
         )
+
+
+async def analyze_group(
+    group: FrameGroup,
+    client: OllamaClient,
+    prompt: str,
+    decoding: DecodingConfig = ANALYZE_DECODING,
+) -> FrameAnalysis:
+    raw = await client.analyze(group.frame, system=prompt, decoding=decoding, validate=_parse_repaired)
+    log.debug("analyze [%s] raw → %r", group.frame.name, raw)
+    elements = _parse_repaired(raw)
+    _log_elements(group, elements)
     return FrameAnalysis(
         start_time=group.start_time,
         end_time=group.end_time,
@@ -64,25 +90,117 @@ def analyze_group(
     )
 
 
-def analyze_groups(
+def text_strips(img: Image.Image, config: TextDetectorConfig) -> dict[str, Image.Image]:
+    """The frame's top and bottom strip crops that may hold text, by position.
+
+    A strip the local detector finds no outlined strokes in is left out,
+    unless that leaves nothing: the pre-filter saw text somewhere.
+    """
+    w, h = img.size
+    strip_h = strip_height(h)
+    crops = {"top": img.crop((0, 0, w, strip_h)), "bottom": img.crop((0, h - strip_h, w, h))}
+    small = img.reduce(config.decode_scale) if config.decode_scale > 1 else img
+    verdicts = strip_verdicts(np.asarray(stack_strips(small).convert("L")), config)
+    kept = {position: crop for (position, crop), verdict in zip(crops.items(), verdicts) if verdict is not False}
+    return kept or crops
+
+
+def _text_strip_jpegs(frame_path: Path, config: TextDetectorConfig) -> dict[str, bytes]:
+    with Image.open(frame_path) as img:
+        strips = text_strips(img.convert("RGB"), config)
+    jpegs = {}
+    for position, crop in strips.items():
+        data = io.BytesIO()
+        crop.save(data, "JPEG", quality=90)
+        jpegs[position] = data.getvalue()
+    return jpegs
+
+
+# A request for one strip's elements, given the system prompt and decoding to send it with
+StripRequest = Callable[[str, DecodingConfig], Awaitable[list[SubtitleElement]]]
+
+
+async def analyze_group_strips(
+    group: FrameGroup,
+    client: OllamaClient,
+    prompt: str,
+    decoding: DecodingConfig = ANALYZE_DECODING,
+    config: TextDetectorConfig | None = None,
+    ask: Callable[[str, StripRequest], Awaitable[list[SubtitleElement]]] | None = None,
+) -> FrameAnalysis:
+    """analyze_group on the subtitle strip crops only, one request per strip.
+
+    Each element's position is the strip it was read from. With ask, each
+    strip's request is made through ask(label, request) instead of sent
+    once, so that a malformed answer for one strip is asked again alone.
+    """
+    if config is None:
+        config = TextDetectorConfig()
+    strips = await asyncio.to_thread(_text_strip_jpegs, group.frame, config)
+    elements = []
+    for position, jpeg in strips.items():
+        async def request(system: str, dec: DecodingConfig, position: str = position, jpeg: bytes = jpeg):
+            raw = await client.analyze_image(jpeg, system=system, decoding=dec, validate=_parse_repaired)
+            log.debug("analyze [%s] %s strip raw → %r", group.frame.name, position, raw)
+            return [el.model_copy(update={"position": position}) for el in _parse_repaired(raw)]
+
+        if ask is None:
+            elements += await request(prompt, decoding)
+        else:
+            elements += await ask(f"analyze [{group.frame.name}] {position} strip", request)
+    _log_elements(group, elements)
+    return FrameAnalysis(
+        start_time=group.start_time,
+        end_time=group.end_time,
+        elements=elements,
+    )
+
+
+def _reused(analysis: FrameAnalysis, group: FrameGroup) -> FrameAnalysis:
+    return analysis.model_copy(update={"start_time": group.start_time, "end_time": group.end_time})
+
+
+def analyze_as_completed(
     groups: list[FrameGroup],
     filter_results: list[bool],
     client: OllamaClient,
     prompt: str,
     workers: int,
     retry_config: RetryConfig | None = None,
-) -> Generator[FrameAnalysis | None, None, None]:
+    crop_strips: bool = False,
+    dedup: TextMaskIndex | None = None,
+    decoding: DecodingConfig = ANALYZE_DECODING,
+) -> Iterator[tuple[int, FrameAnalysis | None]]:
+    """Yield (index in groups, analysis) as groups are analyzed; analysis is None when it failed.
+
+    With crop_strips, only the subtitle strips that may hold text are sent
+    (see analyze_group_strips); prompt should then not ask for positions.
+    With dedup, a group whose text mask matches one already indexed or
+    analyzed reuses that analysis instead of sending a request. decoding
+    can constrain answers to SUBTITLES_SCHEMA (STRIP_SUBTITLES_SCHEMA with
+    crop_strips), on servers and models where that works. An answer that is
+    nearly JSON is repaired; one that is not is asked again at once,
+    rephrased (see Escalation), and the group fails once every rephrasing
+    got a malformed answer. With crop_strips, each strip is retried and
+    rephrased on its own.
+    """
     if retry_config is None:
         retry_config = RetryConfig()
-    def process(group: FrameGroup, has_text: bool) -> FrameAnalysis | None:
-        if not has_text:
-            return FrameAnalysis(
-                start_time=group.start_time,
-                end_time=group.end_time,
-                elements=[],
-            )
+    coordinator = RetryCoordinator(retry_config, name="analyze")
+    async def retried(label: str, request: Callable[[str, DecodingConfig], Awaitable[T]]) -> T:
+        escalation = Escalation(label)
+        return await with_retry_async(
+            lambda: escalation.ask(request, prompt, decoding), retry_config, log, coordinator,
+        )
+
+    async def analyze_one(group: FrameGroup) -> FrameAnalysis | None:
         try:
-            return with_retry(lambda: analyze_group(group, client, prompt), retry_config, log)
+            if crop_strips:
+                # Each strip retried on its own: a malformed answer for one does not send the other again
+                return await analyze_group_strips(group, client, prompt, decoding, ask=retried)
+            return await retried(
+                f"analyze [{group.frame.name}]", lambda system, dec: analyze_group(group, client, system, dec),
+            )
         except NonRetryable as e:
             log.warning("analyze [%s] non-retryable: %s", group.frame.name, e.__cause__)
             return None
@@ -90,6 +208,60 @@ def analyze_groups(
             log.warning("analyze [%s] retries exhausted", group.frame.name)
             return None
 
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        for result in executor.map(process, groups, filter_results):
-            yield result
+    async def process(item: tuple[FrameGroup, bool]) -> FrameAnalysis | None:
+        group, has_text = item
+        if not has_text:
+            return FrameAnalysis(
+                start_time=group.start_time,
+                end_time=group.end_time,
+                elements=[],
+            )
+        if dedup is None:
+            return await analyze_one(group)
+        # Decoding the frame takes a while: off the loop, and only once a worker gets to the group
+        text = await asyncio.to_thread(dedup.mask, group)
+        same = dedup.find(text) if text is not None else None
+        if isinstance(same, asyncio.Future):
+            # Shielded: a follower cancelled must not cancel the analysis others wait for
+            same = await asyncio.shield(same)
+            if same is None:
+                # Its analysis failed: nothing was reused after all, analyze this group itself
+                dedup.reused -= 1
+        if same is not None:
+            log.info("analyze [%s] same text mask as an analyzed group, reused", group.frame.name)
+            return _reused(same, group)
+        if text is None:
+            return await analyze_one(group)
+        analysis: asyncio.Future[FrameAnalysis | None] = asyncio.get_running_loop().create_future()
+        dedup.add(text, analysis)
+        result = None
+        try:
+            result = await analyze_one(group)
+            return result
+        finally:
+            if result is None:
+                # So that later groups with this text do not wait on a failure but are analyzed
+                dedup.remove(text, analysis)
+            analysis.set_result(result)
+
+    for index, result in run_stage_unordered(list(zip(groups, filter_results)), process, workers):
+        yield index, result
+
+
+def analyze_groups(
+    groups: list[FrameGroup],
+    filter_results: list[bool],
+    client: OllamaClient,
+    prompt: str,
+    workers: int,
+    retry_config: RetryConfig | None = None,
+    crop_strips: bool = False,
+    dedup: TextMaskIndex | None = None,
+    decoding: DecodingConfig = ANALYZE_DECODING,
+) -> Generator[FrameAnalysis | None, None, None]:
+    """analyze_as_completed's analyses in group order."""
+    yield from in_order(
+        analyze_as_completed(
+            groups, filter_results, client, prompt, workers, retry_config, crop_strips, dedup, decoding,
+        )
+    )
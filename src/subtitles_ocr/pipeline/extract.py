@@ -1,7 +1,23 @@
 import json
+import queue
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
+from collections import deque
+from itertools import batched
+from dataclasses import dataclass
 from pathlib import Path
-from subtitles_ocr.models import Frame, VideoInfo
+from typing import IO, Iterable, Iterator
+from PIL import Image
+from subtitles_ocr.models import Frame, FrameGroup, VideoInfo
+from subtitles_ocr.pipeline.filter import strip_height
+from subtitles_ocr.pipeline.skip import is_skipped, kept_windows
+
+SEEK_MARGIN = 1.0
+# Seconds before start a trim keeps, so that float rounding never trims the frame at start itself
+TRIM_SLACK = 0.0005
 
 
 def parse_video_info(ffprobe_json: str) -> VideoInfo:
@@ -14,15 +30,20 @@ def parse_video_info(ffprobe_json: str) -> VideoInfo:
         num, den = map(int, stream["r_frame_rate"].split("/"))
     except (KeyError, ValueError) as e:
         raise ValueError(f"Cannot parse r_frame_rate from stream: {stream!r}") from e
+    fmt = data.get("format", {})
     return VideoInfo(
         width=stream["width"],
         height=stream["height"],
         fps=num / den,
+        start_time=float(fmt.get("start_time", 0.0)),
+        duration=float(fmt["duration"]) if "duration" in fmt else None,
     )
 
 
-def compute_frame_timestamps(paths: list[Path], fps: float) -> list[Frame]:
-    return [Frame(path=p, timestamp=i / fps) for i, p in enumerate(paths)]
+def compute_frame_timestamps(paths: list[Path], timestamps: list[float]) -> list[Frame]:
+    if len(paths) != len(timestamps):
+        raise ValueError(f"{len(paths)} frame files for {len(timestamps)} timestamps")
+    return [Frame(path=p, timestamp=t) for p, t in zip(paths, timestamps)]
 
 
 def get_video_info(video_path: Path) -> VideoInfo:
@@ -31,7 +52,7 @@ def get_video_info(video_path: Path) -> VideoInfo:
             [
                 "ffprobe", "-v", "quiet",
                 "-print_format", "json",
-                "-show_streams", "-select_streams", "v:0",
+                "-show_streams", "-select_streams", "v:0", "-show_format",
                 str(video_path),
             ],
             capture_output=True, text=True, check=True,
@@ -44,17 +65,47 @@ def get_video_info(video_path: Path) -> VideoInfo:
         raise RuntimeError(f"Cannot parse video info for {video_path}: {e}") from e
 
 
-def extract_frames(video_path: Path, output_dir: Path) -> tuple[list[Frame], VideoInfo]:
+def prepare_frames_dir(output_dir: Path) -> None:
     output_dir.mkdir(parents=True, exist_ok=True)
     # Clear any existing JPEGs to prevent stale files from corrupting timestamps
     for f in output_dir.glob("*.jpg"):
         f.unlink()
+
+
+def skip_select(skip_ranges: list[tuple[float, float]], start_time: float) -> str:
+    """select filter dropping frames inside the skip ranges, for ffmpeg runs using -copyts."""
+    terms = "+".join(
+        f"between(t,{start + start_time:.6f},{end + start_time:.6f})"
+        for start, end in skip_ranges
+    )
+    return f"select='not({terms})'"
+
+
+def extract_frames(
+    video_path: Path,
+    output_dir: Path,
+    skip_ranges: list[tuple[float, float]] | None = None,
+) -> tuple[list[Frame], VideoInfo]:
+    """Write every frame outside the skip ranges as a JPEG, timestamped from its pts.
+
+    A skip range at the very start is seeked over instead of decoded; frames in
+    the other ranges are dropped before being encoded or written.
+    """
+    prepare_frames_dir(output_dir)
     video_info = get_video_info(video_path)
+    skip_ranges = skip_ranges or []
+    filters = [skip_select(skip_ranges, video_info.start_time)] if skip_ranges else []
+    filters.append("showinfo")
+    seek = 0.0
+    if skip_ranges and skip_ranges[0][0] <= 0.0:
+        seek = max(0.0, skip_ranges[0][1] - SEEK_MARGIN)
 
     try:
-        subprocess.run(
+        result = subprocess.run(
             [
-                "ffmpeg", "-i", str(video_path),
+                "ffmpeg", "-hide_banner", "-nostats",
+                "-copyts", "-ss", f"{seek:.6f}", "-i", str(video_path),
+                "-vf", ",".join(filters), "-fps_mode", "passthrough",
                 "-q:v", "3",
                 str(output_dir / "%06d.jpg"),
             ],
@@ -67,5 +118,262 @@ def extract_frames(video_path: Path, output_dir: Path) -> tuple[list[Frame], Vid
     paths = sorted(output_dir.glob("*.jpg"))
     if not paths:
         raise RuntimeError(f"ffmpeg produced no frames in {output_dir}")
-    frames = compute_frame_timestamps(paths, video_info.fps)
+    timestamps = parse_showinfo(result.stderr.decode(errors="replace"), video_info.start_time)
+    try:
+        frames = compute_frame_timestamps(paths, timestamps)
+    except ValueError as e:
+        raise RuntimeError(f"Cannot timestamp frames of {video_path}: {e}") from e
     return frames, video_info
+
+
+@dataclass(frozen=True)
+class StreamConfig:
+    # Drop strips identical to the previous kept one inside ffmpeg (mpdecimate)
+    decimate: bool = False
+
+
+def strip_filtergraph(video_info: VideoInfo, config: StreamConfig = StreamConfig(), start: float = 0.0) -> str:
+    """ffmpeg filtergraph stacking the top and bottom subtitle strips as full-range gray.
+
+    showinfo logs each output frame's pts so stream_strips can timestamp it.
+    With decimation, frames before start (the seek's lead-in) are trimmed
+    first: mpdecimate must not drop the first frame at start as a
+    duplicate of a frame that is never emitted.
+    """
+    strip_h = strip_height(video_info.height)
+    decimate = "mpdecimate," if config.decimate else ""
+    trim = ""
+    if config.decimate and start > 0:
+        # Timestamps are the container's with -copyts; the slack is far less than a frame
+        trim = f"trim=start={max(0.0, video_info.start_time + start - TRIM_SLACK):.6f},"
+    return (
+        f"[0:v]{trim}split[top][bottom];"
+        f"[top]crop=iw:{strip_h}:0:0[t];"
+        f"[bottom]crop=iw:{strip_h}:0:ih-{strip_h}[b];"
+        f"[t][b]vstack,{decimate}scale=out_range=full,format=gray,showinfo[strips]"
+    )
+
+
+_SHOWINFO_TIME_BASE = re.compile(r"Parsed_showinfo_\d+ @ .*config in time_base: (\d+)/(\d+)")
+_SHOWINFO_FRAME = re.compile(r"Parsed_showinfo_\d+ @ .*\bn:\s*\d+\s+pts:\s*(-?\d+)")
+
+
+class ShowinfoParser:
+    """Turns showinfo log lines into frame timestamps.
+
+    Timestamps are computed from the integer pts so that every ffmpeg run over the
+    same file, whatever its seek position, yields bit-identical values (requires
+    -copyts).
+    """
+
+    def __init__(self, start_time: float):
+        self._start_time = start_time
+        self._time_base = (1, 1)
+
+    def parse(self, line: str) -> float | None:
+        """Return the timestamp of a showinfo frame line, None for any other line."""
+        if match := _SHOWINFO_FRAME.search(line):
+            num, den = self._time_base
+            return int(match.group(1)) * num / den - self._start_time
+        if match := _SHOWINFO_TIME_BASE.search(line):
+            self._time_base = (int(match.group(1)), int(match.group(2)))
+        return None
+
+
+def parse_showinfo(stderr: str, start_time: float) -> list[float]:
+    parser = ShowinfoParser(start_time)
+    return [t for line in stderr.splitlines() if (t := parser.parse(line)) is not None]
+
+
+class ShowinfoReader(threading.Thread):
+    """Parses ffmpeg's stderr in the background, queueing one timestamp per showinfo frame.
+
+    None is queued once stderr is exhausted.
+    """
+
+    def __init__(self, stderr: IO[bytes], start_time: float):
+        super().__init__(daemon=True)
+        self._stderr = stderr
+        self._parser = ShowinfoParser(start_time)
+        self.timestamps: queue.Queue[float | None] = queue.Queue()
+        self.log_tail: deque[str] = deque(maxlen=20)
+
+    def run(self) -> None:
+        try:
+            for raw in self._stderr:
+                line = raw.decode(errors="replace").rstrip()
+                timestamp = self._parser.parse(line)
+                if timestamp is not None:
+                    self.timestamps.put(timestamp)
+                elif "Parsed_showinfo" not in line:
+                    self.log_tail.append(line)
+        finally:
+            self.timestamps.put(None)
+
+
+def stream_strips(
+    video_path: Path,
+    video_info: VideoInfo,
+    output_dir: Path,
+    start: float = 0.0,
+    end: float | None = None,
+    config: StreamConfig = StreamConfig(),
+) -> Iterator[tuple[Frame, Image.Image]]:
+    """Decode only the stacked subtitle strips of frames in [start, end), piped as raw gray pixels.
+
+    Each frame's path is where extract_frames would have written it; nothing is
+    created there until extract_representatives decodes the groups' first frames.
+    The seek starts a little early and frames before start are dropped here, so
+    the segment boundary never depends on ffmpeg's seek accuracy.
+
+    With decimation, each frame is held until the frame before the next one
+    ffmpeg kept, which is why frames are yielded one frame late. The first
+    frame at start is always kept, so a static subtitle across a segment
+    seam or after a skip range is never lost.
+    """
+    size = (video_info.width, strip_height(video_info.height) * 2)
+    frame_bytes = size[0] * size[1]
+    seek = max(0.0, start - SEEK_MARGIN)
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-hide_banner", "-nostats", "-v", "info",
+            "-copyts", "-ss", f"{seek:.6f}", "-i", str(video_path),
+            "-filter_complex", strip_filtergraph(video_info, config, start), "-map", "[strips]",
+            "-fps_mode", "passthrough",
+            "-f", "rawvideo", "-pix_fmt", "gray", "pipe:1",
+        ],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    assert process.stdout is not None and process.stderr is not None
+    reader = ShowinfoReader(process.stderr, video_info.start_time)
+    reader.start()
+    frame_duration = 1 / video_info.fps
+
+    def held(frame: Frame, strips: Image.Image, next_start: float | None) -> tuple[Frame, Image.Image]:
+        if not config.decimate or next_start is None:
+            return frame, strips
+        return frame.model_copy(update={"held_until": max(frame.timestamp, next_start - frame_duration)}), strips
+
+    pending: tuple[Frame, Image.Image] | None = None
+    try:
+        decoded = 0
+        while data := process.stdout.read(frame_bytes):
+            decoded += 1
+            if len(data) != frame_bytes:
+                raise RuntimeError(f"ffmpeg returned a truncated frame for {video_path}")
+            timestamp = reader.timestamps.get()
+            if timestamp is None:
+                raise RuntimeError(f"ffmpeg frame without showinfo timestamp for {video_path}")
+            if timestamp < start:
+                continue
+            if pending is not None:
+                yield held(*pending, timestamp if end is None else min(timestamp, end))
+                pending = None
+            if end is not None and timestamp >= end:
+                return
+            index = round(timestamp * video_info.fps)
+            pending = (
+                Frame(path=output_dir / f"{index + 1:06d}.jpg", timestamp=timestamp),
+                Image.frombytes("L", size, data),
+            )
+        if pending is not None:
+            # Held until the stream ends, not just its own timestamp: the last group would end early
+            stream_end = min((t for t in (end, video_info.duration) if t is not None), default=None)
+            yield held(*pending, stream_end)
+        if process.wait() != 0:
+            reader.join()
+            stderr = "\n".join(reader.log_tail)
+            raise RuntimeError(f"ffmpeg failed for {video_path}: {stderr or '(no stderr)'}")
+        if decoded == 0:
+            raise RuntimeError(f"ffmpeg produced no frames for {video_path}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        reader.join()
+        process.stderr.close()
+
+
+def stream_kept_strips(
+    video_path: Path,
+    video_info: VideoInfo,
+    output_dir: Path,
+    skip_ranges: list[tuple[float, float]],
+    start: float = 0.0,
+    end: float | None = None,
+    config: StreamConfig = StreamConfig(),
+) -> Iterator[tuple[Frame, Image.Image]]:
+    """stream_strips over [start, end), seeking past the skip ranges instead of decoding them."""
+    for window_start, window_end in kept_windows(skip_ranges, start, end):
+        if video_info.duration is not None and window_start >= video_info.duration:
+            # After a skip range running to the end: nothing to decode, which stream_strips would fail on
+            break
+        for frame, strips in stream_strips(video_path, video_info, output_dir, window_start, window_end, config):
+            if not is_skipped(frame.timestamp, skip_ranges):
+                yield frame, strips
+
+
+REPRESENTATIVE_BATCH_SIZE = 64
+
+
+def representative_select(timestamps: list[float], offset: float, fps: float) -> str:
+    """select filter keeping the frames nearest to each timestamp, seeked to offset."""
+    half_frame = 0.5 / fps
+    terms = "+".join(
+        f"between(t,{t - offset - half_frame:.6f},{t - offset + half_frame:.6f})"
+        for t in timestamps
+    )
+    return f"select='{terms}'"
+
+
+def extract_representatives(
+    video_path: Path,
+    video_info: VideoInfo,
+    groups: list[FrameGroup],
+) -> None:
+    """Decode the full-resolution first frame of each group to its frame path as a JPEG.
+
+    Groups are handled in batches; each batch seeks close to its first frame so
+    the whole video is decoded roughly once.
+    """
+    ordered = sorted(groups, key=lambda g: g.start_time)
+    for i in range(0, len(ordered), REPRESENTATIVE_BATCH_SIZE):
+        batch = ordered[i:i + REPRESENTATIVE_BATCH_SIZE]
+        offset = max(0.0, batch[0].start_time - 1.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_dir = Path(tmp)
+            try:
+                subprocess.run(
+                    [
+                        "ffmpeg", "-ss", f"{offset:.6f}", "-i", str(video_path),
+                        "-vf", representative_select([g.start_time for g in batch], offset, video_info.fps),
+                        "-fps_mode", "passthrough", "-frames:v", str(len(batch)),
+                        "-q:v", "3",
+                        str(tmp_dir / "%06d.jpg"),
+                    ],
+                    capture_output=True, check=True,
+                )
+            except subprocess.CalledProcessError as e:
+                stderr = e.stderr.decode(errors="replace") if e.stderr else "(no stderr)"
+                raise RuntimeError(f"ffmpeg failed for {video_path}: {stderr}") from e
+            paths = sorted(tmp_dir.glob("*.jpg"))
+            if len(paths) != len(batch):
+                raise RuntimeError(
+                    f"ffmpeg returned {len(paths)} representative frames for {len(batch)} groups "
+                    f"starting at {batch[0].start_time:.3f}s"
+                )
+            for path, group in zip(paths, batch):
+                group.frame.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(path, group.frame)
+
+
+def iter_representatives(
+    video_path: Path,
+    video_info: VideoInfo,
+    groups: Iterable[FrameGroup],
+) -> Iterator[FrameGroup]:
+    """Pass groups through once their representative frame is decoded, a batch at a time."""
+    for batch in batched(groups, REPRESENTATIVE_BATCH_SIZE):
+        extract_representatives(video_path, video_info, list(batch))
+        yield from batch
@@ -1,61 +1,413 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import batched
 from pathlib import Path
-from typing import Iterable
-from PIL import Image, ImageChops, ImageFilter
+from typing import Callable, Iterable, Iterator, Sequence
+import numpy as np
+from PIL import Image
 from subtitles_ocr.models import Frame, FrameGroup
 
 SUBTITLE_STRIP_RATIO = 0.20
 EDGE_DIFF_THRESHOLD = 8.0
+# Frames whose edge maps are computed together in one 3D array
+EDGE_BATCH_SIZE = 32
+# JPEG DCT scaling factors frame files can be decoded at for grouping
+DECODE_SCALES = (1, 2, 4, 8)
+# Reduced decoding is opt-in: its rescaled threshold only approximates full-resolution grouping
+DEFAULT_DECODE_SCALE = 1
+# Edge diff of a subtitle change at each decode scale relative to full resolution:
+# the mean ratio over the changes between the 1080p subtitles of tests/test_filter.py
+# (Pillow's default font at 54px, 3px outline), which re-measures it. Thin edges cover
+# a larger share of the downscaled strips; smaller or thinner glyphs give lower ratios
+# (about 1.1-1.3 at 48px with a 2px outline), so the rescaled threshold is approximate.
+EDGE_DIFF_SCALE_GAIN = {1: 1.0, 2: 1.49, 4: 1.46, 8: 1.44}
+# Thresholds a diff sidecar covers by default, as multiples of the grouping threshold
+SIDECAR_RANGE = (0.5, 2.0)
 
+# uint8 array of shape (height, width)
+EdgeMap = np.ndarray
 
-def compute_edge_map(frame_path: Path) -> Image.Image:
+
+def strip_height(frame_height: int) -> int:
+    return round(frame_height * SUBTITLE_STRIP_RATIO)
+
+
+def stack_strips(img: Image.Image) -> Image.Image:
+    """Return the top and bottom subtitle strips of a frame stacked vertically."""
+    w, h = img.size
+    strip_h = strip_height(h)
+    top = img.crop((0, 0, w, strip_h))
+    bottom = img.crop((0, h - strip_h, w, h))
+    combined = Image.new(img.mode, (w, strip_h * 2))
+    combined.paste(top, (0, 0))
+    combined.paste(bottom, (0, strip_h))
+    return combined
+
+
+def find_edges(gray: np.ndarray) -> np.ndarray:
+    """Pillow's FIND_EDGES on uint8 images of shape (..., height, width), all at once.
+
+    The 3x3 kernel is 8 at the centre and -1 around it, clipped to 0-255; the
+    border pixels are copied unchanged, as Pillow does.
+    """
+    height, width = gray.shape[-2:]
+    edges = gray.copy()
+    if height < 3 or width < 3:
+        return edges
+    values = gray.astype(np.int16)
+    window_sum = sum(
+        values[..., dy:height - 2 + dy, dx:width - 2 + dx] for dy in range(3) for dx in range(3)
+    )
+    edges[..., 1:-1, 1:-1] = np.clip(9 * values[..., 1:-1, 1:-1] - window_sum, 0, 255)
+    return edges
+
+
+def load_strips(frame_path: Path, scale: int = 1) -> np.ndarray:
+    """Decode a frame file's stacked subtitle strips as a gray uint8 array.
+
+    scale > 1 lets the JPEG decoder emit grayscale at 1/scale size directly.
+    """
     with Image.open(frame_path) as img:
-        w, h = img.size
-        strip_h = round(h * SUBTITLE_STRIP_RATIO)
-        top = img.crop((0, 0, w, strip_h))
-        bottom = img.crop((0, h - strip_h, w, h))
-        combined = Image.new(img.mode, (w, strip_h * 2))
-        combined.paste(top, (0, 0))
-        combined.paste(bottom, (0, strip_h))
-        return combined.convert("L").filter(ImageFilter.FIND_EDGES)
+        if scale > 1:
+            img.draft("L", (img.width // scale, img.height // scale))
+        return np.asarray(stack_strips(img).convert("L"))
 
 
-def edge_diff(map_a: Image.Image, map_b: Image.Image) -> float:
-    diff = ImageChops.difference(map_a, map_b)
-    pixels = diff.get_flattened_data()
-    return sum(pixels) / len(pixels)
+def compute_edge_map(frame_path: Path, scale: int = 1) -> EdgeMap:
+    return find_edges(load_strips(frame_path, scale))
 
 
-def compute_groups(
-    frames: Iterable[Frame],
+def scaled_threshold(diff_threshold: float, scale: int) -> float:
+    """The full-resolution diff_threshold, for edge maps decoded at 1/scale."""
+    return diff_threshold * EDGE_DIFF_SCALE_GAIN[scale]
+
+
+def batched_edge_maps(
+    strips: Iterable[tuple[Frame, np.ndarray]],
+    batch_size: int = EDGE_BATCH_SIZE,
+) -> Iterator[tuple[Frame, EdgeMap]]:
+    """Edge maps of gray strip arrays, filtered batch_size frames at a time."""
+    for batch in batched(strips, batch_size):
+        frames, arrays = zip(*batch)
+        yield from zip(frames, find_edges(np.stack(arrays)))
+
+
+def strips_edge_maps(strips: Iterable[tuple[Frame, Image.Image]]) -> Iterator[tuple[Frame, EdgeMap]]:
+    """Batched edge maps of already-stacked subtitle strips (see stream_strips)."""
+    return batched_edge_maps((frame, np.asarray(image.convert("L"))) for frame, image in strips)
+
+
+def edge_diff(map_a: EdgeMap, map_b: EdgeMap) -> float:
+    """Mean absolute difference per pixel, 0-255."""
+    diff = np.abs(map_a.astype(np.int16) - map_b)
+    return int(diff.sum(dtype=np.int64)) / diff.size
+
+
+def iter_edge_groups(
+    edge_maps: Iterable[tuple[Frame, EdgeMap]],
     diff_threshold: float = EDGE_DIFF_THRESHOLD,
-) -> list[FrameGroup]:
-    frames_iter = iter(frames)
-    first = next(frames_iter, None)
-    if first is None:
-        return []
-
-    groups: list[FrameGroup] = []
-    group_start = first
-    group_end = first
-    group_edges = compute_edge_map(first.path)
-
-    for frame in frames_iter:
-        frame_edges = compute_edge_map(frame.path)
+    open_group: tuple[FrameGroup, EdgeMap] | None = None,
+) -> Iterator[tuple[FrameGroup, EdgeMap]]:
+    """Yield each group with its first frame's edge map, the last one once edge_maps is exhausted.
+
+    open_group continues a group started earlier (e.g. in a previous segment)
+    instead of opening a new one on the first frame.
+    """
+    items = iter(edge_maps)
+    if open_group is None:
+        first = next(items, None)
+        if first is None:
+            return
+        frame, group_edges = first
+        group = FrameGroup(start_time=frame.timestamp, end_time=frame.end_timestamp, frame=frame.path)
+    else:
+        group, group_edges = open_group
+        group = group.model_copy()
+
+    for frame, frame_edges in items:
         if edge_diff(group_edges, frame_edges) <= diff_threshold:
-            group_end = frame
+            group.end_time = frame.end_timestamp
         else:
+            yield group, group_edges
+            group = FrameGroup(start_time=frame.timestamp, end_time=frame.end_timestamp, frame=frame.path)
+            group_edges = frame_edges
+
+    yield group, group_edges
+
+
+def iter_sampled_groups(
+    frames: Sequence[Frame],
+    edge_map_at: Callable[[int], EdgeMap],
+    sample_step: int,
+    diff_threshold: float = EDGE_DIFF_THRESHOLD,
+) -> Iterator[tuple[FrameGroup, EdgeMap]]:
+    """iter_edge_groups looking only at every sample_step-th frame, plus a binary search per change.
+
+    When a sample no longer matches the group's first frame, the frames since the
+    previous sample are bisected for the first one that does not match, so group
+    boundaries stay frame-accurate. Frames between two matching samples are assumed
+    to match too: a change shorter than sample_step frames may be missed.
+    """
+    if not frames:
+        return
+    edge_map_at = lru_cache(maxsize=8)(edge_map_at)
+    last = len(frames) - 1
+    group_edges = edge_map_at(0)
+    group = FrameGroup(start_time=frames[0].timestamp, end_time=frames[0].end_timestamp, frame=frames[0].path)
+    matched = 0  # last frame known to belong to the group
+    while matched < last:
+        sample = min(matched + sample_step, last)
+        if edge_diff(group_edges, edge_map_at(sample)) <= diff_threshold:
+            matched = sample
+            continue
+        changed = sample
+        while changed - matched > 1:
+            middle = (matched + changed) // 2
+            if edge_diff(group_edges, edge_map_at(middle)) <= diff_threshold:
+                matched = middle
+            else:
+                changed = middle
+        group.end_time = frames[matched].end_timestamp
+        yield group, group_edges
+        frame = frames[changed]
+        group = FrameGroup(start_time=frame.timestamp, end_time=frame.end_timestamp, frame=frame.path)
+        group_edges = edge_map_at(changed)
+        matched = changed
+    group.end_time = frames[last].end_timestamp
+    yield group, group_edges
+
+
+@dataclass
+class DiffSidecar:
+    """Edge differences needed to regroup frames at any threshold in [min_threshold, max_threshold].
+
+    Grouping compares each frame to its group's first frame, so for every frame
+    that can start a group at some threshold in range (an anchor), this keeps the
+    frames where the difference to the anchor exceeds every earlier one. The next
+    group at threshold T starts at the first of those records above T. Thresholds
+    are in full-resolution units; record values are raw diffs at decode_scale.
+    The frames depend on extract_mode, decimate and skip_ranges too: a sidecar
+    recorded with other settings is not recorded_with the current ones.
+    """
+
+    timestamps: np.ndarray        # float64, per frame
+    end_timestamps: np.ndarray    # float64, per frame
+    paths: np.ndarray             # str, per frame
+    anchors: np.ndarray           # int64, sorted frame indices
+    offsets: np.ndarray           # int64, records of anchors[k] are offsets[k]:offsets[k + 1]
+    record_frames: np.ndarray     # int64
+    record_values: np.ndarray     # float64, increasing per anchor
+    min_threshold: float
+    max_threshold: float
+    decode_scale: int = 1
+    extract_mode: str = "frames"
+    decimate: bool = False
+    skip_ranges: tuple[tuple[float, float], ...] = ()
+
+    def covers(self, diff_threshold: float) -> bool:
+        return self.min_threshold <= diff_threshold <= self.max_threshold
+
+    def recorded_with(
+        self, decode_scale: int, extract_mode: str, skip_ranges: Sequence[tuple[float, float]], decimate: bool = False,
+    ) -> bool:
+        return (self.decode_scale, self.extract_mode, self.decimate, self.skip_ranges) == (
+            decode_scale, extract_mode, decimate, _skip_key(skip_ranges),
+        )
+
+    def groups(self, diff_threshold: float) -> list[FrameGroup]:
+        """Exactly what compute_groups would return at diff_threshold."""
+        if not self.covers(diff_threshold):
+            raise ValueError(
+                f"Threshold {diff_threshold} outside the recorded range "
+                f"[{self.min_threshold}, {self.max_threshold}]"
+            )
+        threshold = scaled_threshold(diff_threshold, self.decode_scale)
+        last = len(self.timestamps) - 1
+        groups: list[FrameGroup] = []
+        anchor = 0
+        while last >= 0:
+            k = int(np.searchsorted(self.anchors, anchor))
+            start, stop = self.offsets[k], self.offsets[k + 1]
+            index = start + int(np.searchsorted(self.record_values[start:stop], threshold, side="right"))
+            next_anchor = int(self.record_frames[index]) if index < stop else None
+            end = last if next_anchor is None else next_anchor - 1
             groups.append(FrameGroup(
-                start_time=group_start.timestamp,
-                end_time=group_end.timestamp,
-                frame=group_start.path,
+                start_time=float(self.timestamps[anchor]),
+                end_time=float(self.end_timestamps[end]),
+                frame=Path(str(self.paths[anchor])),
             ))
-            group_start = frame
-            group_end = frame
-            group_edges = frame_edges
+            if next_anchor is None:
+                break
+            anchor = next_anchor
+        return groups
+
+    def save(self, path: Path) -> None:
+        with path.open("wb") as f:
+            np.savez_compressed(
+                f,
+                timestamps=self.timestamps,
+                end_timestamps=self.end_timestamps,
+                paths=self.paths,
+                anchors=self.anchors,
+                offsets=self.offsets,
+                record_frames=self.record_frames,
+                record_values=self.record_values,
+                thresholds=np.array([self.min_threshold, self.max_threshold]),
+                decode_scale=np.array(self.decode_scale),
+                extract_mode=np.array(self.extract_mode),
+                decimate=np.array(self.decimate),
+                skip_ranges=np.array(self.skip_ranges, dtype=np.float64).reshape(-1, 2),
+            )
+
+    @classmethod
+    def load(cls, path: Path) -> "DiffSidecar":
+        with np.load(path) as data:
+            min_threshold, max_threshold = data["thresholds"].tolist()
+            return cls(
+                timestamps=data["timestamps"],
+                end_timestamps=data["end_timestamps"],
+                paths=data["paths"],
+                anchors=data["anchors"],
+                offsets=data["offsets"],
+                record_frames=data["record_frames"],
+                record_values=data["record_values"],
+                min_threshold=min_threshold,
+                max_threshold=max_threshold,
+                decode_scale=int(data["decode_scale"]),
+                # Older sidecars did not record how their frames were extracted: no extract mode matches
+                extract_mode=str(data["extract_mode"]) if "extract_mode" in data else "",
+                decimate=bool(data["decimate"]) if "decimate" in data else False,
+                skip_ranges=_skip_key(data["skip_ranges"].tolist()) if "skip_ranges" in data else (),
+            )
+
+
+def _skip_key(skip_ranges: Iterable[Sequence[float]]) -> tuple[tuple[float, float], ...]:
+    return tuple((float(start), float(end)) for start, end in skip_ranges)
+
+
+class DiffRecorder:
+    """Records a DiffSidecar from the (frame, edge map) pairs passing through record().
+
+    Every frame is compared to each anchor still open, that is whose largest
+    difference so far is at most max_threshold; a record above min_threshold
+    makes that frame an anchor as well. That is on top of grouping's own
+    comparisons, and the more so the wider the range, so recording is for
+    runs that will regroup or sweep.
+    """
+
+    def __init__(
+        self,
+        min_threshold: float,
+        max_threshold: float,
+        decode_scale: int = 1,
+        extract_mode: str = "frames",
+        skip_ranges: Sequence[tuple[float, float]] = (),
+        decimate: bool = False,
+    ):
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.decode_scale = decode_scale
+        self.extract_mode = extract_mode
+        self.skip_ranges = _skip_key(skip_ranges)
+        self.decimate = decimate
+        self._low = scaled_threshold(min_threshold, decode_scale)
+        self._high = scaled_threshold(max_threshold, decode_scale)
+        self._frames: list[Frame] = []
+        self._open: dict[int, tuple[EdgeMap, float]] = {}
+        self._records: dict[int, list[tuple[int, float]]] = {}
+
+    def record(self, edge_maps: Iterable[tuple[Frame, EdgeMap]]) -> Iterator[tuple[Frame, EdgeMap]]:
+        for frame, edges in edge_maps:
+            self.add(frame, edges)
+            yield frame, edges
+
+    def add(self, frame: Frame, edges: EdgeMap) -> None:
+        index = len(self._frames)
+        self._frames.append(frame)
+        is_anchor = index == 0
+        for anchor, (anchor_edges, largest) in list(self._open.items()):
+            diff = edge_diff(anchor_edges, edges)
+            if diff <= largest:
+                continue
+            if diff > self._low:
+                self._records[anchor].append((index, diff))
+                is_anchor = True
+            if diff > self._high:
+                del self._open[anchor]
+            else:
+                self._open[anchor] = (anchor_edges, diff)
+        if is_anchor:
+            self._open[index] = (edges, -1.0)
+            self._records[index] = []
 
-    groups.append(FrameGroup(
-        start_time=group_start.timestamp,
-        end_time=group_end.timestamp,
-        frame=group_start.path,
-    ))
-    return groups
+    def sidecar(self) -> DiffSidecar:
+        anchors = sorted(self._records)
+        records = [record for anchor in anchors for record in self._records[anchor]]
+        return DiffSidecar(
+            timestamps=np.array([f.timestamp for f in self._frames], dtype=np.float64),
+            end_timestamps=np.array([f.end_timestamp for f in self._frames], dtype=np.float64),
+            paths=np.array([str(f.path) for f in self._frames], dtype=str),
+            anchors=np.array(anchors, dtype=np.int64),
+            offsets=np.cumsum([0, *(len(self._records[a]) for a in anchors)], dtype=np.int64),
+            record_frames=np.array([i for i, _ in records], dtype=np.int64),
+            record_values=np.array([v for _, v in records], dtype=np.float64),
+            min_threshold=self.min_threshold,
+            max_threshold=self.max_threshold,
+            decode_scale=self.decode_scale,
+            extract_mode=self.extract_mode,
+            decimate=self.decimate,
+            skip_ranges=self.skip_ranges,
+        )
+
+
+def group_edge_maps(
+    edge_maps: Iterable[tuple[Frame, EdgeMap]],
+    diff_threshold: float = EDGE_DIFF_THRESHOLD,
+) -> list[FrameGroup]:
+    """Group consecutive frames whose edge map stays close to the group's first frame."""
+    return [group for group, _ in iter_edge_groups(edge_maps, diff_threshold)]
+
+
+def frame_edge_maps(frames: Iterable[Frame], scale: int = 1) -> Iterator[tuple[Frame, EdgeMap]]:
+    return batched_edge_maps((frame, load_strips(frame.path, scale)) for frame in frames)
+
+
+def compute_groups(
+    frames: Iterable[Frame],
+    diff_threshold: float = EDGE_DIFF_THRESHOLD,
+    sample_step: int = 1,
+    decode_scale: int = 1,
+    recorder: DiffRecorder | None = None,
+) -> Iterator[FrameGroup]:
+    """Yield groups of frame files as they close; with sample_step > 1 only sampled frames
+    and those around changes are decoded.
+
+    diff_threshold is in full-resolution units whatever the decode_scale. A
+    recorder sees every frame's edge map, so it cannot be used with sampling.
+    """
+    diff_threshold = scaled_threshold(diff_threshold, decode_scale)
+    if sample_step <= 1:
+        edge_maps = frame_edge_maps(frames, decode_scale)
+        if recorder is not None:
+            edge_maps = recorder.record(edge_maps)
+        return (group for group, _ in iter_edge_groups(edge_maps, diff_threshold))
+    if recorder is not None:
+        raise ValueError("Cannot record edge differences while sampling frames")
+    frames = list(frames)
+    return (
+        group for group, _ in iter_sampled_groups(
+            frames, lambda i: compute_edge_map(frames[i].path, decode_scale), sample_step, diff_threshold,
+        )
+    )
+
+
+def compute_stream_groups(
+    strips: Iterable[tuple[Frame, Image.Image]],
+    diff_threshold: float = EDGE_DIFF_THRESHOLD,
+    recorder: DiffRecorder | None = None,
+) -> Iterator[FrameGroup]:
+    """Yield groups of frames streamed as already-stacked subtitle strips (see stream_strips) as they close."""
+    edge_maps = strips_edge_maps(strips)
+    if recorder is not None:
+        edge_maps = recorder.record(edge_maps)
+    return (group for group, _ in iter_edge_groups(edge_maps, diff_threshold))
@@ -0,0 +1,102 @@
+# src/subtitles_ocr/pipeline/fingerprint.py
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from subtitles_ocr.models import FrameAnalysis, FrameGroup
+from subtitles_ocr.pipeline.filter import load_strips
+from subtitles_ocr.pipeline.local_prefilter import TextDetectorConfig, outlined_strokes
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FingerprintConfig:
+    detector: TextDetectorConfig = TextDetectorConfig()
+    # Side of the square cells the mask is pooled into for the fingerprint, at
+    # the detector's decode scale, and the outlined pixels that mark a cell
+    cell: int = 16
+    min_cell_pixels: int = 16
+    # Fewer outlined pixels than this is no subtitle to fingerprint
+    min_pixels: int = 200
+    # Overlap (intersection over union) two masks with the same fingerprint
+    # need to be the same subtitle; one changed punctuation mark stays below
+    min_overlap: float = 0.95
+
+
+@dataclass
+class TextMask:
+    fingerprint: str
+    mask: np.ndarray
+
+
+def text_mask(frame_path: Path, config: FingerprintConfig) -> TextMask | None:
+    """The subtitle glyph mask of a frame's strips, bright fill inside dark outline, and its fingerprint.
+
+    The fingerprint hashes which coarse cells the mask covers, so that the
+    same subtitle over another background usually gets the same one.
+    """
+    strips = load_strips(frame_path, config.detector.decode_scale)
+    height = strips.shape[0] // 2
+    mask = np.vstack([outlined_strokes(strips[:height], config.detector), outlined_strokes(strips[height:], config.detector)])
+    if mask.sum() < config.min_pixels:
+        return None
+    rows, cols = mask.shape[0] // config.cell, mask.shape[1] // config.cell
+    cells = mask[:rows * config.cell, :cols * config.cell].reshape(rows, config.cell, cols, config.cell).sum(axis=(1, 3))
+    grid = cells >= config.min_cell_pixels
+    digest = hashlib.blake2b(np.packbits(grid).tobytes(), digest_size=16)
+    digest.update(f"{rows}x{cols}".encode())
+    return TextMask(fingerprint=digest.hexdigest(), mask=mask)
+
+
+def _overlap(a: np.ndarray, b: np.ndarray) -> float:
+    if a.shape != b.shape:
+        return 0.0
+    return np.logical_and(a, b).sum() / np.logical_or(a, b).sum()
+
+
+@dataclass
+class TextMaskIndex:
+    """Analyses by the text mask of their group's frame, to reuse for groups showing the same subtitle.
+
+    An entry is an analysis or, for one not done yet, the caller's handle on it
+    (analyze_as_completed uses a future of the analysis, None if it failed).
+    """
+    config: FingerprintConfig = field(default_factory=FingerprintConfig)
+    reused: int = 0
+    _entries: dict[str, list[tuple[np.ndarray, FrameAnalysis | asyncio.Future]]] = field(default_factory=dict)
+
+    def mask(self, group: FrameGroup) -> TextMask | None:
+        try:
+            return text_mask(group.frame, self.config)
+        except OSError as e:
+            log.warning("fingerprint [%s] unreadable frame: %s", group.frame.name, e)
+            return None
+
+    def find(self, text: TextMask) -> FrameAnalysis | asyncio.Future | None:
+        for mask, analysis in self._entries.get(text.fingerprint, []):
+            if _overlap(mask, text.mask) >= self.config.min_overlap:
+                self.reused += 1
+                return analysis
+        return None
+
+    def add(self, text: TextMask, analysis: FrameAnalysis | asyncio.Future) -> None:
+        self._entries.setdefault(text.fingerprint, []).append((text.mask, analysis))
+
+    def remove(self, text: TextMask, analysis: FrameAnalysis | asyncio.Future) -> None:
+        entries = self._entries.get(text.fingerprint, [])
+        entries[:] = [entry for entry in entries if entry[1] is not analysis]
+
+    def add_analyses(self, analyzed: Iterable[tuple[FrameGroup, FrameAnalysis]]) -> None:
+        """Index analyses already done, e.g. by an interrupted run."""
+        for group, analysis in analyzed:
+            if not analysis.elements:
+                continue
+            text = self.mask(group)
+            if text is not None:
+                self.add(text, analysis)
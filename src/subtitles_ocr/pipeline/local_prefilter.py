@@ -0,0 +1,124 @@
+# src/subtitles_ocr/pipeline/local_prefilter.py
+import logging
+from dataclasses import dataclass
+from typing import Generator, Iterable
+
+import numpy as np
+
+from subtitles_ocr.models import FrameGroup
+from subtitles_ocr.pipeline.filter import load_strips
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TextDetectorConfig:
+    decode_scale: int = 2
+    # Gray levels of subtitle fill (white, yellow and cyan are all above) and outline
+    bright: int = 170
+    dark: int = 70
+    # Widest glyph stroke, in pixels at decode_scale, between two outline pixels
+    max_stroke: int = 4
+    # Share of a strip's pixels that are outlined strokes
+    no_text_below: float = 0.00005
+    text_above: float = 0.0005
+    # Gray step to a neighbouring pixel that makes a sharp edge, and the share of a strip's pixels on
+    # one below which it has no high-contrast strokes at all, outlined or not
+    min_contrast: int = 48
+    no_edges_below: float = 0.0002
+    # Share of a strip's strokes that must fall in its densest band of rows, and that band's height
+    min_concentration: float = 0.97
+    band_ratio: float = 1 / 3
+
+
+def _dark_within(dark: np.ndarray, distance: int, axis: int, before: bool) -> np.ndarray:
+    """Whether a dark pixel lies within distance pixels before (or after) each pixel along axis."""
+    near = np.zeros_like(dark)
+    length = dark.shape[axis]
+    for d in range(1, min(distance, length - 1) + 1):
+        if axis == 1:
+            if before:
+                near[:, d:] |= dark[:, :length - d]
+            else:
+                near[:, :length - d] |= dark[:, d:]
+        else:
+            if before:
+                near[d:, :] |= dark[:length - d, :]
+            else:
+                near[:length - d, :] |= dark[d:, :]
+    return near
+
+
+def outlined_strokes(strip: np.ndarray, config: TextDetectorConfig) -> np.ndarray:
+    """Bright pixels with an outline pixel close on both sides, horizontally or vertically."""
+    bright = strip >= config.bright
+    dark = strip <= config.dark
+    strokes = np.zeros_like(bright)
+    for axis in (0, 1):
+        strokes |= (
+            _dark_within(dark, config.max_stroke, axis, before=True)
+            & _dark_within(dark, config.max_stroke, axis, before=False)
+        )
+    return bright & strokes
+
+
+def sharp_edges(strip: np.ndarray, config: TextDetectorConfig) -> np.ndarray:
+    """Pixels at least min_contrast gray levels away from their right or lower neighbour."""
+    values = strip.astype(np.int16)
+    edges = np.zeros(strip.shape, dtype=bool)
+    edges[:, :-1] |= np.abs(np.diff(values, axis=1)) >= config.min_contrast
+    edges[:-1, :] |= np.abs(np.diff(values, axis=0)) >= config.min_contrast
+    return edges
+
+
+def classify_strip(strip: np.ndarray, config: TextDetectorConfig) -> bool | None:
+    """True for a line of outlined glyphs, False for no high-contrast strokes at all, None when unsure.
+
+    Subtitles are mostly bright glyphs with dark outlines, laid out in one
+    line of text; line art can also have bright strokes between dark lines,
+    but spread over the whole strip. Text with a colored fill or without an
+    outline is no outlined glyph, but has sharp edges: that is unsure too.
+    """
+    strokes = outlined_strokes(strip, config)
+    share = strokes.mean()
+    if share < config.no_text_below:
+        return False if sharp_edges(strip, config).mean() < config.no_edges_below else None
+    if share < config.text_above:
+        return None
+    rows = strokes.sum(axis=1)
+    band = max(1, round(len(rows) * config.band_ratio))
+    concentration = np.convolve(rows, np.ones(band, dtype=rows.dtype), "valid").max() / rows.sum()
+    return True if concentration >= config.min_concentration else None
+
+
+def strip_verdicts(strips: np.ndarray, config: TextDetectorConfig) -> tuple[bool | None, bool | None]:
+    """classify_strip for the top and the bottom halves of stacked strips."""
+    height = strips.shape[0] // 2
+    return classify_strip(strips[:height], config), classify_strip(strips[height:], config)
+
+
+def detect_text(strips: np.ndarray, config: TextDetectorConfig) -> bool | None:
+    """Classify stacked top and bottom strips: text in either is text, none in both is no text."""
+    verdicts = list(strip_verdicts(strips, config))
+    if True in verdicts:
+        return True
+    if verdicts == [False, False]:
+        return False
+    return None
+
+
+def local_prefilter_groups(
+    groups: Iterable[FrameGroup],
+    config: TextDetectorConfig | None = None,
+) -> Generator[bool | None, None, None]:
+    """Yield has_text for each group from its frame's strips, or None to leave it to the VLM."""
+    if config is None:
+        config = TextDetectorConfig()
+    for group in groups:
+        try:
+            strips = load_strips(group.frame, config.decode_scale)
+        except OSError as e:
+            log.warning("local prefilter [%s] unreadable frame: %s", group.frame.name, e)
+            yield None
+            continue
+        yield detect_text(strips, config)
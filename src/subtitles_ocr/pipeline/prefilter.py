@@ -1,43 +1,144 @@
 # src/subtitles_ocr/pipeline/prefilter.py
-import json
+import asyncio
+import io
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import Generator
+from itertools import batched
+from pathlib import Path
+from typing import Generator, Iterator
+
+from PIL import Image
 
 from subtitles_ocr.models import FrameGroup
-from subtitles_ocr.vlm.client import OllamaClient
-from subtitles_ocr.pipeline.retry import RetryConfig, RetryExhausted, NonRetryable, with_retry
+from subtitles_ocr.vlm.client import DecodingConfig, OllamaClient
+from subtitles_ocr.vlm.prompt import PREFILTER_BATCH_PROMPT, PREFILTER_SCHEMA, prefilter_batch_schema
+from subtitles_ocr.pipeline.filter import stack_strips
+from subtitles_ocr.pipeline.repair import Escalation, loads_repaired
+from subtitles_ocr.pipeline.retry import (
+    MalformedAnswer, RetryConfig, RetryCoordinator, RetryExhausted, NonRetryable, with_retry_async,
+)
+from subtitles_ocr.pipeline.runner import in_order, run_stage_unordered
 
 log = logging.getLogger(__name__)
 
+# Width the subtitle strips are shrunk to at most before being sent, alone or as mosaic tiles
+THUMBNAIL_MAX_WIDTH = 768
+# Mosaic layout: tiles are told apart by solid bars between them, in a color no subtitle uses. No
+# numbers: glyphs drawn in the image would be text to a model asked whether there is text.
+MOSAIC_GAP = 8
+MOSAIC_SEPARATOR_COLOR = "magenta"
+# {"has_text": false} is about 6 tokens, a batch answer about 2 per tile: leave room for whitespace
+PREFILTER_DECODING = DecodingConfig(schema=PREFILTER_SCHEMA, max_tokens=16)
+BATCH_TOKENS_PER_TILE = 4
 
-def prefilter_groups(
+
+def batch_decoding(count: int) -> DecodingConfig:
+    return DecodingConfig(
+        schema=prefilter_batch_schema(count),
+        max_tokens=PREFILTER_DECODING.max_tokens + BATCH_TOKENS_PER_TILE * count,
+    )
+
+
+def _coerce_has_text(value: object) -> bool:
+    if isinstance(value, str):
+        coerced = {"true": True, "false": False}.get(value.lower())
+        if coerced is not None:
+            return coerced
+        raise ValueError(f"unrecognized has_text string: {value!r}")
+    if isinstance(value, bool):
+        return value
+    raise ValueError(f"has_text missing or wrong type: {value!r}")
+
+
+def _jpeg(img: Image.Image) -> bytes:
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def strip_image(frame_path: Path, max_width: int = THUMBNAIL_MAX_WIDTH) -> Image.Image:
+    """The frame's stacked subtitle strips, shrunk to at most max_width."""
+    with Image.open(frame_path) as img:
+        img.draft("RGB", (max_width, max_width * img.height // img.width))
+        strips = stack_strips(img.convert("RGB"))
+    if strips.width > max_width:
+        strips = strips.resize((max_width, max(1, round(strips.height * max_width / strips.width))), Image.LANCZOS)
+    return strips
+
+
+def strip_thumbnail(frame_path: Path, max_width: int = THUMBNAIL_MAX_WIDTH) -> bytes:
+    """strip_image as an in-memory JPEG."""
+    return _jpeg(strip_image(frame_path, max_width))
+
+
+def build_mosaic(groups: list[FrameGroup], tile_width: int = THUMBNAIL_MAX_WIDTH) -> bytes:
+    """Stack the groups' subtitle strips vertically as tiles separated by colored bars, as a JPEG."""
+    tiles = [strip_image(group.frame, tile_width) for group in groups]
+    mosaic = Image.new(
+        "RGB",
+        (max(t.width for t in tiles), sum(t.height for t in tiles) + MOSAIC_GAP * (len(tiles) - 1)),
+        MOSAIC_SEPARATOR_COLOR,
+    )
+    y = 0
+    for tile in tiles:
+        mosaic.paste(tile, (0, y))
+        y += tile.height + MOSAIC_GAP
+    return _jpeg(mosaic)
+
+
+def parse_response(response: str) -> bool:
+    """The has_text answer of a single-group response, repaired if need be."""
+    data = loads_repaired(response)
+    if not isinstance(data, dict):
+        raise ValueError(f"expected JSON object: {response!r}")
+    return _coerce_has_text(data.get("has_text"))
+
+
+def parse_batch_response(response: str, count: int) -> list[bool]:
+    """The has_text answers of a mosaic response: a JSON array, or an object holding one, repaired if need be."""
+    data = loads_repaired(response)
+    if isinstance(data, dict):
+        data = data.get("has_text")
+    if not isinstance(data, list) or len(data) != count:
+        raise ValueError(f"expected a JSON array of {count} answers: {response!r}")
+    return [_coerce_has_text(value) for value in data]
+
+
+def prefilter_as_completed(
     groups: list[FrameGroup],
     client: OllamaClient,
     prompt: str,
     workers: int,
     retry_config: RetryConfig | None = None,
-) -> Generator[bool | None, None, None]:
+    batch_size: int = 1,
+    thumbnail_width: int = THUMBNAIL_MAX_WIDTH,
+) -> Iterator[tuple[int, bool | None]]:
+    """Yield (index in groups, has_text) as groups are classified; has_text is None when it could not be.
+
+    The model only sees the subtitle strips, shrunk to thumbnail_width in
+    memory, and its answer is constrained to the expected JSON; one that is
+    nearly JSON anyway is repaired, one that is not is asked again at once,
+    rephrased (see Escalation). With batch_size > 1, groups are asked about
+    batch_size at a time as one mosaic image; a batch whose answer is
+    malformed or incomplete is asked again one group at a time.
+    """
     if retry_config is None:
         retry_config = RetryConfig()
-    def classify(group: FrameGroup) -> bool | None:
-        def _attempt() -> bool:
-            response = client.analyze(group.frame, prompt, json_mode=True)
-            data = json.loads(response)
-            if not isinstance(data, dict):
-                raise ValueError(f"expected JSON object: {response!r}")
-            result = data.get("has_text")
-            if isinstance(result, str):
-                coerced = {"true": True, "false": False}.get(result.lower())
-                if coerced is not None:
-                    return coerced
-                raise ValueError(f"unrecognized has_text string: {result!r}")
-            if isinstance(result, bool):
-                return result
-            raise ValueError(f"has_text missing or wrong type: {result!r}")
+    coordinator = RetryCoordinator(retry_config, name="prefilter")
+    async def classify(group: FrameGroup) -> bool | None:
+        async def _ask(text: str, decoding: DecodingConfig) -> bool:
+            return parse_response(
+                await client.analyze_image(thumbnail, text, decoding=decoding, validate=parse_response),
+            )
 
+        escalation = Escalation(f"prefilter [{group.frame.name}]")
         try:
-            return with_retry(_attempt, retry_config, log)
+            thumbnail = await asyncio.to_thread(strip_thumbnail, group.frame, thumbnail_width)
+            return await with_retry_async(
+                lambda: escalation.ask(_ask, prompt, PREFILTER_DECODING), retry_config, log, coordinator,
+            )
+        except OSError as e:
+            log.warning("prefilter [%s] unreadable frame: %s", group.frame.name, e)
+            return None
         except NonRetryable as e:
             log.warning("prefilter [%s] non-retryable error: %s", group.frame.name, e.__cause__)
             return None
@@ -45,6 +146,48 @@ def prefilter_groups(
             log.warning("prefilter [%s] retries exhausted", group.frame.name)
             return None
 
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        for result in executor.map(classify, groups):
-            yield result
+    async def classify_batch(batch: tuple[FrameGroup, ...]) -> list[bool | None]:
+        if len(batch) == 1:
+            return [await classify(batch[0])]
+        label = f"{batch[0].frame.name}..{batch[-1].frame.name}"
+
+        async def ask_batch() -> str:
+            try:
+                return await client.analyze_image(
+                    mosaic, PREFILTER_BATCH_PROMPT.format(count=len(batch)), decoding=batch_decoding(len(batch)),
+                    validate=lambda answer: parse_batch_response(answer, len(batch)),
+                )
+            except ValueError as e:
+                # Not worth sending the same mosaic again: asking one group at a time is the retry
+                raise MalformedAnswer(str(e)) from e
+
+        try:
+            mosaic = await asyncio.to_thread(build_mosaic, list(batch), thumbnail_width)
+            response = await with_retry_async(ask_batch, retry_config, log, coordinator)
+            return list(parse_batch_response(response, len(batch)))
+        except RetryExhausted:
+            log.warning("prefilter [%s] retries exhausted", label)
+            return [None] * len(batch)
+        except (OSError, ValueError, NonRetryable) as e:
+            log.info("prefilter [%s] batch answer unusable (%s), asking one group at a time", label, e)
+            return [await classify(group) for group in batch]
+
+    size = max(1, batch_size)
+    for batch_index, results in run_stage_unordered(batched(groups, size), classify_batch, workers):
+        for offset, has_text in enumerate(results):
+            yield batch_index * size + offset, has_text
+
+
+def prefilter_groups(
+    groups: list[FrameGroup],
+    client: OllamaClient,
+    prompt: str,
+    workers: int,
+    retry_config: RetryConfig | None = None,
+    batch_size: int = 1,
+    thumbnail_width: int = THUMBNAIL_MAX_WIDTH,
+) -> Generator[bool | None, None, None]:
+    """prefilter_as_completed's has_text values in group order."""
+    yield from in_order(
+        prefilter_as_completed(groups, client, prompt, workers, retry_config, batch_size, thumbnail_width)
+    )
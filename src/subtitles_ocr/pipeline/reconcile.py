@@ -1,16 +1,21 @@
 # src/subtitles_ocr/pipeline/reconcile.py
 import logging
 from collections import Counter
-from concurrent.futures import ThreadPoolExecutor
 from typing import Iterator
 
 from subtitles_ocr.models import SubtitleElement, SubtitleEvent
-from subtitles_ocr.vlm.client import OllamaClient
+from subtitles_ocr.vlm.client import DecodingConfig, OllamaClient
 from subtitles_ocr.vlm.prompt import RECONCILE_PROMPT
-from subtitles_ocr.pipeline.retry import RetryConfig, RetryExhausted, NonRetryable, with_retry
+from subtitles_ocr.pipeline.retry import (
+    RetryConfig, RetryCoordinator, RetryExhausted, NonRetryable, with_retry_async,
+)
+from subtitles_ocr.pipeline.runner import in_order, run_stage_unordered
 
 log = logging.getLogger(__name__)
 
+# The answer is one subtitle, a line or two; a blank line starts an explanation the prompt asked not for
+RECONCILE_DECODING = DecodingConfig(max_tokens=128, stop=("\n\n",))
+
 
 def _majority(values: list[str]) -> str:
     counts = Counter(values)
@@ -21,14 +26,14 @@ def _majority(values: list[str]) -> str:
     raise AssertionError("unreachable")
 
 
-def _reconcile_text(texts: list[str], client: OllamaClient) -> str:
+async def _reconcile_text(texts: list[str], client: OllamaClient) -> str:
     if len(set(texts)) == 1:
         return texts[0]
     numbered = "\n".join(f"{i + 1}. {t}" for i, t in enumerate(texts))
-    return client.chat(f"Readings:\n{numbered}", system=RECONCILE_PROMPT).strip()
+    return (await client.chat(f"Readings:\n{numbered}", system=RECONCILE_PROMPT, decoding=RECONCILE_DECODING)).strip()
 
 
-def _reconcile_cluster(cluster: list[SubtitleEvent], client: OllamaClient) -> SubtitleEvent:
+async def _reconcile_cluster(cluster: list[SubtitleEvent], client: OllamaClient) -> SubtitleEvent:
     if len(cluster) == 1:
         return cluster[0]
 
@@ -38,7 +43,7 @@ def _reconcile_cluster(cluster: list[SubtitleEvent], client: OllamaClient) -> Su
     for position in positions:
         all_els = [el for event in cluster for el in event.elements if el.position == position]
         elements.append(SubtitleElement(
-            text=_reconcile_text([el.text for el in all_els], client),
+            text=await _reconcile_text([el.text for el in all_els], client),
             style=_majority([el.style for el in all_els]),
             color=_majority([el.color for el in all_els]),
             position=position,
@@ -51,18 +56,22 @@ def _reconcile_cluster(cluster: list[SubtitleEvent], client: OllamaClient) -> Su
     )
 
 
-def reconcile_groups(
+def reconcile_as_completed(
     clusters: list[list[SubtitleEvent]],
     client: OllamaClient,
     workers: int,
     retry_config: RetryConfig | None = None,
-) -> Iterator[SubtitleEvent | None]:
+) -> Iterator[tuple[int, SubtitleEvent | None]]:
+    """Yield (index in clusters, event) as clusters are reconciled; event is None when it failed."""
     if retry_config is None:
         retry_config = RetryConfig()
+    coordinator = RetryCoordinator(retry_config, name="reconcile")
 
-    def process(cluster: list[SubtitleEvent]) -> SubtitleEvent | None:
+    async def process(cluster: list[SubtitleEvent]) -> SubtitleEvent | None:
         try:
-            return with_retry(lambda: _reconcile_cluster(cluster, client), retry_config, log)
+            return await with_retry_async(
+                lambda: _reconcile_cluster(cluster, client), retry_config, log, coordinator,
+            )
         except NonRetryable as e:
             log.warning(
                 "reconcile [cluster@%.3f] non-retryable: %s",
@@ -73,6 +82,13 @@ def reconcile_groups(
             log.warning("reconcile [cluster@%.3f] retries exhausted", cluster[0].start_time)
             return None
 
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        for result in executor.map(process, clusters):
-            yield result
+    yield from run_stage_unordered(clusters, process, workers)
+
+
+def reconcile_groups(
+    clusters: list[list[SubtitleEvent]],
+    client: OllamaClient,
+    workers: int,
+    retry_config: RetryConfig | None = None,
+) -> Iterator[SubtitleEvent | None]:
+    yield from in_order(reconcile_as_completed(clusters, client, workers, retry_config))
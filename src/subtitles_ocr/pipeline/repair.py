@@ -0,0 +1,162 @@
+# src/subtitles_ocr/pipeline/repair.py
+import dataclasses
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, TypeVar
+
+from subtitles_ocr.vlm.client import DecodingConfig
+from subtitles_ocr.vlm.prompt import FORMAT_REMINDER
+from subtitles_ocr.pipeline.retry import MalformedAnswer
+
+log = logging.getLogger(__name__)
+T = TypeVar("T")
+
+_CLOSERS = {"{": "}", "[": "]"}
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_WORD = re.compile(r"\w+")
+# What may follow the quote ending a string; a quote followed by anything else is part of the text
+_AFTER_STRING = re.compile(r"\s*(?:[,:}\]]|$)")
+
+
+def _parses(text: str) -> bool:
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+def _drop_trailing_comma(out: list[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def repair_json(raw: str) -> str | None:
+    """raw as valid JSON, if it is nearly JSON; None otherwise.
+
+    Prose or code fences around the first object or array are dropped,
+    single-quoted strings and Python literals are converted, trailing
+    commas are removed, and an answer that ends early is closed after its
+    last complete array item. Only for answers the model ended itself: one
+    cut off at max_tokens fails in the client with AnswerCutOff instead.
+    """
+    starts = [i for i in (raw.find("{"), raw.find("[")) if i >= 0]
+    if not starts:
+        return None
+    out: list[str] = []
+    stack: list[str] = []
+    # Where a cut-off answer can be closed: before the comma after an array item
+    cuts: list[tuple[int, tuple[str, ...]]] = []
+    quote: str | None = None
+    i = min(starts)
+    while i < len(raw):
+        c = raw[i]
+        if quote is not None:
+            if c == "\\" and i + 1 < len(raw):
+                out.append("'" if raw[i + 1] == "'" else raw[i:i + 2])
+                i += 2
+                continue
+            if c == quote and _AFTER_STRING.match(raw, i + 1):
+                out.append('"')
+                quote = None
+            elif c == '"':
+                out.append('\\"')
+            elif c == "\n":
+                out.append("\\n")
+            else:
+                out.append(c)
+        elif c in "\"'":
+            out.append('"')
+            quote = c
+        elif c in _CLOSERS:
+            out.append(c)
+            stack.append(_CLOSERS[c])
+        elif c in "}]":
+            if not stack or c != stack[-1]:
+                return None
+            _drop_trailing_comma(out)
+            out.append(stack.pop())
+            if not stack:
+                text = "".join(out)
+                return text if _parses(text) else None
+        elif c.isalpha():
+            word = _WORD.match(raw, i).group()
+            out.append(_PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            if c == "," and stack[-1] == "]":
+                cuts.append((len(out), tuple(stack)))
+            out.append(c)
+        i += 1
+
+    # Cut off: close it where it ends if that is right after a value, else after its last complete array item
+    candidates = cuts[::-1]
+    text = "".join(out).rstrip()
+    if quote is None and not text.endswith((",", ":", "[", "{")):
+        candidates.insert(0, (len(out), tuple(stack)))
+    for length, open_brackets in candidates:
+        text = "".join(out[:length]) + "".join(reversed(open_brackets))
+        if _parses(text):
+            return text
+    return None
+
+
+def loads_repaired(raw: str) -> Any:
+    """json.loads, falling back to repair_json; raises json.loads's error when raw cannot be repaired."""
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        repaired = repair_json(raw)
+        if repaired is None:
+            raise
+    log.debug("repaired malformed JSON %r → %r", raw, repaired)
+    return json.loads(repaired)
+
+
+@dataclass(frozen=True)
+class Rephrasing:
+    # Append FORMAT_REMINDER to the prompt
+    remind: bool = False
+    # Sample at this temperature instead of the request's
+    temperature: float | None = None
+
+
+# How a request is asked after each malformed answer: as is, then with a reminder of the format, then
+# sampled away from the answer that greedy decoding keeps giving
+REPHRASINGS = (Rephrasing(), Rephrasing(remind=True), Rephrasing(remind=True, temperature=0.7))
+
+
+class Escalation:
+    """Asks one element's request again at once, rephrased, after each malformed answer.
+
+    Sent again unchanged after a backoff, a request mostly gets the same
+    malformed answer back. Once every rephrasing got one, MalformedAnswer
+    is raised: retrying cannot help. The rephrasing reached is kept across
+    calls, so a retry after another error does not start over.
+    """
+
+    def __init__(self, label: str, rephrasings: tuple[Rephrasing, ...] = REPHRASINGS):
+        self.label = label
+        self.rephrasings = rephrasings
+        self.malformed = 0
+
+    async def ask(
+        self, request: Callable[[str, DecodingConfig], Awaitable[T]], prompt: str, decoding: DecodingConfig,
+    ) -> T:
+        """request(prompt, decoding), as rephrased for the malformed answers so far."""
+        while True:
+            rephrasing = self.rephrasings[self.malformed]
+            if rephrasing.temperature is not None:
+                decoding = dataclasses.replace(decoding, temperature=rephrasing.temperature)
+            try:
+                return await request(prompt + FORMAT_REMINDER if rephrasing.remind else prompt, decoding)
+            except ValueError as e:
+                self.malformed += 1
+                if self.malformed >= len(self.rephrasings):
+                    raise MalformedAnswer(f"{self.malformed} malformed answers") from e
+                log.info("%s malformed answer (%s), asking again rephrased", self.label, e)
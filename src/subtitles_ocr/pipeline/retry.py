@@ -1,23 +1,41 @@
 # src/subtitles_ocr/pipeline/retry.py
+import asyncio
 import logging
+import random
 import time
 from dataclasses import dataclass
-from typing import Callable, TypeVar
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, TypeVar
 
 from openai import (
-    APIConnectionError, RateLimitError, InternalServerError,
+    APIConnectionError, APIStatusError, RateLimitError, InternalServerError,
     AuthenticationError, PermissionDeniedError, NotFoundError, BadRequestError,
 )
 
 log = logging.getLogger(__name__)
 T = TypeVar("T")
 
+# Longer Retry-After values are ignored in favor of the backoff, as the OpenAI SDK does
+MAX_RETRY_AFTER = 60.0
+
 
 @dataclass
 class RetryConfig:
     max_attempts: int = 10
     base_delay: float = 1.0
     max_delay: float = 30.0
+    # Retries a stage's workers may make between them: budget, plus
+    # budget_ratio per element they were given
+    budget: int = 20
+    budget_ratio: float = 0.2
+    # Backend errors in a row (connection errors, 5xx) that open the circuit,
+    # and the wait before probing it, doubled after each failed probe
+    breaker_threshold: int = 5
+    probe_delay: float = 5.0
+    max_probe_delay: float = 60.0
+    # Seconds the circuit may stay open: past them, a failed probe gives the stage's remaining
+    # requests up with RetryExhausted instead of waiting for a backend that is not coming back
+    max_open: float = 600.0
 
 
 class RetryExhausted(Exception):
@@ -28,6 +46,10 @@ class NonRetryable(Exception):
     """Error that must not be retried."""
 
 
+class MalformedAnswer(NonRetryable):
+    """Answers that stayed malformed however the request was asked again."""
+
+
 _NON_RETRYABLE_TYPES = (
     OSError,
     AuthenticationError,
@@ -47,6 +69,167 @@ _RETRYABLE_TYPES = (
 )
 
 
+# Errors meaning the backend is unreachable or failing, as opposed to answering badly
+_BACKEND_DOWN_TYPES = (APIConnectionError, InternalServerError)
+# Errors meaning the backend answered
+_BACKEND_UP_TYPES = (APIStatusError, ValueError, RuntimeError, MalformedAnswer)
+
+
+def retry_after(error: Exception) -> float | None:
+    """The seconds an error response's Retry-After header (or retry-after-ms) asks to wait, if usable."""
+    if not isinstance(error, APIStatusError):
+        return None
+    headers = error.response.headers
+    try:
+        if (value := headers.get("retry-after-ms")) is not None:
+            seconds = float(value) / 1000
+        elif (value := headers.get("retry-after")) is not None:
+            try:
+                seconds = float(value)
+            except ValueError:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        else:
+            return None
+    except (ValueError, TypeError):
+        return None
+    return seconds if 0 <= seconds <= MAX_RETRY_AFTER else None
+
+
+class RetryCoordinator:
+    """Retry policy shared by all the workers of a stage.
+
+    Backoff delays are jittered, so workers failing together do not retry
+    together; a Retry-After header holds back every worker; retries past
+    the stage's budget are refused. After breaker_threshold backend errors
+    in a row the circuit opens: workers wait while one probe request at a
+    time tries the backend, and resume once one gets an answer. If none
+    has after max_open seconds, every waiting and later request raises
+    RetryExhausted until one does.
+    """
+
+    def __init__(self, config: RetryConfig, name: str = "", rng: random.Random | None = None):
+        self.config = config
+        self.name = name
+        self.requests = 0
+        self.retries = 0
+        self._rng = rng or random.Random()
+        self._failures = 0
+        self._resume_at = 0.0
+        # When the circuit is open, when the next probe may go
+        self._open_until: float | None = None
+        # When the circuit opened, probes failing since, and whether it stayed open too long
+        self._opened_at: float | None = None
+        self._given_up = False
+        self._probe_delay = config.probe_delay
+        self._probing = False
+        self._changed = asyncio.Event()
+
+    @property
+    def is_open(self) -> bool:
+        return self._open_until is not None
+
+    async def admit(self) -> bool:
+        """Wait until a request may be sent; True when it is to probe the open circuit."""
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while self._open_until is not None:
+            if self._given_up:
+                raise RetryExhausted(f"{self.name} backend down for over {self.config.max_open:.0f}s")
+            wait = self._open_until - time.monotonic()
+            if not self._probing and wait <= 0:
+                self._probing = True
+                return True
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), None if self._probing else wait)
+            except TimeoutError:
+                pass
+        return False
+
+    def record(self, error: BaseException | None, probe: bool = False) -> None:
+        """Record the outcome of a request admitted by admit()."""
+        if probe:
+            self._probing = False
+        if isinstance(error, _BACKEND_DOWN_TYPES):
+            self._failures += 1
+            if probe:
+                self._probe_delay = min(self._probe_delay * 2, self.config.max_probe_delay)
+                self._open(f"probe failed ({type(error).__name__})")
+            elif self._open_until is None and self._failures >= self.config.breaker_threshold:
+                self._open(f"{self._failures} backend errors in a row")
+        elif error is None or isinstance(error, _BACKEND_UP_TYPES):
+            self._failures = 0
+            if self._open_until is not None:
+                log.warning("%s backend answered, resuming", self.name)
+                self._open_until = None
+                self._opened_at = None
+                self._given_up = False
+                self._probe_delay = self.config.probe_delay
+                self._notify()
+        elif probe:
+            # Failed before telling anything about the backend: let another worker probe
+            self._notify()
+
+    def delay(self, backoff: float, error: Exception) -> float | None:
+        """The jittered delay before retrying after error, or None when the stage's retry budget is spent."""
+        if self.retries >= self.config.budget + self.config.budget_ratio * self.requests:
+            return None
+        self.retries += 1
+        delay = self._rng.uniform(0, backoff)
+        if (wait := retry_after(error)) is not None:
+            self._resume_at = max(self._resume_at, time.monotonic() + wait)
+            delay = max(delay, wait)
+        return delay
+
+    def _open(self, reason: str) -> None:
+        now = time.monotonic()
+        if self._opened_at is None:
+            self._opened_at = now
+        elif now - self._opened_at >= self.config.max_open:
+            self._given_up = True
+            log.warning("%s circuit open for %.0fs: %s, giving up", self.name, now - self._opened_at, reason)
+            self._notify()
+            return
+        self._open_until = now + self._probe_delay
+        log.warning("%s circuit open: %s, pausing workers, probing in %.0fs", self.name, reason, self._probe_delay)
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+def _retry_delay(
+    attempt: int,
+    config: RetryConfig,
+    error: Exception,
+    logger: logging.Logger,
+    coordinator: RetryCoordinator | None = None,
+) -> float | None:
+    """Log a failed attempt; the delay before the next one, or None when none is left."""
+    if attempt < config.max_attempts - 1:
+        delay = min(config.base_delay * (2 ** attempt), config.max_delay)
+        if coordinator is not None:
+            delay = coordinator.delay(delay, error)
+            if delay is None:
+                logger.warning(
+                    "Attempt %d/%d failed (%s): %s — stage retry budget spent",
+                    attempt + 1, config.max_attempts, type(error).__name__, error,
+                )
+                return None
+        logger.warning(
+            "Attempt %d/%d failed (%s): %s — retrying in %.1fs",
+            attempt + 1, config.max_attempts, type(error).__name__, error, delay,
+        )
+        return delay
+    logger.warning(
+        "Attempt %d/%d failed (%s): %s — retries exhausted",
+        attempt + 1, config.max_attempts, type(error).__name__, error,
+    )
+    return None
+
+
 def with_retry(
     fn: Callable[[], T],
     config: RetryConfig,
@@ -60,16 +243,55 @@ def with_retry(
             raise NonRetryable(str(e)) from e
         except _RETRYABLE_TYPES as e:
             last_error = e
-            if attempt < config.max_attempts - 1:
-                delay = min(config.base_delay * (2 ** attempt), config.max_delay)
-                logger.warning(
-                    "Attempt %d/%d failed (%s): %s — retrying in %.1fs",
-                    attempt + 1, config.max_attempts, type(e).__name__, e, delay,
-                )
+            delay = _retry_delay(attempt, config, e, logger)
+            if delay is not None:
                 time.sleep(delay)
-            else:
-                logger.warning(
-                    "Attempt %d/%d failed (%s): %s — retries exhausted",
-                    attempt + 1, config.max_attempts, type(e).__name__, e,
-                )
+    raise RetryExhausted(f"All {config.max_attempts} attempts failed") from last_error
+
+
+async def with_retry_async(
+    fn: Callable[[], Awaitable[T]],
+    config: RetryConfig,
+    logger: logging.Logger = log,
+    coordinator: RetryCoordinator | None = None,
+) -> T:
+    """with_retry for a coroutine function, sleeping without blocking the event loop.
+
+    With a coordinator, attempts wait for its circuit to close, delays are
+    its jittered ones, and a failed probe of the circuit is not counted as
+    one of this call's attempts.
+    """
+    if coordinator is not None:
+        coordinator.requests += 1
+    last_error: Exception | None = None
+    attempt = 0
+    while attempt < config.max_attempts:
+        probe = await coordinator.admit() if coordinator is not None else False
+        try:
+            result = await fn()
+        except _NON_RETRYABLE_TYPES as e:
+            if coordinator is not None:
+                coordinator.record(e, probe)
+            raise NonRetryable(str(e)) from e
+        except _RETRYABLE_TYPES as e:
+            last_error = e
+            if coordinator is not None:
+                coordinator.record(e, probe)
+                if probe and coordinator.is_open:
+                    continue
+            delay = _retry_delay(attempt, config, e, logger, coordinator)
+            if delay is None:
+                if attempt < config.max_attempts - 1:
+                    raise RetryExhausted(f"Retry budget of stage {coordinator.name!r} spent") from e
+                break
+            attempt += 1
+            await asyncio.sleep(delay)
+        except BaseException as e:
+            if coordinator is not None:
+                coordinator.record(e, probe)
+            raise
+        else:
+            if coordinator is not None:
+                coordinator.record(None, probe)
+            return result
     raise RetryExhausted(f"All {config.max_attempts} attempts failed") from last_error
@@ -0,0 +1,95 @@
+# src/subtitles_ocr/pipeline/runner.py
+import asyncio
+import queue
+import threading
+from typing import Awaitable, Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """The event loop every stage's requests run on, in a daemon thread started on first use.
+
+    Clients share one loop so they can share one HTTP connection pool.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="inference-loop", daemon=True).start()
+        return _loop
+
+
+def run_stage_unordered(
+    items: Iterable[T],
+    process: Callable[[T], Awaitable[R]],
+    concurrency: int,
+    window: int | None = None,
+) -> Iterator[tuple[int, R]]:
+    """Yield (index, process(item)) for each item as soon as it completes.
+
+    Up to concurrency items are in flight at once, and items are only
+    started while fewer than window (by default twice concurrency) are
+    started but not yet yielded, so a slow item holds back neither the
+    results behind it nor memory. The coroutines run on event_loop(); the
+    caller's thread only waits for results. An exception raised by process
+    is raised here, and closing the generator cancels what is still running.
+    """
+    if window is None:
+        window = 2 * concurrency
+    loop = event_loop()
+    results: queue.Queue = queue.Queue()
+    window_slots = asyncio.Semaphore(max(window, concurrency))
+
+    async def run_all() -> None:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(index: int, item: T) -> None:
+            async with semaphore:
+                try:
+                    results.put((index, await process(item), None))
+                except Exception as e:
+                    results.put((index, None, e))
+
+        tasks = set()
+        try:
+            for index, item in enumerate(items):
+                await window_slots.acquire()
+                task = asyncio.create_task(run_one(index, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            while tasks:
+                await asyncio.gather(*tasks)
+        except Exception as e:
+            results.put((None, None, e))
+        finally:
+            for task in tasks:
+                task.cancel()
+            results.put(None)
+
+    running = asyncio.run_coroutine_threadsafe(run_all(), loop)
+    try:
+        while (entry := results.get()) is not None:
+            index, result, error = entry
+            if error is not None:
+                raise error
+            loop.call_soon_threadsafe(window_slots.release)
+            yield index, result
+    finally:
+        running.cancel()
+
+
+def in_order(pairs: Iterable[tuple[int, R]]) -> Iterator[R]:
+    """The results of (index, result) pairs, in index order from 0."""
+    done: dict[int, R] = {}
+    next_index = 0
+    for index, result in pairs:
+        done[index] = result
+        while next_index in done:
+            yield done.pop(next_index)
+            next_index += 1
+
@@ -0,0 +1,129 @@
+# src/subtitles_ocr/pipeline/segments.py
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from subtitles_ocr.models import Frame, FrameGroup, VideoInfo
+from subtitles_ocr.pipeline.extract import StreamConfig, stream_kept_strips
+from subtitles_ocr.pipeline.filter import EdgeMap, iter_edge_groups, strips_edge_maps
+
+# A picklable callable producing the (frame, edge map) pairs of one segment.
+# It is called once in a worker, and again in the parent if its seam needs repair.
+EdgeMapSource = Callable[[], Iterable[tuple[Frame, EdgeMap]]]
+
+
+@dataclass
+class SegmentResult:
+    groups: list[FrameGroup]
+    last_edges: EdgeMap | None
+
+
+def split_time_range(duration: float, count: int, start: float = 0.0) -> list[tuple[float, float | None]]:
+    """Split [start, duration) into count equal segments; the last one is open-ended."""
+    bounds = [start + (duration - start) * i / count for i in range(count)]
+    return [(start, end) for start, end in zip(bounds, [*bounds[1:], None])]
+
+
+def split_frames(frames: list[Frame], count: int) -> list[list[Frame]]:
+    size, extra = divmod(len(frames), count)
+    chunks: list[list[Frame]] = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(frames[start:end])
+        start = end
+    return chunks
+
+
+def stream_segment_edge_maps(
+    video_path: Path,
+    video_info: VideoInfo,
+    frames_dir: Path,
+    start: float,
+    end: float | None,
+    skip_ranges: list[tuple[float, float]],
+    config: StreamConfig,
+) -> Iterator[tuple[Frame, EdgeMap]]:
+    yield from strips_edge_maps(
+        stream_kept_strips(video_path, video_info, frames_dir, skip_ranges, start, end, config)
+    )
+
+
+def group_segment(source: EdgeMapSource, diff_threshold: float) -> SegmentResult:
+    groups: list[FrameGroup] = []
+    last_edges: EdgeMap | None = None
+    for group, edges in iter_edge_groups(source(), diff_threshold):
+        groups.append(group)
+        last_edges = edges
+    return SegmentResult(groups=groups, last_edges=last_edges)
+
+
+def _repair_seam(
+    stitched: list[FrameGroup],
+    open_group: tuple[FrameGroup, EdgeMap],
+    result: SegmentResult,
+    source: EdgeMapSource,
+    diff_threshold: float,
+) -> tuple[FrameGroup, EdgeMap]:
+    """Continue open_group into the next segment, appending closed groups to stitched.
+
+    The segment was grouped from its own first frame; its groups become valid as
+    soon as the continued walk opens a group on a frame that also starts one of
+    them, since grouping from a given first frame onwards no longer depends on
+    what came before. Returns the group left open at the end of the segment.
+    """
+    own_starts = {g.start_time: i for i, g in enumerate(result.groups)}
+    edge_maps = source()
+    previous: tuple[FrameGroup, EdgeMap] = open_group
+    try:
+        for group, edges in iter_edge_groups(edge_maps, diff_threshold, open_group=open_group):
+            if group.start_time != open_group[0].start_time:
+                stitched.append(previous[0])
+            index = own_starts.get(group.start_time)
+            if index is not None:
+                assert result.last_edges is not None
+                stitched.extend(result.groups[index:-1])
+                return result.groups[-1], result.last_edges
+            previous = (group, edges)
+    finally:
+        close = getattr(edge_maps, "close", None)
+        if close is not None:
+            close()
+    return previous
+
+
+def stitch_segments(
+    results: list[SegmentResult],
+    sources: list[EdgeMapSource],
+    diff_threshold: float,
+) -> list[FrameGroup]:
+    """Join per-segment groups into exactly what one sequential pass would produce."""
+    stitched: list[FrameGroup] = []
+    open_group: tuple[FrameGroup, EdgeMap] | None = None
+    for result, source in zip(results, sources):
+        if not result.groups:
+            continue
+        if open_group is None:
+            assert result.last_edges is not None
+            stitched.extend(result.groups[:-1])
+            open_group = (result.groups[-1], result.last_edges)
+        else:
+            open_group = _repair_seam(stitched, open_group, result, source, diff_threshold)
+    if open_group is not None:
+        stitched.append(open_group[0])
+    return stitched
+
+
+def compute_groups_segmented(
+    sources: list[EdgeMapSource],
+    diff_threshold: float,
+    workers: int,
+) -> list[FrameGroup]:
+    """Group each segment in its own process, then stitch the seams in this one."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        results = list(executor.map(group_segment, sources, repeat(diff_threshold)))
+    return stitch_segments(results, sources, diff_threshold)
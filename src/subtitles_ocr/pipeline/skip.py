@@ -61,11 +61,38 @@ def normalize_ranges(ranges: list[tuple[float, float]]) -> list[tuple[float, flo
     return result
 
 
+def is_skipped(timestamp: float, skip_ranges: list[tuple[float, float]]) -> bool:
+    """Return True if timestamp falls within any skip range (inclusive)."""
+    return any(start <= timestamp <= end for start, end in skip_ranges)
+
+
 def filter_frames(frames: list[Frame], skip_ranges: list[tuple[float, float]]) -> list[Frame]:
     """Return frames whose timestamp does not fall within any skip range (inclusive)."""
     if not skip_ranges:
         return frames
-    return [
-        f for f in frames
-        if not any(start <= f.timestamp <= end for start, end in skip_ranges)
-    ]
+    return [f for f in frames if not is_skipped(f.timestamp, skip_ranges)]
+
+
+def kept_windows(
+    skip_ranges: list[tuple[float, float]],
+    start: float = 0.0,
+    end: float | None = None,
+) -> list[tuple[float, float | None]]:
+    """Return the parts of [start, end) outside the normalized skip ranges.
+
+    Windows begin at a range's end, whose own frame is still skipped (ranges are
+    inclusive), so callers must keep filtering with is_skipped.
+    """
+    windows: list[tuple[float, float | None]] = []
+    cursor = start
+    for range_start, range_end in skip_ranges:
+        if end is not None and range_start >= end:
+            break
+        if range_end < cursor:
+            continue
+        if range_start > cursor:
+            windows.append((cursor, range_start))
+        cursor = max(cursor, range_end)
+    if end is None or cursor < end:
+        windows.append((cursor, end))
+    return windows
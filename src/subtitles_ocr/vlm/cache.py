@@ -0,0 +1,106 @@
+# src/subtitles_ocr/vlm/cache.py
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 100_000
+# Eviction runs once every this many stores rather than on each one
+EVICT_EVERY = 100
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def request_key(request: dict) -> str:
+    """Hash of a completion request: model, messages (images included) and decoding params."""
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+class InferenceCache:
+    """Completions keyed by request_key, in one SQLite file shared by runs and processes.
+
+    Entries past max_entries are evicted least recently used first. An
+    answer the caller rejects is dropped with invalidate, so that the next
+    lookup asks the model again.
+    """
+
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._stats: dict[str, CacheStats] = {}
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, content TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+
+    def get(self, key: str, stage: str) -> str | None:
+        with self._lock:
+            stats = self._stats.setdefault(stage, CacheStats())
+            row = self._conn.execute("SELECT content FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                stats.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            stats.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, content, last_used) VALUES (?, ?, ?)",
+                (key, content, time.time()),
+            )
+            self._stores += 1
+            if self._stores % EVICT_EVERY == 0:
+                self._evict()
+
+    def invalidate(self, key: str, stage: str) -> None:
+        """Drop the answer get just served for key, rejected by the caller: that lookup counts as a miss."""
+        with self._lock:
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            stats = self._stats.setdefault(stage, CacheStats())
+            if stats.hits:
+                stats.hits -= 1
+                stats.misses += 1
+
+    def _evict(self) -> None:
+        deleted = self._conn.execute(
+            "DELETE FROM completions WHERE key IN "
+            "(SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        if deleted:
+            log.debug("cache %s: evicted %d entries", self.path.name, deleted)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def stats(self) -> dict[str, CacheStats]:
+        with self._lock:
+            return {stage: CacheStats(s.hits, s.misses) for stage, s in self._stats.items()}
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._conn.close()
@@ -1,19 +1,140 @@
+import asyncio
 import base64
 import logging
+import time
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
 
-from openai import OpenAI
+import httpx
+from openai import (
+    APIConnectionError, APITimeoutError, AsyncOpenAI, DefaultAsyncHttpxClient, InternalServerError, RateLimitError,
+)
+
+from subtitles_ocr.vlm.cache import InferenceCache, request_key
+from subtitles_ocr.vlm.concurrency import AdaptiveConcurrency
+from subtitles_ocr.vlm.router import Backend, BackendRouter, LatencyTracker
 
 log = logging.getLogger(__name__)
 
+# Connections kept open to the inference server, shared by every client
+HTTP_MAX_CONNECTIONS = 512
+HTTP_KEEPALIVE_EXPIRY = 60.0
+
+_http_client: httpx.AsyncClient | None = None
+
+
+def shared_http_client() -> httpx.AsyncClient:
+    """The connection pool all clients send through, created on first use."""
+    global _http_client
+    if _http_client is None:
+        _http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _http_client
+
+
+class AnswerCutOff(ValueError):
+    """An answer that stopped at max_tokens instead of ending: retried, as a malformed one is."""
+
+
+@dataclass(frozen=True)
+class DecodingConfig:
+    # JSON schema the server constrains the answer to, when it supports structured outputs
+    schema: dict | None = None
+    # Generation stops after max_tokens, or at the first stop sequence, left out of the answer
+    max_tokens: int | None = None
+    stop: tuple[str, ...] = ()
+    # None leaves sampling to the server
+    temperature: float | None = None
+
+    def params(self) -> dict:
+        """The completion request parameters; none for DecodingConfig().
+
+        A request's parameters are part of its cache key: answers cached
+        under other decoding settings are not served for it.
+        """
+        params: dict = {}
+        if self.schema is not None:
+            params["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": self.schema.get("title", "answer"), "schema": self.schema},
+            }
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.stop:
+            params["stop"] = list(self.stop)
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
 
 class OllamaClient:
-    def __init__(self, model: str, host: str = "http://localhost:11434"):
+    """Requests are coroutines, to await on pipeline.runner's event loop: the shared pool is bound to it.
+
+    File reads, cache lookups and request hashing run in worker threads, so
+    that a cache file locked by another job holds back no other request.
+
+    With backends, requests are spread over those servers instead of host
+    (see BackendRouter). A request taking longer than timeout fails with
+    APITimeoutError. With hedge and several backends, a request not back
+    by the model's p95 latency is sent again to another backend, in a
+    limiter slot of its own, and the first answer wins.
+
+    With validate, an answer is checked before it is cached, and a cached
+    one before it is served: an answer validate raises ValueError for is
+    never cached, and a cached one is dropped and asked for again.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        host: str = "http://localhost:11434",
+        cache: InferenceCache | None = None,
+        stage: str | None = None,
+        http_client: httpx.AsyncClient | None = None,
+        limiter: AdaptiveConcurrency | None = None,
+        backends: list[Backend] | None = None,
+        timeout: float | None = None,
+        hedge: bool = False,
+    ):
         self.model = model
-        self._client = OpenAI(base_url=f"{host}/v1", api_key="ollama")
+        # Label the cache's hit rates are reported under
+        self.stage = stage or model
+        self._cache = cache
+        self.limiter = limiter
+        self.router = BackendRouter(backends or [Backend(host)], name=self.stage)
+        self.timeout = timeout
+        self.hedge = hedge and len(self.router.backends) > 1
+        self.latency = LatencyTracker()
+        self.hedged = 0
+        self.hedges_won = 0
+        self._clients = [
+            AsyncOpenAI(
+                base_url=f"{backend.url}/v1", api_key="ollama", http_client=http_client or shared_http_client(),
+                # Retries are the pipeline's, coordinated across a stage's requests
+                max_retries=0,
+            )
+            for backend in self.router.backends
+        ]
+
+    async def analyze(
+        self, image_path: Path, prompt: str = "", system: str = "", decoding: DecodingConfig = DecodingConfig(),
+        validate: Callable[[str], object] | None = None,
+    ) -> str:
+        return await self.analyze_image(
+            await asyncio.to_thread(image_path.read_bytes), prompt, system, decoding, validate,
+        )
 
-    def analyze(self, image_path: Path, prompt: str = "", system: str = "") -> str:
-        image_data = image_path.read_bytes()
+    async def analyze_image(
+        self, image_data: bytes, prompt: str = "", system: str = "", decoding: DecodingConfig = DecodingConfig(),
+        validate: Callable[[str], object] | None = None,
+    ) -> str:
+        """analyze() for a JPEG already in memory."""
         b64 = base64.b64encode(image_data).decode()
         messages = []
         if system:
@@ -22,26 +143,112 @@ class OllamaClient:
         if prompt:
             user_content.insert(0, {"type": "text", "text": prompt})
         messages.append({"role": "user", "content": user_content})
-        response = self._client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-        )
-        content = response.choices[0].message.content
-        if not content:
-            log.debug("Empty response from %s — full response: %r", self.model, response)
-            raise RuntimeError(f"Ollama returned no text content ({self.model})")
-        return content
+        return await self._complete(validate, model=self.model, messages=messages, **decoding.params())
 
-    def chat(self, prompt: str, system: str) -> str:
-        response = self._client.chat.completions.create(
+    async def chat(
+        self, prompt: str, system: str, decoding: DecodingConfig = DecodingConfig(),
+        validate: Callable[[str], object] | None = None,
+    ) -> str:
+        return await self._complete(
+            validate,
             model=self.model,
             messages=[
                 {"role": "system", "content": system},
                 {"role": "user", "content": prompt},
             ],
+            **decoding.params(),
         )
-        content = response.choices[0].message.content
+
+    async def _attempt(self, request: dict, sent: list[tuple[int, float]], exclude: int | None = None):
+        """One send of request, in its own limiter slot; (backend index, send time) is appended to sent."""
+        if self.limiter is None:
+            return await self._post(request, sent, exclude)
+        async with self.limiter.slot():
+            start = time.monotonic()
+            try:
+                response = await self._post(request, sent, exclude)
+            except (RateLimitError, InternalServerError, APIConnectionError) as e:  # timeouts included
+                self.limiter.overloaded(type(e).__name__)
+                raise
+            self.limiter.completed(time.monotonic() - start)
+            return response
+
+    async def _post(self, request: dict, sent: list[tuple[int, float]], exclude: int | None):
+        async with self.router.backend(exclude) as index:
+            sent.append((index, time.monotonic()))
+            model = self.router.backends[index].model
+            if model is not None:
+                request = {**request, "model": model}
+            try:
+                async with asyncio.timeout(self.timeout):
+                    return await self._clients[index].chat.completions.create(**request)
+            except TimeoutError:
+                url = self.router.backends[index].url
+                log.debug("%s request to %s timed out after %ss", self.model, url, self.timeout)
+                raise APITimeoutError(request=httpx.Request("POST", f"{url}/v1/chat/completions")) from None
+
+    async def _send(self, request: dict):
+        """The first answer to request; its latency, from the first send, is recorded whichever send won."""
+        sent: list[tuple[int, float]] = []
+        delay = self.latency.p95 if self.hedge else None
+        if delay is None:
+            response = await self._attempt(request, sent)
+            self.latency.add(time.monotonic() - sent[0][1])
+            return response
+        primary = asyncio.create_task(self._attempt(request, sent))
+        tasks = {primary}
+        try:
+            await asyncio.wait(tasks, timeout=delay)
+            if primary.done() or not sent:
+                # Back in time, or still waiting for a backend, where a duplicate would wait too
+                response = await primary
+                self.latency.add(time.monotonic() - sent[0][1])
+                return response
+            self.hedged += 1
+            hedge = asyncio.create_task(self._attempt(request, [], exclude=sent[0][0]))
+            tasks.add(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # The primary first: a hedge done at the same time did not win
+                for task in (primary, hedge):
+                    if task in done and not task.cancelled() and task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                        # The request took this long, however much sooner the hedge answered
+                        self.latency.add(time.monotonic() - sent[0][1])
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _complete(self, validate: Callable[[str], object] | None = None, **request) -> str:
+        key = None
+        if self._cache is not None:
+            # Hashing the image and waiting for the cache file's lock both happen off the shared loop
+            key = await asyncio.to_thread(request_key, request)
+            cached = await asyncio.to_thread(self._cache.get, key, self.stage)
+            if cached is not None:
+                try:
+                    if validate is not None:
+                        validate(cached)
+                    return cached
+                except ValueError as e:
+                    log.debug("%s cached answer rejected (%s), asking again", self.model, e)
+                    await asyncio.to_thread(self._cache.invalidate, key, self.stage)
+        response = await self._send(request)
+        choice = response.choices[0]
+        content = choice.message.content
         if not content:
             log.debug("Empty response from %s — full response: %r", self.model, response)
             raise RuntimeError(f"Ollama returned no text content ({self.model})")
+        if choice.finish_reason == "length":
+            # However well it parses, a cut-off answer is missing its end: not worth keeping
+            log.debug("%s answer cut off at max_tokens: %r", self.model, content)
+            raise AnswerCutOff(f"{self.model} answer cut off at {request.get('max_tokens')} tokens")
+        if validate is not None:
+            validate(content)
+        if key is not None:
+            await asyncio.to_thread(self._cache.put, key, content)
         return content
@@ -0,0 +1,121 @@
+# src/subtitles_ocr/vlm/concurrency.py
+import asyncio
+import logging
+import statistics
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AdaptiveConfig:
+    initial: int = 4
+    minimum: int = 1
+    maximum: int = 64
+    # Additive step up, and factor the limit is multiplied by on overload
+    increase: int = 1
+    decrease: float = 0.7
+    # A window's throughput must beat the one of the last step up by this much to keep growing
+    min_gain: float = 0.05
+    # Median latency over the lowest seen that counts as a latency spike
+    latency_tolerance: float = 2.0
+    # Completions per window, at least; a window is otherwise as long as the limit
+    min_window: int = 4
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the requests in flight to one model, tuned from their outcomes.
+
+    Each window of completions, the limit grows by one while throughput rises
+    and latency stays near the lowest seen, and is cut back on a latency
+    spike; an overload error (429, 5xx, timeout) cuts it back at once, at
+    most once per window since requests already in flight fail together.
+    """
+
+    def __init__(self, config: AdaptiveConfig, name: str = "", clock: Callable[[], float] = time.monotonic):
+        self.config = config
+        self.name = name
+        self.limit = max(config.minimum, min(config.initial, config.maximum))
+        self.peak = self.limit
+        self.completed_requests = 0
+        self._clock = clock
+        self._in_flight = 0
+        self._condition: asyncio.Condition | None = None
+        self._first_start: float | None = None
+        self._last_done: float | None = None
+        self._window: list[float] = []
+        self._window_start: float | None = None
+        self._previous_throughput: float | None = None
+        self._base_latency: float | None = None
+        self._decreased_this_window = False
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the limit's slots for the duration of a request."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        now = self._clock()
+        if self._first_start is None:
+            self._first_start = now
+        if self._window_start is None:
+            self._window_start = now
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    @property
+    def throughput(self) -> float:
+        """Completed requests per second since the first one started."""
+        if self._first_start is None or self._last_done is None or self._last_done <= self._first_start:
+            return 0.0
+        return self.completed_requests / (self._last_done - self._first_start)
+
+    def completed(self, latency: float) -> None:
+        now = self._clock()
+        self.completed_requests += 1
+        self._last_done = now
+        self._window.append(latency)
+        if len(self._window) < max(self.limit, self.config.min_window):
+            return
+        median = statistics.median(self._window)
+        elapsed = now - self._window_start if self._window_start is not None else 0.0
+        throughput = len(self._window) / elapsed if elapsed > 0 else None
+        self._window = []
+        self._window_start = now
+        self._decreased_this_window = False
+        if self._base_latency is None or median < self._base_latency:
+            self._base_latency = median
+        if median > self._base_latency * self.config.latency_tolerance:
+            self._set_limit(round(self.limit * self.config.decrease), f"latency spike ({median:.2f}s)")
+            self._previous_throughput = None
+        elif throughput is not None and (
+            self._previous_throughput is None
+            or throughput > self._previous_throughput * (1 + self.config.min_gain)
+        ):
+            # Later windows must beat the throughput that justified this step
+            self._set_limit(self.limit + self.config.increase, f"{throughput:.2f} requests/s")
+            self._previous_throughput = throughput
+
+    def overloaded(self, reason: str) -> None:
+        if self._decreased_this_window:
+            return
+        self._decreased_this_window = True
+        self._set_limit(round(self.limit * self.config.decrease), reason)
+        self._previous_throughput = None
+
+    def _set_limit(self, limit: int, reason: str) -> None:
+        limit = max(self.config.minimum, min(limit, self.config.maximum))
+        if limit == self.limit:
+            return
+        log.info("%s concurrency %d → %d (%s)", self.name, self.limit, limit, reason)
+        self.limit = limit
+        self.peak = max(self.peak, limit)
@@ -1,21 +1,29 @@
-SYSTEM_PROMPT = """\
-You are analyzing a video frame from a Japanese anime series with French subtitles added by a fansub group.
+def _analysis_prompt(image: str, positions: bool) -> str:
+    """The analysis system prompt for image; with positions, subtitles are asked for their position too."""
+    example_position = ', "position": "..."' if positions else ""
+    position_field = (
+        '- "position": "top" if the subtitle appears in the top half of the frame, '
+        '"bottom" if in the bottom half (string) — default: "bottom"\n'
+        if positions else ""
+    )
+    return f"""\
+You are analyzing {image} from a Japanese anime series with French subtitles added by a fansub group.
 
 Extract ALL French subtitle text visible in this image. Do NOT extract:
 - Japanese text (kanji, hiragana, katakana, romaji signs in the scene)
 - Text that is part of the original animation artwork
 - French translations of in-scene text (signs, posters, props, backgrounds)
 
-Return ONLY a raw JSON object — no markdown, no code fences, no explanation. Start your response with { and end with }. Use this exact format:
-{"subtitles": [{"text": "...", "style": "...", "color": "...", "position": "..."}, ...]}
-If no French subtitles are visible, return: {"subtitles": []}
+Return ONLY a raw JSON object — no markdown, no code fences, no explanation. \
+Start your response with {{ and end with }}. Use this exact format:
+{{"subtitles": [{{"text": "...", "style": "...", "color": "..."{example_position}}}, ...]}}
+If no French subtitles are visible, return: {{"subtitles": []}}
 
 Each element in the "subtitles" array must be a JSON object with these fields:
 - "text": exact text content (string) — REQUIRED
 - "style": one of "regular", "italic" (string) — default: "regular"
 - "color": text fill color name chosen from the palette below (string) — default: "white"
-- "position": "top" if the subtitle appears in the top half of the frame, "bottom" if in the bottom half (string) — default: "bottom"
-
+{position_field}
 Color palette — use the name, not the hex value:
 - white (#FFFFFF)
 - yellow (#FFFF00)
@@ -26,11 +34,80 @@ If the color does not match any palette entry, use "other".
 Never include the same subtitle text more than once in the array.\
 """
 
+
+SYSTEM_PROMPT = _analysis_prompt("a video frame", positions=True)
+STRIP_SYSTEM_PROMPT = _analysis_prompt(
+    "a horizontal strip cropped from the top or bottom edge of a video frame", positions=False,
+)
+
 PREFILTER_PROMPT = 'Is there text visible in this image? Return only a JSON object: {"has_text": true} or {"has_text": false}.'
 
+PREFILTER_BATCH_PROMPT = """\
+This image stacks {count} tiles vertically, separated by magenta bars, the first one at the top. \
+Each tile shows the top and bottom edges of a different video frame. \
+For each tile, in order, is there text visible in it? \
+Return only a JSON array of {count} booleans, one per tile, e.g. [true, false, ...].\
+"""
+
 RECONCILE_PROMPT = """\
 You are correcting OCR errors in French subtitle text.
 You will receive multiple readings of the same subtitle from different video frames.
 The readings are noisy — individual words may be wrong, but the overall structure is preserved.
 Return ONLY the single most likely correct text. No explanation, no surrounding quotes, no added punctuation.\
 """
+
+# Appended to a prompt whose answer could not be parsed, when asking again
+FORMAT_REMINDER = """
+
+Your previous answer to this could not be parsed. Answer again with the JSON only, exactly in the format asked for: \
+no code fences, no explanation, nothing before or after it.\
+"""
+
+# JSON schemas the answers to the prompts above are constrained to, where the server supports it
+
+PREFILTER_SCHEMA = {
+    "title": "prefilter",
+    "type": "object",
+    "properties": {"has_text": {"type": "boolean"}},
+    "required": ["has_text"],
+}
+
+
+def prefilter_batch_schema(count: int) -> dict:
+    return {
+        "title": "prefilter_batch",
+        "type": "array",
+        "items": {"type": "boolean"},
+        "minItems": count,
+        "maxItems": count,
+    }
+
+
+_SUBTITLE_PROPERTIES = {
+    "text": {"type": "string"},
+    "style": {"type": "string", "enum": ["regular", "italic"]},
+    "color": {"type": "string", "enum": ["white", "yellow", "cyan", "other"]},
+    "position": {"type": "string", "enum": ["top", "bottom"]},
+}
+
+
+def _subtitles_schema(title: str, fields: list[str]) -> dict:
+    return {
+        "title": title,
+        "type": "object",
+        "properties": {
+            "subtitles": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {field: _SUBTITLE_PROPERTIES[field] for field in fields},
+                    "required": fields,
+                },
+            },
+        },
+        "required": ["subtitles"],
+    }
+
+
+SUBTITLES_SCHEMA = _subtitles_schema("subtitles", ["text", "style", "color", "position"])
+STRIP_SUBTITLES_SCHEMA = _subtitles_schema("strip_subtitles", ["text", "style", "color"])
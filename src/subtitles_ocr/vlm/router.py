@@ -0,0 +1,173 @@
+# src/subtitles_ocr/vlm/router.py
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
+from openai import APIConnectionError, InternalServerError
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Backend:
+    url: str
+    # Requests the server takes at once; None leaves it to the stage's concurrency
+    max_parallel_requests: int | None = None
+    # Name the server knows the model by, when not the client's (a LiteLLM alias); None sends the client's
+    model: str | None = None
+
+
+@dataclass(frozen=True)
+class RouterConfig:
+    # Connection errors or 5xx in a row that eject a backend, and for how long;
+    # a backend failing again right after re-admission is ejected twice as long
+    eject_after: int = 3
+    eject_for: float = 10.0
+    max_eject_for: float = 300.0
+
+
+@dataclass
+class BackendStats:
+    url: str
+    in_flight: int = 0
+    completed: int = 0
+    failed: int = 0
+    ejections: int = 0
+    first_start: float | None = None
+    last_done: float | None = None
+
+    @property
+    def throughput(self) -> float:
+        """Completed requests per second since the first one started."""
+        if self.first_start is None or self.last_done is None or self.last_done <= self.first_start:
+            return 0.0
+        return self.completed / (self.last_done - self.first_start)
+
+
+class BackendRouter:
+    """Spreads one model's requests over the servers running it.
+
+    A request goes to the healthy backend with the fewest requests in flight
+    for its max_parallel_requests, waiting while every one is full. A backend
+    failing eject_after times in a row is ejected for a while, then
+    re-admitted on trial: one more failure ejects it again. While every
+    backend is ejected, requests go to the one due back first.
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        config: RouterConfig = RouterConfig(),
+        name: str = "",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not backends:
+            raise ValueError("a router needs at least one backend")
+        self.backends = backends
+        self.config = config
+        self.name = name
+        self.stats = [BackendStats(backend.url) for backend in backends]
+        self._clock = clock
+        self._failures = [0] * len(backends)
+        self._ejected_until: list[float | None] = [None] * len(backends)
+        self._on_trial = [False] * len(backends)
+        self._eject_for = [config.eject_for] * len(backends)
+        self._condition: asyncio.Condition | None = None
+
+    def is_ejected(self, index: int) -> bool:
+        until = self._ejected_until[index]
+        return until is not None and self._clock() < until
+
+    def _has_room(self, index: int) -> bool:
+        limit = self.backends[index].max_parallel_requests
+        return limit is None or self.stats[index].in_flight < limit
+
+    def _load(self, index: int) -> tuple[float, int]:
+        in_flight = self.stats[index].in_flight
+        return in_flight / (self.backends[index].max_parallel_requests or 1), in_flight
+
+    def _pick(self, exclude: int | None) -> int | None:
+        indices = [i for i in range(len(self.backends)) if i != exclude]
+        healthy = [i for i in indices if not self.is_ejected(i)]
+        if not healthy:
+            # Rather than stall: the backend due back first, as if re-admitted
+            healthy = [min(indices, key=lambda i: self._ejected_until[i])]
+        free = [i for i in healthy if self._has_room(i)]
+        return min(free, key=self._load) if free else None
+
+    @asynccontextmanager
+    async def backend(self, exclude: int | None = None) -> AsyncIterator[int]:
+        """Hold a request slot on the backend to send to, by its index in backends, other than exclude."""
+        if exclude is not None and len(self.backends) < 2:
+            raise ValueError("no backend other than the excluded one")
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while (index := self._pick(exclude)) is None:
+                await self._condition.wait()
+            stats = self.stats[index]
+            stats.in_flight += 1
+        if stats.first_start is None:
+            stats.first_start = self._clock()
+        try:
+            yield index
+        except (APIConnectionError, InternalServerError) as e:
+            self._failed(index, e)
+            raise
+        else:
+            self._succeeded(index)
+        finally:
+            async with self._condition:
+                stats.in_flight -= 1
+                self._condition.notify_all()
+
+    def _succeeded(self, index: int) -> None:
+        stats = self.stats[index]
+        stats.completed += 1
+        stats.last_done = self._clock()
+        self._failures[index] = 0
+        if self._on_trial[index]:
+            log.info("%s backend %s back", self.name, stats.url)
+            self._on_trial[index] = False
+            self._eject_for[index] = self.config.eject_for
+
+    def _failed(self, index: int, error: Exception) -> None:
+        stats = self.stats[index]
+        stats.failed += 1
+        if self.is_ejected(index):
+            return
+        self._failures[index] += 1
+        if not self._on_trial[index] and self._failures[index] < self.config.eject_after:
+            return
+        if self._on_trial[index]:
+            self._eject_for[index] = min(self._eject_for[index] * 2, self.config.max_eject_for)
+        self._on_trial[index] = True
+        self._failures[index] = 0
+        self._ejected_until[index] = self._clock() + self._eject_for[index]
+        stats.ejections += 1
+        log.warning(
+            "%s backend %s ejected for %.0fs (%s)", self.name, stats.url, self._eject_for[index], type(error).__name__,
+        )
+
+
+class LatencyTracker:
+    """Latencies of a model's latest successful requests, for a running p95."""
+
+    def __init__(self, window: int = 256, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=window)
+
+    def add(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    @property
+    def p95(self) -> float | None:
+        """None until min_samples requests succeeded."""
+        if len(self._latencies) < self.min_samples:
+            return None
+        return statistics.quantiles(self._latencies, n=20, method="inclusive")[-1]
@@ -1,12 +1,21 @@
 # tests/test_analyze.py
+import asyncio
+import io
 import json
 import logging
 import pytest
+import threading
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, patch
+from PIL import Image, ImageDraw, ImageFont
 from subtitles_ocr.models import FrameGroup, SubtitleElement
-from subtitles_ocr.pipeline.analyze import analyze_group, analyze_groups, parse_elements
+from subtitles_ocr.pipeline.analyze import (
+    ANALYZE_DECODING, analyze_as_completed, analyze_group, analyze_group_strips, analyze_groups, parse_elements,
+)
+from subtitles_ocr.pipeline.fingerprint import TextMaskIndex
 from subtitles_ocr.pipeline.retry import RetryConfig
+from subtitles_ocr.vlm.client import AnswerCutOff, DecodingConfig
+from subtitles_ocr.vlm.prompt import STRIP_SUBTITLES_SCHEMA
 
 VALID_ELEMENT = {
     "text": "Bonjour",
@@ -137,9 +146,15 @@ def test_parse_elements_does_not_strip_unclosed_code_fence():
         parse_elements('```json\n{"subtitles": []}')  # no closing ```
 
 
+def test_parse_elements_repairs_when_asked():
+    assert parse_elements('```json\n{"subtitles": []}', repair=True) == []
+    raw = '{"subtitles": [{"text": "Bonjour"}, {"text": "Au rev'
+    assert [el.text for el in parse_elements(raw, repair=True)] == ["Bonjour"]
+
+
 def test_analyze_groups_does_not_retry_empty_object():
     """When model returns {}, accept it as no-subtitle frame on the first attempt; do not retry."""
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = "{}"
     result = list(analyze_groups([_group()], [True], client, "p", workers=1, retry_config=_no_retry()))
     assert len(result) == 1
@@ -151,34 +166,34 @@ def test_analyze_groups_does_not_retry_empty_object():
 # --- analyze_group ---
 
 def test_analyze_group_returns_correct_timing():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_EMPTY
-    analysis = analyze_group(_group(), client, prompt="p")
+    analysis = asyncio.run(analyze_group(_group(), client, prompt="p"))
     assert analysis.start_time == 1.0
     assert analysis.end_time == 2.5
 
 
 def test_analyze_group_parses_elements():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_VALID
-    analysis = analyze_group(_group(), client, prompt="p")
+    analysis = asyncio.run(analyze_group(_group(), client, prompt="p"))
     assert len(analysis.elements) == 1
     assert analysis.elements[0].text == "Bonjour"
 
 
 def test_analyze_group_logs_raw_at_debug(caplog):
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_EMPTY
     with caplog.at_level(logging.DEBUG, logger="subtitles_ocr.pipeline.analyze"):
-        analyze_group(_group(), client, prompt="p")
+        asyncio.run(analyze_group(_group(), client, prompt="p"))
     assert any("raw →" in r.message and r.levelno == logging.DEBUG for r in caplog.records)
 
 
 def test_analyze_group_logs_no_elements(caplog):
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_EMPTY
     with caplog.at_level(logging.INFO, logger="subtitles_ocr.pipeline.analyze"):
-        analyze_group(_group(), client, prompt="p")
+        asyncio.run(analyze_group(_group(), client, prompt="p"))
     info_msgs = [r.message for r in caplog.records if r.levelno == logging.INFO]
     assert len(info_msgs) == 1
     assert "(no elements)" in info_msgs[0]
@@ -186,40 +201,49 @@ def test_analyze_group_logs_no_elements(caplog):
 
 def test_analyze_group_passes_prompt_as_system():
     """Instructions belong in the system role — Qwen2.5-VL follows them more reliably there."""
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_EMPTY
-    analyze_group(_group(), client, prompt="my system prompt")
+    asyncio.run(analyze_group(_group(), client, prompt="my system prompt"))
     _, kwargs = client.analyze.call_args
     assert kwargs.get("system") == "my system prompt"
 
 
 def test_analyze_group_does_not_use_json_mode():
     """json_mode=True triggers Ollama's grammar-constraint bug with qwen2.5vl — must not be used."""
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_EMPTY
-    analyze_group(_group(), client, prompt="p")
+    asyncio.run(analyze_group(_group(), client, prompt="p"))
     _, kwargs = client.analyze.call_args
     assert kwargs.get("json_mode", False) is False
 
 
+def test_analyze_group_caps_tokens_without_a_schema_by_default():
+    client = AsyncMock()
+    client.analyze.return_value = WRAPPED_EMPTY
+    asyncio.run(analyze_group(_group(), client, prompt="p"))
+    decoding = client.analyze.call_args.kwargs["decoding"]
+    assert decoding == ANALYZE_DECODING
+    assert decoding.schema is None and decoding.max_tokens is not None
+
+
 def test_analyze_group_propagates_client_error():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.side_effect = RuntimeError("model failed")
     with pytest.raises(RuntimeError, match="model failed"):
-        analyze_group(_group(), client, prompt="p")
+        asyncio.run(analyze_group(_group(), client, prompt="p"))
 
 
 def test_analyze_group_propagates_parse_error():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = "not json"
     with pytest.raises(json.JSONDecodeError):
-        analyze_group(_group(), client, prompt="p")
+        asyncio.run(analyze_group(_group(), client, prompt="p"))
 
 
 # --- analyze_groups ---
 
 def test_analyze_groups_skips_vlm_when_no_text():
-    client = MagicMock()
+    client = AsyncMock()
     group = _group()
     result = list(analyze_groups([group], [False], client, "p", workers=1, retry_config=_no_retry()))
     assert len(result) == 1
@@ -229,7 +253,7 @@ def test_analyze_groups_skips_vlm_when_no_text():
 
 
 def test_analyze_groups_calls_vlm_when_has_text():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_VALID
     result = list(analyze_groups([_group()], [True], client, "p", workers=1, retry_config=_no_retry()))
     assert len(result) == 1
@@ -238,30 +262,30 @@ def test_analyze_groups_calls_vlm_when_has_text():
 
 
 def test_analyze_groups_yields_none_on_exhausted_retries():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.side_effect = RuntimeError("model failed")
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(analyze_groups([_group()], [True], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [None]
 
 
 def test_analyze_groups_logs_warning_on_failure(caplog):
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.side_effect = RuntimeError("model failed")
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         with caplog.at_level(logging.WARNING, logger="subtitles_ocr.pipeline.analyze"):
             list(analyze_groups([_group()], [True], client, "p", workers=1, retry_config=_no_retry()))
     assert any(r.levelno == logging.WARNING for r in caplog.records)
 
 
 def test_analyze_groups_error_on_one_does_not_block_others():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.side_effect = [RuntimeError("fail"), WRAPPED_VALID]
     groups = [
         FrameGroup(start_time=1.0, end_time=2.0, frame=Path("frames/a.jpg")),
         FrameGroup(start_time=3.0, end_time=4.0, frame=Path("frames/b.jpg")),
     ]
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(analyze_groups(groups, [True, True], client, "p", workers=1, retry_config=_no_retry()))
     assert result[0] is None
     assert result[1] is not None
@@ -269,7 +293,7 @@ def test_analyze_groups_error_on_one_does_not_block_others():
 
 
 def test_analyze_groups_preserves_order():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_EMPTY
     groups = [
         FrameGroup(start_time=1.0, end_time=2.0, frame=Path("frames/a.jpg")),
@@ -281,7 +305,7 @@ def test_analyze_groups_preserves_order():
 
 
 def test_analyze_groups_mixed_filter():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.return_value = WRAPPED_VALID
     groups = [_group(), _group(), _group()]
     result = list(analyze_groups(groups, [False, True, False], client, "p", workers=1, retry_config=_no_retry()))
@@ -293,18 +317,18 @@ def test_analyze_groups_mixed_filter():
 
 
 def test_analyze_groups_empty_returns_empty():
-    client = MagicMock()
+    client = AsyncMock()
     result = list(analyze_groups([], [], client, "p", workers=1, retry_config=_no_retry()))
     assert result == []
 
 
 def test_analyze_groups_retries_on_garbage_output():
     """When model returns garbage (no 'subtitles' key), retry and succeed on second attempt."""
-    client = MagicMock()
+    client = AsyncMock()
     garbage = json.dumps({"]0E@#@$&,FB8$.-B2=A3F766=E+*9*)?2AC@3#1F9B.0": "#)8#-.:"})
     client.analyze.side_effect = [garbage, WRAPPED_VALID]
     retry_config = RetryConfig(max_attempts=2)
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(analyze_groups([_group()], [True], client, "p", workers=1, retry_config=retry_config))
     assert result[0] is not None
     assert len(result[0].elements) == 1
@@ -312,8 +336,161 @@ def test_analyze_groups_retries_on_garbage_output():
 
 
 def test_analyze_groups_yields_none_on_non_retryable():
-    client = MagicMock()
+    client = AsyncMock()
     client.analyze.side_effect = OSError("disk error")
     result = list(analyze_groups([_group()], [True], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [None]
     assert client.analyze.call_count == 1
+
+
+# --- strip crops ---
+
+def _subtitled_frame(tmp_path: Path, top: str | None = None, bottom: str | None = None) -> FrameGroup:
+    img = Image.new("RGB", (960, 540), (40, 60, 90))
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=40)
+    for text, y in ((top, 30), (bottom, 460)):
+        if text:
+            draw.text((200, y), text, font=font, fill="white", stroke_width=3, stroke_fill="black")
+    path = tmp_path / "000024.jpg"
+    img.save(path, quality=95)
+    return FrameGroup(start_time=1.0, end_time=2.5, frame=path)
+
+
+def test_analyze_group_strips_sends_only_the_flagged_strip(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.return_value = json.dumps({"subtitles": [{"text": "Bonjour"}]})
+    result = asyncio.run(analyze_group_strips(_subtitled_frame(tmp_path, top="Bonjour"), client, "p"))
+    client.analyze_image.assert_called_once()
+    crop = Image.open(io.BytesIO(client.analyze_image.call_args.args[0]))
+    assert crop.size == (960, 108)
+    assert [(el.text, el.position) for el in result.elements] == [("Bonjour", "top")]
+    client.analyze.assert_not_called()
+
+
+def test_analyze_group_strips_sends_both_strips_when_none_flagged(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.side_effect = [WRAPPED_EMPTY, json.dumps({"subtitles": [VALID_ELEMENT | {"position": "top"}]})]
+    result = asyncio.run(analyze_group_strips(_subtitled_frame(tmp_path), client, "p"))
+    assert client.analyze_image.call_count == 2
+    assert [el.position for el in result.elements] == ["bottom"]
+
+
+def test_analyze_groups_crop_strips_uses_strip_crops(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.return_value = WRAPPED_VALID
+    group = _subtitled_frame(tmp_path, top="Haut", bottom="Bas")
+    result = list(analyze_groups([group], [True], client, "p", workers=1, retry_config=_no_retry(), crop_strips=True))
+    assert [el.position for el in result[0].elements] == ["top", "bottom"]
+    client.analyze.assert_not_called()
+
+
+def test_analyze_groups_passes_decoding_to_every_strip_request(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.return_value = WRAPPED_VALID
+    group = _subtitled_frame(tmp_path, top="Haut", bottom="Bas")
+    decoding = DecodingConfig(schema=STRIP_SUBTITLES_SCHEMA, max_tokens=256)
+    list(analyze_groups(
+        [group], [True], client, "p", workers=1, retry_config=_no_retry(), crop_strips=True, decoding=decoding,
+    ))
+    assert [call.kwargs["decoding"] for call in client.analyze_image.call_args_list] == [decoding, decoding]
+
+
+
+def test_analyze_groups_asks_again_only_for_the_strip_with_a_malformed_answer(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.side_effect = [WRAPPED_VALID, "Sorry, I cannot", WRAPPED_VALID]
+    group = _subtitled_frame(tmp_path, top="Haut", bottom="Bas")
+    result = list(analyze_groups([group], [True], client, "p", workers=1, retry_config=_no_retry(), crop_strips=True))
+    assert [el.position for el in result[0].elements] == ["top", "bottom"]
+    top, bottom, bottom_again = (call.args[0] for call in client.analyze_image.call_args_list)
+    assert bottom_again == bottom != top
+
+# --- text mask dedup ---
+
+def test_analyze_groups_dedup_reuses_analysis_of_same_subtitle(tmp_path):
+    client = AsyncMock()
+    client.analyze.return_value = WRAPPED_VALID
+    group = _subtitled_frame(tmp_path, bottom="Bonjour")
+    later = FrameGroup(start_time=7.0, end_time=8.0, frame=group.frame)
+    index = TextMaskIndex()
+    result = list(analyze_groups([group, later], [True, True], client, "p", workers=2, retry_config=_no_retry(),
+                                 dedup=index))
+    client.analyze.assert_called_once()
+    assert (result[1].start_time, result[1].end_time) == (7.0, 8.0)
+    assert result[1].elements == result[0].elements
+    assert index.reused == 1
+
+
+def test_analyze_groups_dedup_skips_groups_without_text(tmp_path):
+    client = AsyncMock()
+    client.analyze.return_value = WRAPPED_VALID
+    group = _subtitled_frame(tmp_path, bottom="Bonjour")
+    result = list(analyze_groups([group, group], [False, True], client, "p", workers=1, retry_config=_no_retry(),
+                                 dedup=TextMaskIndex()))
+    assert result[0].elements == []
+    assert len(result[1].elements) == 1
+
+
+
+def test_analyze_groups_dedup_analyzes_again_when_the_matched_analysis_failed(tmp_path):
+    client = AsyncMock()
+    client.analyze.side_effect = [ConnectionError("down"), WRAPPED_VALID]
+    group = _subtitled_frame(tmp_path, bottom="Bonjour")
+    later = FrameGroup(start_time=7.0, end_time=8.0, frame=group.frame)
+    index = TextMaskIndex()
+    result = list(analyze_groups([group, later], [True, True], client, "p", workers=2, retry_config=_no_retry(),
+                                 dedup=index))
+    # Whichever group got the failure, the other one was analyzed, not handed the failure
+    assert sorted(analysis is None for analysis in result) == [False, True]
+    assert client.analyze.call_count == 2
+    assert index.reused == 0
+
+
+def test_analyze_groups_dedup_computes_masks_off_the_caller_thread(tmp_path):
+    client = AsyncMock()
+    client.analyze.return_value = WRAPPED_VALID
+    group = _subtitled_frame(tmp_path, bottom="Bonjour")
+    index = TextMaskIndex()
+    threads = []
+    mask = index.mask
+    def recording_mask(g):
+        threads.append(threading.get_ident())
+        return mask(g)
+    index.mask = recording_mask
+    groups = analyze_as_completed([group], [True], client, "p", workers=1, retry_config=_no_retry(), dedup=index)
+    assert threads == []
+    list(groups)
+    assert threads and threading.get_ident() not in threads
+
+def test_analyze_groups_asks_again_at_once_after_a_malformed_answer():
+    client = AsyncMock()
+    client.analyze.side_effect = ["Bonjour", "still not JSON", WRAPPED_VALID]
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep") as sleep:
+        result = list(analyze_groups([_group()], [True], client, "p", workers=1))
+    assert result[0].elements[0].text == "Bonjour"
+    sleep.assert_not_called()
+    prompts = [call.kwargs["system"] for call in client.analyze.call_args_list]
+    assert prompts[0] == "p" and prompts[1].startswith("p") and prompts[1] != "p"
+    assert client.analyze.call_args.kwargs["decoding"].temperature is not None
+
+
+def test_analyze_groups_fails_a_group_malformed_every_way_without_retrying():
+    client = AsyncMock()
+    client.analyze.return_value = "not json"
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep") as sleep:
+        result = list(analyze_groups([_group()], [True], client, "p", workers=1))
+    assert result == [None]
+    assert client.analyze.call_count == 3
+    sleep.assert_not_called()
+
+
+def test_analysis_cut_off_at_the_token_cap_is_asked_again_not_repaired():
+    client = AsyncMock()
+    two_lines = json.dumps({"subtitles": [VALID_ELEMENT, {**VALID_ELEMENT, "text": "Au revoir"}]})
+    client.analyze.side_effect = [AnswerCutOff("cut off at 2048 tokens"), two_lines]
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep") as sleep:
+        result = list(analyze_groups([_group()], [True], client, "p", workers=1))
+    assert [el.text for el in result[0].elements] == ["Bonjour", "Au revoir"]
+    assert client.analyze.call_args.kwargs["system"] != "p"
+    sleep.assert_not_called()
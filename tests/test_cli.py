@@ -1,9 +1,12 @@
 import json
 from pathlib import Path
 from unittest.mock import patch
+import numpy as np
 from click.testing import CliRunner
 from subtitles_ocr.cli import _read_jsonl, cli, _resolve_workers, FILTER_WORKERS_DEFAULT
-from subtitles_ocr.models import FrameAnalysis
+from subtitles_ocr.models import Frame, FrameAnalysis, FrameGroup, VideoInfo
+from subtitles_ocr.pipeline.filter import DiffRecorder
+from subtitles_ocr.vlm.prompt import STRIP_SUBTITLES_SCHEMA, STRIP_SYSTEM_PROMPT
 
 
 def test_read_jsonl_returns_empty_when_file_missing(tmp_path):
@@ -44,8 +47,8 @@ def test_extract_skipped_when_manifest_exists(tmp_path):
     video, workdir = _minimal_workdir(tmp_path)
     with patch("subtitles_ocr.cli.extract_frames") as mock_extract, \
          patch("subtitles_ocr.cli.compute_groups", return_value=[]), \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=[]), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=[]), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=[]), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=[]), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
     mock_extract.assert_not_called()
@@ -58,8 +61,8 @@ def test_phash_skipped_when_groups_exist(tmp_path):
 
     with patch("subtitles_ocr.cli.extract_frames"), \
          patch("subtitles_ocr.cli.compute_groups") as mock_compute, \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=iter([False])), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
     mock_compute.assert_not_called()
@@ -78,8 +81,8 @@ def test_prefilter_is_called_with_all_groups(tmp_path):
 
     with patch("subtitles_ocr.cli.extract_frames"), \
          patch("subtitles_ocr.cli.compute_groups"), \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=iter([False, False])) as mock_pf, \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False, False]))) as mock_pf, \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
     mock_pf.assert_called_once()
@@ -117,8 +120,8 @@ def test_analyze_resumes_from_existing_analysis(tmp_path):
 
     with patch("subtitles_ocr.cli.extract_frames"), \
          patch("subtitles_ocr.cli.compute_groups"), \
-         patch("subtitles_ocr.cli.prefilter_groups"), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([fake_analysis])) as mock_analyze, \
+         patch("subtitles_ocr.cli.prefilter_as_completed"), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([fake_analysis]))) as mock_analyze, \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
 
@@ -138,15 +141,15 @@ def test_prefilter_writes_results_incrementally(tmp_path):
         "\n".join(json.dumps(g) for g in groups) + "\n", encoding="utf-8"
     )
 
-    def partial_prefilter(groups, client, prompt, workers, retry_config=None):
-        yield False
-        yield True
+    def partial_prefilter(groups, client, prompt, workers, retry_config=None, batch_size=1, thumbnail_width=768):
+        yield 0, False
+        yield 1, True
         raise RuntimeError("simulated crash")
 
     with patch("subtitles_ocr.cli.extract_frames"), \
          patch("subtitles_ocr.cli.compute_groups"), \
-         patch("subtitles_ocr.cli.prefilter_groups", side_effect=partial_prefilter), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", side_effect=partial_prefilter), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
 
@@ -154,8 +157,108 @@ def test_prefilter_writes_results_incrementally(tmp_path):
     assert len(filter_lines) == 2
 
 
+def _workdir_with_groups(tmp_path: Path, count: int) -> tuple[Path, Path]:
+    video, workdir = _minimal_workdir(tmp_path)
+    groups = [
+        {"start_time": float(i), "end_time": float(i + 1), "frame": f"frames/{i:06d}.jpg"}
+        for i in range(count)
+    ]
+    (workdir / "003-groups.jsonl").write_text(
+        "\n".join(json.dumps(g) for g in groups) + "\n", encoding="utf-8"
+    )
+    return video, workdir
+
+
+def test_analyses_written_as_completed_are_grouped_in_order(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 3)
+    analyses = [FrameAnalysis(start_time=float(i), end_time=float(i + 1), elements=[]) for i in range(3)]
+    with patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True] * 3))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter([(2, analyses[2]), (0, analyses[0]), (1, analyses[1])])), \
+         patch("subtitles_ocr.cli.group_events", return_value=[]) as mock_group, \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--no-local-prefilter",
+        ])
+    assert result.exit_code == 0, result.output
+    written = [json.loads(line)["id"] for line in _read_jsonl(workdir / "005-analysis.jsonl")]
+    assert written == ["frames/000002.jpg", "frames/000000.jpg", "frames/000001.jpg"]
+    assert mock_group.call_args.args[0] == analyses
+
+
+def test_local_prefilter_sends_only_unsure_groups_to_vlm(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 3)
+    with patch("subtitles_ocr.cli.local_prefilter_groups", return_value=iter([False, None, True])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True]))) as mock_prefilter, \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
+    assert result.exit_code == 0, result.output
+    assert [g.frame.name for g in mock_prefilter.call_args[0][0]] == ["000001.jpg"]
+    lines = {d["id"]: d for d in map(json.loads, _read_jsonl(workdir / "004-filter.jsonl"))}
+    assert lines["frames/000000.jpg"] == {"id": "frames/000000.jpg", "has_text": False, "engine": "local"}
+    assert lines["frames/000001.jpg"] == {"id": "frames/000001.jpg", "has_text": True, "engine": "vlm"}
+    assert lines["frames/000002.jpg"]["engine"] == "local"
+
+
+def test_no_local_prefilter_sends_every_group_to_vlm(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 2)
+    with patch("subtitles_ocr.cli.local_prefilter_groups") as mock_local, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True, False]))) as mock_prefilter, \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--no-local-prefilter",
+        ])
+    assert result.exit_code == 0, result.output
+    mock_local.assert_not_called()
+    assert len(mock_prefilter.call_args[0][0]) == 2
+
+
+def test_filter_image_width_is_passed_to_prefilter(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    with patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False]))) as mock_prefilter, \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--filter-image-width", "512",
+        ])
+    assert result.exit_code == 0, result.output
+    assert mock_prefilter.call_args.kwargs["thumbnail_width"] == 512
+
+
+def test_analyze_strips_uses_the_strip_prompt(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    with patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))) as mock_analyze, \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--analyze-strips",
+        ])
+    assert result.exit_code == 0, result.output
+    assert mock_analyze.call_args.args[3] == STRIP_SYSTEM_PROMPT
+    assert mock_analyze.call_args.kwargs["crop_strips"] is True
+    assert mock_analyze.call_args.kwargs["decoding"].schema is None
+
+
+def test_analyze_schema_matches_the_strip_prompt(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    with patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))) as mock_analyze, \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--analyze-strips", "--analyze-schema", "--analyze-max-tokens", "512",
+        ])
+    assert result.exit_code == 0, result.output
+    decoding = mock_analyze.call_args.kwargs["decoding"]
+    assert decoding.schema == STRIP_SUBTITLES_SCHEMA
+    assert decoding.max_tokens == 512
+
+
 def test_failed_prefilter_element_not_written_to_jsonl(tmp_path):
-    """None results from prefilter_groups are not written to filter.jsonl."""
+    """None results from prefilter_as_completed are not written to filter.jsonl."""
     video, workdir = _minimal_workdir(tmp_path)
 
     groups = [
@@ -168,8 +271,10 @@ def test_failed_prefilter_element_not_written_to_jsonl(tmp_path):
 
     with patch("subtitles_ocr.cli.extract_frames"), \
          patch("subtitles_ocr.cli.compute_groups"), \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=iter([True, None])), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", side_effect=[
+             iter(enumerate([True, None])), iter(enumerate([None])),
+         ]), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
 
@@ -178,14 +283,59 @@ def test_failed_prefilter_element_not_written_to_jsonl(tmp_path):
     assert len(filter_lines) == 1  # only the successful one
 
 
+def test_failed_groups_are_retried_at_the_end_of_the_step(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 3)
+    with patch("subtitles_ocr.cli.prefilter_as_completed", side_effect=[
+             iter([(1, None), (0, False), (2, None)]), iter([(1, False), (0, False)]),
+         ]) as mock_prefilter, \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--no-local-prefilter",
+        ])
+    assert result.exit_code == 0, result.output
+    groups = mock_prefilter.call_args_list[0].args[0]
+    assert mock_prefilter.call_args_list[1].args[0] == [groups[1], groups[2]]
+    assert len(_read_jsonl(workdir / "004-filter.jsonl")) == 3
+    assert not (workdir / "failures.jsonl").exists()
+
+
+def test_groups_failing_again_are_reported_then_abort_the_run(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 2)
+    (workdir / "004-filter.jsonl").write_text("".join(
+        json.dumps({"id": g["frame"], "has_text": True}) + "\n"
+        for g in map(json.loads, _read_jsonl(workdir / "003-groups.jsonl"))
+    ), encoding="utf-8")
+    analysis = FrameAnalysis(start_time=0.0, end_time=1.0, elements=[])
+    with patch("subtitles_ocr.cli.OllamaClient") as MockClient, \
+         patch("subtitles_ocr.cli._echo_concurrency"), \
+         patch("subtitles_ocr.cli.analyze_as_completed", side_effect=[
+             iter([(0, analysis), (1, None)]), iter([(0, None)]),
+         ]) as mock_analyze:
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--analyze-fallback-model", "qwen2.5vl:7b",
+        ])
+    assert result.exit_code != 0
+    assert "failures.jsonl" in result.output
+    assert [call.kwargs["model"] for call in MockClient.call_args_list] == ["qwen3-vl:4b", "qwen2.5vl:7b"]
+    assert mock_analyze.call_args_list[1].args[2] is MockClient.return_value
+    failures = [json.loads(line) for line in _read_jsonl(workdir / "failures.jsonl")]
+    assert failures == [{
+        "step": 5, "stage": "analyze", "id": str(mock_analyze.call_args_list[0].args[0][1].frame),
+        "models": ["qwen3-vl:4b", "qwen2.5vl:7b"],
+    }]
+    assert len(_read_jsonl(workdir / "005-analysis.jsonl")) == 1
+
+
 def test_inference_url_propagated_to_clients(tmp_path):
     video, workdir = _minimal_workdir(tmp_path)
     fake_group = {"start_time": 0.0, "end_time": 1.0, "frame": "frames/000001.jpg"}
     (workdir / "003-groups.jsonl").write_text(json.dumps(fake_group) + "\n", encoding="utf-8")
 
     with patch("subtitles_ocr.cli.OllamaClient") as MockClient, \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=iter([False])), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
          patch("subtitles_ocr.cli.group_events", return_value=[]), \
          patch("subtitles_ocr.cli.fuzzy_group_events", return_value=[]), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
@@ -195,7 +345,81 @@ def test_inference_url_propagated_to_clients(tmp_path):
         ])
 
     for call in MockClient.call_args_list:
-        assert call.kwargs["host"] == "http://proxy:4000"
+        assert [backend.url for backend in call.kwargs["backends"]] == ["http://proxy:4000"]
+
+
+def test_litellm_backends_route_each_model_to_its_servers(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    config = tmp_path / "litellm.yaml"
+    config.write_text(json.dumps({"model_list": [
+        {"model_name": model, "litellm_params": {"api_base": url, "max_parallel_requests": limit}}
+        for model, url, limit in [
+            ("llava:7b", "http://big:11434", 2),
+            ("qwen3-vl:4b", "http://big:11434", 2),
+            ("qwen3-vl:4b", "http://small:11434/v1", 1),
+            ("gemma3:1b-it-qat", "http://small:11434", 4),
+        ]
+    ]}), encoding="utf-8")
+    with patch("subtitles_ocr.cli.OllamaClient") as MockClient, \
+         patch("subtitles_ocr.cli._echo_concurrency"), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--litellm-config", str(config), "--litellm-backends",
+        ])
+    assert result.exit_code == 0, result.output
+    backends = {call.kwargs["model"]: call.kwargs["backends"] for call in MockClient.call_args_list}
+    assert [(b.url, b.max_parallel_requests) for b in backends["qwen3-vl:4b"]] == [
+        ("http://big:11434", 2), ("http://small:11434", 1),
+    ]
+    assert [b.url for b in backends["llava:7b"]] == ["http://big:11434"]
+
+
+def test_timeouts_and_hedging_reach_each_stage_client(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    with patch("subtitles_ocr.cli.OllamaClient") as MockClient, \
+         patch("subtitles_ocr.cli._echo_concurrency"), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([True]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--filter-timeout", "5", "--analyze-timeout", "90", "--hedge",
+        ])
+    assert result.exit_code == 0, result.output
+    options = {call.kwargs["stage"]: call.kwargs for call in MockClient.call_args_list}
+    assert options["prefilter"]["timeout"] == 5.0
+    assert options["analyze"]["timeout"] == 90.0
+    assert options["analyze"]["hedge"] is True
+
+
+def test_litellm_backends_need_a_config(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--litellm-backends"])
+    assert result.exit_code != 0
+    assert "--litellm-config" in result.output
+
+
+def test_cache_file_shared_by_clients_and_reported(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    cache_file = tmp_path / "cache.sqlite"
+
+    def fake_prefilter(groups, client, *args, **kwargs):
+        client._cache.get("key", client.stage)
+        return iter([(0, False)])
+
+    with patch("subtitles_ocr.cli.prefilter_as_completed", side_effect=fake_prefilter), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--cache-file", str(cache_file),
+        ])
+    assert result.exit_code == 0, result.output
+    assert cache_file.exists()
+    assert "prefilter: 0/1 hits (0%)" in result.output
 
 
 def test_resolve_workers_explicit_wins(tmp_path):
@@ -235,8 +459,8 @@ def test_skip_filters_frames_in_range(tmp_path):
 
     with patch("subtitles_ocr.cli.extract_frames"), \
          patch("subtitles_ocr.cli.compute_groups", return_value=[]), \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=[]), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=[]), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=[]), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=[]), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         result = CliRunner().invoke(cli, [
             str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--skip", "0-1",
@@ -263,8 +487,8 @@ def test_retry_options_accepted(tmp_path):
     """--retry-max-attempts, --retry-base-delay, --retry-max-delay are accepted."""
     video, workdir = _minimal_workdir(tmp_path)
     with patch("subtitles_ocr.cli.compute_groups", return_value=[]), \
-         patch("subtitles_ocr.cli.prefilter_groups", return_value=iter([])), \
-         patch("subtitles_ocr.cli.analyze_groups", return_value=iter([])), \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
          patch("subtitles_ocr.cli.build_ass_content", return_value=""):
         result = CliRunner().invoke(cli, [
             str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
@@ -273,3 +497,269 @@ def test_retry_options_accepted(tmp_path):
             "--retry-max-delay", "15.0",
         ])
     assert result.exit_code == 0, result.output
+
+
+def test_retry_budget_and_breaker_reach_the_stages(tmp_path):
+    video, workdir = _workdir_with_groups(tmp_path, 1)
+    with patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False]))) as mock_prefilter, \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--no-local-prefilter", "--retry-budget", "0.5", "--breaker-threshold", "3",
+        ])
+    assert result.exit_code == 0, result.output
+    retry_config = mock_prefilter.call_args.args[4]
+    assert retry_config.budget_ratio == 0.5
+    assert retry_config.breaker_threshold == 3
+
+
+def test_stream_mode_groups_streamed_frames_without_manifest(tmp_path):
+    video = tmp_path / "v.mkv"
+    video.write_bytes(b"fake")
+    workdir = tmp_path / "workdir"
+    info = VideoInfo(width=1920, height=1080, fps=24.0)
+    fake_group = FrameGroup(start_time=0.0, end_time=1.0, frame=Path("frames/000001.jpg"))
+
+    with patch("subtitles_ocr.cli.get_video_info", return_value=info), \
+         patch("subtitles_ocr.cli.stream_kept_strips", return_value=iter([])) as mock_stream, \
+         patch("subtitles_ocr.cli.compute_stream_groups", return_value=[fake_group]) as mock_group, \
+         patch("subtitles_ocr.pipeline.extract.extract_representatives") as mock_representatives, \
+         patch("subtitles_ocr.cli.extract_frames") as mock_extract, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--extract-mode", "stream",
+        ])
+
+    assert result.exit_code == 0, result.output
+    mock_extract.assert_not_called()
+    mock_stream.assert_called_once()
+    mock_group.assert_called_once()
+    mock_representatives.assert_called_once_with(video, info, [fake_group])
+    assert not (workdir / "001-manifest.json").exists()
+    assert (workdir / "001-video_info.json").exists()
+    assert len(_read_jsonl(workdir / "003-groups.jsonl")) == 1
+
+
+def test_decimate_requires_stream_mode(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    result = CliRunner().invoke(cli, [
+        str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--decimate",
+    ])
+    assert result.exit_code != 0
+    assert "--extract-mode stream" in result.output
+
+
+def test_sample_fps_sets_compute_groups_step(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    with patch("subtitles_ocr.cli.compute_groups", return_value=[]) as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--sample-fps", "4",
+        ])
+    assert result.exit_code == 0, result.output
+    assert mock_compute.call_args.kwargs["sample_step"] == 6
+
+
+def test_decode_scale_defaults_and_passes_to_compute_groups(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    with patch("subtitles_ocr.cli.compute_groups", return_value=[]) as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
+        assert result.exit_code == 0, result.output
+        assert mock_compute.call_args.kwargs["decode_scale"] == 1
+        (workdir / "003-groups.jsonl").unlink()
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--decode-scale", "4",
+        ])
+    assert result.exit_code == 0, result.output
+    assert mock_compute.call_args.kwargs["decode_scale"] == 4
+
+
+def _sidecar_with_two_changes(decode_scale: int = 1):
+    recorder = DiffRecorder(4.0, 16.0, decode_scale)
+    frames = [Frame(path=Path(f"frames/{i:06d}.jpg"), timestamp=float(i)) for i in range(1, 4)]
+    levels = [0, 10, 30]  # diffs to the first frame: 10 and 30 (times the scale gain)
+    for frame, level in zip(frames, levels):
+        recorder.add(frame, np.full((2, 2), level, dtype=np.uint8))
+    return recorder.sidecar()
+
+
+def test_groups_recomputed_from_diff_sidecar_without_edge_maps(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    _sidecar_with_two_changes().save(workdir / "003-diffs.npz")
+    with patch("subtitles_ocr.cli.compute_groups") as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False, False]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--edge-diff-threshold", "10",
+        ])
+    assert result.exit_code == 0, result.output
+    mock_compute.assert_not_called()
+    assert len(_read_jsonl(workdir / "003-groups.jsonl")) == 2
+
+
+
+def test_sidecar_recorded_with_other_skip_ranges_is_not_reused(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    _sidecar_with_two_changes().save(workdir / "003-diffs.npz")
+    with patch("subtitles_ocr.cli.compute_groups", return_value=[]) as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--edge-diff-threshold", "10", "--skip", "0:10-0:20",
+        ])
+    assert result.exit_code == 0, result.output
+    mock_compute.assert_called_once()
+
+
+def test_edge_differences_are_recorded_only_when_asked(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    with patch("subtitles_ocr.cli.compute_groups", return_value=[]) as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
+        assert result.exit_code == 0, result.output
+        assert mock_compute.call_args.kwargs["recorder"] is None
+        assert not (workdir / "003-diffs.npz").exists()
+        (workdir / "003-groups.jsonl").unlink()
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--record-diffs",
+        ])
+    assert result.exit_code == 0, result.output
+    assert mock_compute.call_args.kwargs["recorder"].extract_mode == "frames"
+    assert (workdir / "003-diffs.npz").exists()
+
+def test_sweep_reports_group_counts_and_stops(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    _sidecar_with_two_changes().save(workdir / "003-diffs.npz")
+    (workdir / "003-groups.jsonl").write_text("", encoding="utf-8")
+    with patch("subtitles_ocr.cli.prefilter_as_completed") as mock_prefilter:
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--sweep", "5,10,15,50",
+        ])
+    assert result.exit_code == 0, result.output
+    assert "5: 3 groups" in result.output
+    assert "10: 2 groups" in result.output
+    assert "15: 2 groups" in result.output
+    assert "50: outside the recorded range" in result.output
+    mock_prefilter.assert_not_called()
+
+
+def test_sweep_widens_recorded_range(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    with patch("subtitles_ocr.cli.compute_groups", return_value=[]) as mock_compute:
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--sweep", "1,30",
+        ])
+    assert result.exit_code == 0, result.output
+    recorder = mock_compute.call_args.kwargs["recorder"]
+    assert (recorder.min_threshold, recorder.max_threshold) == (1.0, 30.0)
+    assert (workdir / "003-diffs.npz").exists()
+
+
+def _workdir_with_frames(tmp_path: Path, count: int) -> tuple[Path, Path]:
+    video, workdir = _minimal_workdir(tmp_path)
+    manifest = [{"path": str(workdir / "001-frames" / f"{i + 1:06d}.jpg"), "timestamp": float(i)} for i in range(count)]
+    (workdir / "002-filtered_manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+    return video, workdir
+
+
+def _crash_grouping_after_first_group(tmp_path: Path, workdir: Path, video: Path) -> FrameGroup:
+    first = FrameGroup(start_time=0.0, end_time=1.0, frame=workdir / "001-frames" / "000001.jpg")
+
+    def crash_after_first_group(*args, **kwargs):
+        yield first
+        raise RuntimeError("decoder crashed")
+
+    with patch("subtitles_ocr.cli.compute_groups", side_effect=crash_after_first_group):
+        result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
+    assert result.exit_code != 0
+    return first
+
+
+def test_grouping_checkpoints_closed_groups_when_interrupted(tmp_path):
+    video, workdir = _workdir_with_frames(tmp_path, 4)
+    _crash_grouping_after_first_group(tmp_path, workdir, video)
+    assert not (workdir / "003-groups.jsonl").exists()
+    assert len(_read_jsonl(workdir / "003-groups.jsonl.partial")) == 1
+    params = json.loads((workdir / "003-groups.partial.json").read_text())
+    assert (params["edge_diff_threshold"], params["decimate"]) == (8.0, False)
+
+
+def test_grouping_resumes_after_last_closed_group(tmp_path):
+    video, workdir = _workdir_with_frames(tmp_path, 4)
+    first = _crash_grouping_after_first_group(tmp_path, workdir, video)
+    second = FrameGroup(start_time=2.0, end_time=3.0, frame=workdir / "001-frames" / "000003.jpg")
+    with patch("subtitles_ocr.cli.compute_groups", return_value=iter([second])) as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False, False]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass")])
+    assert result.exit_code == 0, result.output
+    assert [f.timestamp for f in mock_compute.call_args.args[0]] == [2.0, 3.0]
+    assert mock_compute.call_args.kwargs["recorder"] is None
+    groups = [FrameGroup.model_validate_json(line) for line in _read_jsonl(workdir / "003-groups.jsonl")]
+    assert groups == [first, second]
+    assert not (workdir / "003-groups.jsonl.partial").exists()
+    assert not (workdir / "003-groups.partial.json").exists()
+
+
+def test_grouping_checkpoint_of_another_threshold_is_discarded(tmp_path):
+    video, workdir = _workdir_with_frames(tmp_path, 4)
+    _crash_grouping_after_first_group(tmp_path, workdir, video)
+    with patch("subtitles_ocr.cli.compute_groups", return_value=iter([])) as mock_compute, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"), "--edge-diff-threshold", "10",
+        ])
+    assert result.exit_code == 0, result.output
+    assert "discarding" in result.output
+    assert [f.timestamp for f in mock_compute.call_args.args[0]] == [0.0, 1.0, 2.0, 3.0]
+    assert _read_jsonl(workdir / "003-groups.jsonl") == []
+
+
+def test_decode_scale_requires_frames_mode(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    result = CliRunner().invoke(cli, [
+        str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+        "--extract-mode", "stream", "--decode-scale", "2",
+    ])
+    assert result.exit_code != 0
+    assert "--extract-mode frames" in result.output
+
+
+def test_segments_option_groups_frame_chunks_in_parallel(tmp_path):
+    video, workdir = _minimal_workdir(tmp_path)
+    fake_group = FrameGroup(start_time=0.0, end_time=1.0, frame=Path("frames/000001.jpg"))
+    with patch("subtitles_ocr.cli.compute_groups") as mock_compute, \
+         patch("subtitles_ocr.cli.compute_groups_segmented", return_value=[fake_group]) as mock_segmented, \
+         patch("subtitles_ocr.cli.prefilter_as_completed", return_value=iter(enumerate([False]))), \
+         patch("subtitles_ocr.cli.analyze_as_completed", return_value=iter(enumerate([]))), \
+         patch("subtitles_ocr.cli.build_ass_content", return_value=""):
+        result = CliRunner().invoke(cli, [
+            str(video), "--workdir", str(workdir), "--output", str(tmp_path / "out.ass"),
+            "--segments", "4",
+        ])
+    assert result.exit_code == 0, result.output
+    mock_compute.assert_not_called()
+    sources = mock_segmented.call_args[0][0]
+    assert len(sources) == 4
+    assert mock_segmented.call_args.kwargs["workers"] == 4
@@ -1,7 +1,25 @@
+import io
 import json
 from pathlib import Path
-from subtitles_ocr.pipeline.extract import parse_video_info, compute_frame_timestamps
-from subtitles_ocr.models import VideoInfo, Frame
+from unittest.mock import MagicMock, patch
+import pytest
+from PIL import Image
+from subtitles_ocr.pipeline.extract import (
+    StreamConfig,
+    parse_video_info,
+    compute_frame_timestamps,
+    extract_representatives,
+    iter_representatives,
+    extract_frames,
+    parse_showinfo,
+    representative_select,
+    skip_select,
+    stream_kept_strips,
+    stream_strips,
+    ShowinfoReader,
+    strip_filtergraph,
+)
+from subtitles_ocr.models import VideoInfo, Frame, FrameGroup
 
 FFPROBE_OUTPUT = json.dumps({
     "streams": [{
@@ -32,20 +50,306 @@ def test_parse_video_info_integer_fps():
     assert info.fps == 24.0
 
 
-def test_compute_frame_timestamps_first_is_zero():
+def test_compute_frame_timestamps_uses_given_timestamps():
     paths = [Path("000001.jpg"), Path("000002.jpg"), Path("000003.jpg")]
-    frames = compute_frame_timestamps(paths, fps=24.0)
-    assert frames[0].timestamp == 0.0
+    frames = compute_frame_timestamps(paths, [0.0, 0.042, 0.125])
     assert frames[0].path == Path("000001.jpg")
+    assert [f.timestamp for f in frames] == [0.0, 0.042, 0.125]
 
 
-def test_compute_frame_timestamps_spacing():
-    paths = [Path(f"{i:06d}.jpg") for i in range(1, 4)]
-    frames = compute_frame_timestamps(paths, fps=24.0)
-    assert abs(frames[1].timestamp - 1 / 24) < 1e-6
-    assert abs(frames[2].timestamp - 2 / 24) < 1e-6
+def test_compute_frame_timestamps_rejects_count_mismatch():
+    with pytest.raises(ValueError, match="2 frame files for 1 timestamps"):
+        compute_frame_timestamps([Path("000001.jpg"), Path("000002.jpg")], [0.0])
 
 
 def test_compute_frame_timestamps_empty():
-    frames = compute_frame_timestamps([], fps=24.0)
+    frames = compute_frame_timestamps([], [])
     assert frames == []
+
+
+def _showinfo(*pts: int, time_base: str = "1/1000") -> bytes:
+    lines = [f"[Parsed_showinfo_6 @ 0x55] config in time_base: {time_base}, frame_rate: 24/1"]
+    lines += [f"[Parsed_showinfo_6 @ 0x55] n:{i:4d} pts:{p:7d} pts_time:{p / 1000:<8g} duration:42" for i, p in enumerate(pts)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _fake_ffmpeg(stdout: bytes, returncode: int = 0, stderr: bytes = b"") -> MagicMock:
+    process = MagicMock()
+    process.stdout = io.BytesIO(stdout)
+    process.stderr = io.BytesIO(stderr)
+    process.wait.return_value = returncode
+    process.poll.return_value = returncode
+    return process
+
+
+def test_stream_strips_yields_stacked_strips_and_timestamps(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0)
+    raw = bytes([10, 20, 30, 40]) * 3  # 2px wide, 2 strips of 1px each
+    process = _fake_ffmpeg(raw, stderr=_showinfo(0, 42, 83))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process) as popen:
+        frames = list(stream_strips(Path("v.mkv"), info, tmp_path))
+    assert [f.timestamp for f, _ in frames] == [0.0, 0.042, 0.083]
+    assert [f.path.name for f, _ in frames] == ["000001.jpg", "000002.jpg", "000003.jpg"]
+    assert frames[0][1].size == (2, 2)
+    assert frames[0][1].getpixel((0, 1)) == 30
+    assert list(tmp_path.iterdir()) == []
+    args = popen.call_args[0][0]
+    assert args[args.index("-pix_fmt") + 1] == "gray"
+
+
+def test_stream_strips_raises_on_truncated_frame(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0)
+    process = _fake_ffmpeg(b"\x00" * 5, stderr=_showinfo(0))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process):
+        with pytest.raises(RuntimeError, match="truncated"):
+            list(stream_strips(Path("v.mkv"), info, tmp_path))
+
+
+def test_stream_strips_raises_on_ffmpeg_failure(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0)
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=_fake_ffmpeg(b"", returncode=1)):
+        with pytest.raises(RuntimeError, match="ffmpeg failed"):
+            list(stream_strips(Path("v.mkv"), info, tmp_path))
+
+
+
+def test_stream_strips_raises_when_ffmpeg_produces_no_frames(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0)
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=_fake_ffmpeg(b"")):
+        with pytest.raises(RuntimeError, match="no frames"):
+            list(stream_strips(Path("v.mkv"), info, tmp_path))
+
+def test_stream_strips_keeps_only_frames_inside_segment(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0)
+    process = _fake_ffmpeg(bytes(4) * 4, stderr=_showinfo(9000, 10000, 10042, 11000))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process) as popen:
+        frames = list(stream_strips(Path("v.mkv"), info, tmp_path, start=10.0, end=11.0))
+    assert [f.timestamp for f, _ in frames] == [10.0, 10.042]
+    args = popen.call_args[0][0]
+    assert args[args.index("-ss") + 1] == "9.000000"
+    assert "-copyts" in args
+
+
+def test_stream_strips_subtracts_container_start_time(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0, start_time=1.5)
+    process = _fake_ffmpeg(bytes(4), stderr=_showinfo(1542))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process):
+        frames = list(stream_strips(Path("v.mkv"), info, tmp_path))
+    assert frames[0][0].timestamp == 1542 / 1000 - 1.5
+
+
+def test_stream_strips_holds_decimated_frames_until_next_kept_frame(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=25.0)
+    process = _fake_ffmpeg(bytes(4) * 3, stderr=_showinfo(0, 2000, 2040))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process) as popen:
+        frames = [f for f, _ in stream_strips(Path("v.mkv"), info, tmp_path, end=2.02, config=StreamConfig(decimate=True))]
+    assert [(f.timestamp, f.held_until) for f in frames] == [(0.0, 1.96), (2.0, 2.0)]
+    args = popen.call_args[0][0]
+    assert "vstack,mpdecimate," in args[args.index("-filter_complex") + 1]
+
+
+
+def test_stream_strips_holds_last_decimated_frame_until_the_video_ends(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=25.0, duration=10.0)
+    process = _fake_ffmpeg(bytes(4) * 2, stderr=_showinfo(0, 2000))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process):
+        frames = [f for f, _ in stream_strips(Path("v.mkv"), info, tmp_path, config=StreamConfig(decimate=True))]
+    assert [(f.timestamp, f.held_until) for f in frames] == [(0.0, 1.96), (2.0, 9.96)]
+
+
+def _decimating_ffmpeg(seek: float, frames: list[int], fps: float):
+    """Popen stand-in running a static scene through the graph's trim and mpdecimate as ffmpeg would.
+
+    frames holds each frame's content from the seek position on, one byte repeated over the strips.
+    """
+    def popen(args, **kwargs):
+        graph = args[args.index("-filter_complex") + 1]
+        trim = float(graph.split("trim=start=")[1].split(",")[0]) if "trim=start=" in graph else 0.0
+        kept, pts, previous = [], [], None
+        for i, content in enumerate(frames):
+            t = seek + i / fps
+            if t < trim:
+                continue
+            if "mpdecimate" in graph and content == previous:
+                continue
+            previous = content
+            kept.append(bytes([content]) * 4)
+            pts.append(round(t * 1000))
+        return _fake_ffmpeg(b"".join(kept), stderr=_showinfo(*pts))
+    return popen
+
+
+def test_stream_strips_keeps_a_static_subtitle_at_the_start_of_a_decimated_window(tmp_path):
+    # The same subtitle from the lead-in before start on: the first frame at start must still be emitted
+    info = VideoInfo(width=2, height=5, fps=25.0)
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", side_effect=_decimating_ffmpeg(9.0, [7] * 50, 25.0)):
+        frames = [
+            f for f, _ in stream_strips(Path("v.mkv"), info, tmp_path, start=10.0, end=11.0,
+                                        config=StreamConfig(decimate=True))
+        ]
+    assert [(f.timestamp, f.held_until) for f in frames] == [(10.0, 10.96)]
+
+
+def test_strip_filtergraph_trims_the_lead_in_only_before_mpdecimate():
+    info = VideoInfo(width=1920, height=1080, fps=24.0, start_time=1.5)
+    graph = strip_filtergraph(info, StreamConfig(decimate=True), start=10.0)
+    assert graph.startswith("[0:v]trim=start=11.499500,split")
+    assert "trim" not in strip_filtergraph(info, StreamConfig(decimate=True))
+    assert "trim" not in strip_filtergraph(info, StreamConfig(), start=10.0)
+
+def test_stream_strips_without_decimate_leaves_frames_unheld(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=25.0)
+    process = _fake_ffmpeg(bytes(4) * 2, stderr=_showinfo(0, 2000))
+    with patch("subtitles_ocr.pipeline.extract.subprocess.Popen", return_value=process):
+        frames = [f for f, _ in stream_strips(Path("v.mkv"), info, tmp_path)]
+    assert [f.held_until for f in frames] == [None, None]
+
+
+def test_showinfo_reader_uses_time_base_and_ignores_other_lines():
+    stderr = _showinfo(0, 1001, time_base="1/24000") + b"[h264 @ 0x1] error while decoding\n"
+    reader = ShowinfoReader(io.BytesIO(stderr), start_time=0.0)
+    reader.run()
+    assert reader.timestamps.get() == 0.0
+    assert reader.timestamps.get() == 1001 / 24000
+    assert reader.timestamps.get() is None
+    assert list(reader.log_tail) == ["[h264 @ 0x1] error while decoding"]
+
+
+def test_parse_video_info_reads_format_start_and_duration():
+    data = json.loads(FFPROBE_OUTPUT)
+    data["format"] = {"start_time": "0.007000", "duration": "1420.5"}
+    info = parse_video_info(json.dumps(data))
+    assert info.start_time == 0.007
+    assert info.duration == 1420.5
+
+
+def test_parse_video_info_without_format_defaults():
+    info = parse_video_info(FFPROBE_OUTPUT)
+    assert info.start_time == 0.0
+    assert info.duration is None
+
+
+def test_parse_showinfo_returns_one_timestamp_per_frame():
+    assert parse_showinfo(_showinfo(0, 42, 2000).decode(), start_time=0.0) == [0.0, 0.042, 2.0]
+
+
+def test_skip_select_offsets_ranges_by_container_start():
+    expr = skip_select([(0.0, 90.0), (1300.0, 1390.5)], start_time=0.5)
+    assert expr == "select='not(between(t,0.500000,90.500000)+between(t,1300.500000,1391.000000))'"
+
+
+def _fake_extract_run(timestamps_ms: list[int]):
+    def run(args, **kwargs):
+        out_dir = Path(args[-1]).parent
+        for i in range(1, len(timestamps_ms) + 1):
+            (out_dir / f"{i:06d}.jpg").write_bytes(b"jpg")
+        return MagicMock(stderr=_showinfo(*timestamps_ms))
+    return run
+
+
+def test_extract_frames_seeks_over_leading_skip_and_selects_the_rest(tmp_path):
+    info = VideoInfo(width=1920, height=1080, fps=24.0)
+    with patch("subtitles_ocr.pipeline.extract.get_video_info", return_value=info), \
+         patch("subtitles_ocr.pipeline.extract.subprocess.run", side_effect=_fake_extract_run([90042, 90083])) as run:
+        frames, _ = extract_frames(Path("v.mkv"), tmp_path, [(0.0, 90.0), (300.0, 400.0)])
+    assert [f.timestamp for f in frames] == [90.042, 90.083]
+    args = run.call_args[0][0]
+    assert args[args.index("-ss") + 1] == "89.000000"
+    assert args[args.index("-vf") + 1].startswith("select='not(between(t,0.000000,90.000000)+")
+    assert args[args.index("-vf") + 1].endswith(",showinfo")
+
+
+def test_extract_frames_without_skip_only_logs_showinfo(tmp_path):
+    info = VideoInfo(width=1920, height=1080, fps=24.0)
+    with patch("subtitles_ocr.pipeline.extract.get_video_info", return_value=info), \
+         patch("subtitles_ocr.pipeline.extract.subprocess.run", side_effect=_fake_extract_run([0, 42])) as run:
+        frames, _ = extract_frames(Path("v.mkv"), tmp_path)
+    assert [f.timestamp for f in frames] == [0.0, 0.042]
+    args = run.call_args[0][0]
+    assert args[args.index("-vf") + 1] == "showinfo"
+    assert args[args.index("-ss") + 1] == "0.000000"
+
+
+def test_stream_kept_strips_streams_each_kept_window(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0)
+    calls = []
+
+    def fake_stream(video_path, video_info, output_dir, start, end, config):
+        calls.append((start, end))
+        for t in (start, start + 1.0):
+            yield Frame(path=output_dir / "x.jpg", timestamp=t), Image.new("L", (2, 2))
+
+    with patch("subtitles_ocr.pipeline.extract.stream_strips", side_effect=fake_stream):
+        frames = list(stream_kept_strips(Path("v.mkv"), info, tmp_path, [(10.0, 20.0)]))
+    assert calls == [(0.0, 10.0), (20.0, None)]
+    # the frame exactly at a range's end is still inside the (inclusive) range
+    assert [f.timestamp for f, _ in frames] == [0.0, 1.0, 21.0]
+
+
+
+def test_stream_kept_strips_does_not_stream_past_the_end_of_the_video(tmp_path):
+    info = VideoInfo(width=2, height=5, fps=24.0, duration=30.0)
+    calls = []
+
+    def fake_stream(video_path, video_info, output_dir, start, end, config):
+        calls.append((start, end))
+        yield Frame(path=output_dir / "x.jpg", timestamp=start), Image.new("L", (2, 2))
+
+    with patch("subtitles_ocr.pipeline.extract.stream_strips", side_effect=fake_stream):
+        list(stream_kept_strips(Path("v.mkv"), info, tmp_path, [(25.0, 30.0)]))
+    assert calls == [(0.0, 25.0)]
+
+def test_strip_filtergraph_crops_twenty_percent_bands():
+    graph = strip_filtergraph(VideoInfo(width=1920, height=1080, fps=24.0))
+    assert "crop=iw:216:0:0" in graph
+    assert "crop=iw:216:0:ih-216" in graph
+    assert "vstack" in graph
+    assert "mpdecimate" not in graph
+
+
+def test_representative_select_is_relative_to_seek_offset():
+    expr = representative_select([10.0, 12.0], offset=9.0, fps=25.0)
+    assert expr == "select='between(t,0.980000,1.020000)+between(t,2.980000,3.020000)'"
+
+
+def _fake_run_writing(count: int):
+    def run(args, **kwargs):
+        out_dir = Path(args[-1]).parent
+        for i in range(1, count + 1):
+            (out_dir / f"{i:06d}.jpg").write_bytes(b"jpg")
+        return MagicMock()
+    return run
+
+
+def test_extract_representatives_moves_frames_to_group_paths(tmp_path):
+    info = VideoInfo(width=1920, height=1080, fps=24.0)
+    groups = [
+        FrameGroup(start_time=5.0, end_time=6.0, frame=tmp_path / "000121.jpg"),
+        FrameGroup(start_time=0.0, end_time=4.9, frame=tmp_path / "000001.jpg"),
+    ]
+    with patch("subtitles_ocr.pipeline.extract.subprocess.run", side_effect=_fake_run_writing(2)):
+        extract_representatives(Path("v.mkv"), info, groups)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["000001.jpg", "000121.jpg"]
+
+
+def test_iter_representatives_yields_groups_after_their_batch_is_decoded(tmp_path):
+    info = VideoInfo(width=1920, height=1080, fps=24.0)
+    groups = [FrameGroup(start_time=float(i), end_time=float(i), frame=tmp_path / f"{i:06d}.jpg") for i in range(3)]
+    with patch("subtitles_ocr.pipeline.extract.REPRESENTATIVE_BATCH_SIZE", 2), \
+         patch("subtitles_ocr.pipeline.extract.extract_representatives") as mock_extract:
+        passed = iter_representatives(Path("v.mkv"), info, iter(groups))
+        assert next(passed) is groups[0]
+        assert mock_extract.call_count == 1
+        assert list(passed) == groups[1:]
+    assert [c.args[2] for c in mock_extract.call_args_list] == [groups[:2], groups[2:]]
+
+
+def test_extract_representatives_raises_on_missing_frames(tmp_path):
+    info = VideoInfo(width=1920, height=1080, fps=24.0)
+    groups = [
+        FrameGroup(start_time=0.0, end_time=1.0, frame=tmp_path / "000001.jpg"),
+        FrameGroup(start_time=2.0, end_time=3.0, frame=tmp_path / "000049.jpg"),
+    ]
+    with patch("subtitles_ocr.pipeline.extract.subprocess.run", side_effect=_fake_run_writing(1)):
+        with pytest.raises(RuntimeError, match="1 representative frames for 2 groups"):
+            extract_representatives(Path("v.mkv"), info, groups)
@@ -1,17 +1,33 @@
+import random
 from pathlib import Path
 from unittest.mock import patch
-from PIL import Image
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
 from subtitles_ocr.models import Frame
 from subtitles_ocr.pipeline.filter import (
     compute_groups,
     compute_edge_map,
+    compute_stream_groups,
+    DiffRecorder,
+    DiffSidecar,
+    DECODE_SCALES,
+    EDGE_DIFF_SCALE_GAIN,
+    find_edges,
+    load_strips,
+    scaled_threshold,
+    group_edge_maps,
+    iter_sampled_groups,
+    stack_strips,
     edge_diff,
     SUBTITLE_STRIP_RATIO,
 )
 
-_SIZE = (100, 40)
-EDGES_A = Image.new("L", _SIZE, 0)
-EDGES_B = Image.new("L", _SIZE, 255)
+_SHAPE = (40, 100)
+EDGES_A = np.zeros(_SHAPE, dtype=np.uint8)
+EDGES_B = np.full(_SHAPE, 255, dtype=np.uint8)
+STRIPS_A = np.zeros(_SHAPE, dtype=np.uint8)
+STRIPS_B = np.tile(np.array([0, 255], dtype=np.uint8), (_SHAPE[0], _SHAPE[1] // 2))  # ~127 edge diff from A
 
 
 def _frames(*timestamps: float) -> list[Frame]:
@@ -20,8 +36,8 @@ def _frames(*timestamps: float) -> list[Frame]:
 
 def test_single_frame_is_one_group():
     frames = _frames(0.0)
-    with patch("subtitles_ocr.pipeline.filter.compute_edge_map", return_value=EDGES_A):
-        groups = compute_groups(frames)
+    with patch("subtitles_ocr.pipeline.filter.load_strips", return_value=STRIPS_A):
+        groups = list(compute_groups(frames))
     assert len(groups) == 1
     assert groups[0].start_time == 0.0
     assert groups[0].end_time == 0.0
@@ -29,8 +45,8 @@ def test_single_frame_is_one_group():
 
 def test_identical_frames_form_one_group():
     frames = _frames(0.0, 0.042, 0.083)
-    with patch("subtitles_ocr.pipeline.filter.compute_edge_map", return_value=EDGES_A):
-        groups = compute_groups(frames)
+    with patch("subtitles_ocr.pipeline.filter.load_strips", return_value=STRIPS_A):
+        groups = list(compute_groups(frames))
     assert len(groups) == 1
     assert groups[0].start_time == 0.0
     assert groups[0].end_time == 0.083
@@ -39,9 +55,9 @@ def test_identical_frames_form_one_group():
 
 def test_different_frames_form_separate_groups():
     frames = _frames(0.0, 1.0)
-    edge_maps = [EDGES_A, EDGES_B]
-    with patch("subtitles_ocr.pipeline.filter.compute_edge_map", side_effect=edge_maps):
-        groups = compute_groups(frames)
+    strips = [STRIPS_A, STRIPS_B]
+    with patch("subtitles_ocr.pipeline.filter.load_strips", side_effect=strips):
+        groups = list(compute_groups(frames))
     assert len(groups) == 2
     assert groups[0].start_time == 0.0
     assert groups[0].end_time == 0.0
@@ -49,27 +65,40 @@ def test_different_frames_form_separate_groups():
     assert groups[1].end_time == 1.0
 
 
+def test_compute_groups_yields_closed_groups_before_reading_all_frames():
+    consumed = []
+
+    def frames():
+        for frame in _frames(*(i / 24 for i in range(100))):
+            consumed.append(frame)
+            yield frame
+
+    strips = [STRIPS_A, STRIPS_B] + [STRIPS_B] * 98
+    with patch("subtitles_ocr.pipeline.filter.load_strips", side_effect=strips):
+        groups = compute_groups(frames())
+        assert next(groups).end_time == 0.0
+    assert len(consumed) < 100
+
+
 def test_empty_frames_returns_empty():
-    groups = compute_groups([])
+    groups = list(compute_groups([]))
     assert groups == []
 
 
 def test_representative_frame_is_first_of_group():
     frames = _frames(0.0, 0.042, 0.083)
-    with patch("subtitles_ocr.pipeline.filter.compute_edge_map", return_value=EDGES_A):
-        groups = compute_groups(frames)
+    with patch("subtitles_ocr.pipeline.filter.load_strips", return_value=STRIPS_A):
+        groups = list(compute_groups(frames))
     assert groups[0].frame == Path("000001.jpg")
 
 
 def test_diff_threshold_controls_grouping():
     frames = _frames(0.0, 1.0)
-    # EDGES_A vs EDGES_B: diff = 255 per pixel
-    edge_maps_tight = [EDGES_A, EDGES_B]
-    edge_maps_loose = [EDGES_A, EDGES_B]
-    with patch("subtitles_ocr.pipeline.filter.compute_edge_map", side_effect=edge_maps_tight):
-        tight = compute_groups(frames, diff_threshold=100.0)
-    with patch("subtitles_ocr.pipeline.filter.compute_edge_map", side_effect=edge_maps_loose):
-        loose = compute_groups(frames, diff_threshold=300.0)
+    # edges of STRIPS_A vs STRIPS_B: diff ~127 per pixel
+    with patch("subtitles_ocr.pipeline.filter.load_strips", side_effect=[STRIPS_A, STRIPS_B]):
+        tight = list(compute_groups(frames, diff_threshold=100.0))
+    with patch("subtitles_ocr.pipeline.filter.load_strips", side_effect=[STRIPS_A, STRIPS_B]):
+        loose = list(compute_groups(frames, diff_threshold=200.0))
     assert len(tight) == 2
     assert len(loose) == 1
 
@@ -96,3 +125,225 @@ def test_compute_edge_map_ignores_middle_changes(tmp_path):
     frame_a.save(path_a)
     frame_b.save(path_b)
     assert edge_diff(compute_edge_map(path_a), compute_edge_map(path_b)) == 0
+
+
+def test_compute_stream_groups_matches_edge_maps_of_full_frames(tmp_path):
+    frame_a = Image.new("RGB", (100, 100), color=(255, 255, 255))
+    frame_b = frame_a.copy()
+    frame_b.paste(Image.new("RGB", (100, 20), color=(0, 0, 0)), (0, 80))
+    path_a = tmp_path / "a.png"
+    path_b = tmp_path / "b.png"
+    frame_a.save(path_a)
+    frame_b.save(path_b)
+    frames = _frames(0.0, 1.0, 2.0)
+    strips = [stack_strips(frame_a), stack_strips(frame_a), stack_strips(frame_b)]
+    streamed = list(compute_stream_groups(zip(frames, strips)))
+    with patch("subtitles_ocr.pipeline.filter.load_strips",
+               side_effect=[np.asarray(stack_strips(Image.open(p)).convert("L")) for p in (path_a, path_a, path_b)]):
+        decoded = list(compute_groups(frames))
+    assert streamed == decoded
+    assert len(streamed) == 2
+
+
+def test_held_frames_extend_group_end():
+    frames = [
+        Frame(path=Path("000001.jpg"), timestamp=0.0, held_until=1.96),
+        Frame(path=Path("000051.jpg"), timestamp=2.0, held_until=2.96),
+        Frame(path=Path("000076.jpg"), timestamp=3.0),
+    ]
+    strips = [Image.fromarray(a) for a in (STRIPS_A, STRIPS_A, STRIPS_B)]
+    groups = list(compute_stream_groups(zip(frames, strips)))
+    assert [(g.start_time, g.end_time) for g in groups] == [(0.0, 2.96), (3.0, 3.0)]
+
+
+def _sampled(frames, edge_maps, step):
+    return [g for g, _ in iter_sampled_groups(frames, edge_maps.__getitem__, step, 8.0)]
+
+
+def test_sampled_grouping_finds_exact_change_frame():
+    frames = _frames(*(i / 24 for i in range(20)))
+    edge_maps = [EDGES_A] * 13 + [EDGES_B] * 7
+    groups = _sampled(frames, edge_maps, step=6)
+    assert [(g.start_time, g.end_time) for g in groups] == [(0.0, 12 / 24), (13 / 24, 19 / 24)]
+    assert groups[1].frame == Path("000014.jpg")
+
+
+def test_sampled_grouping_matches_full_scan_when_runs_outlast_step():
+    rng = random.Random(42)
+    for _ in range(50):
+        step = rng.randint(2, 8)
+        levels: list[int] = []
+        while len(levels) < 60:
+            level = rng.choice([v for v in (0, 50, 100, 150) if not levels or v != levels[-1]])
+            levels += [level] * rng.randint(step, 3 * step)
+        edge_maps = [np.full(_SHAPE, v, dtype=np.uint8) for v in levels]
+        frames = _frames(*(i / 24 for i in range(len(levels))))
+        assert _sampled(frames, edge_maps, step) == group_edge_maps(zip(frames, edge_maps), 8.0)
+
+
+def test_compute_groups_with_sample_step_decodes_fewer_frames():
+    frames = _frames(*(i / 24 for i in range(48)))
+    with patch("subtitles_ocr.pipeline.filter.compute_edge_map",
+               side_effect=lambda path, scale: EDGES_A if path < Path("000030.jpg") else EDGES_B) as mock_edges:
+        groups = list(compute_groups(frames, sample_step=6))
+    assert [g.start_time for g in groups] == [0.0, 29 / 24]
+    assert mock_edges.call_count < 16
+
+
+def _recorded(edge_maps, low, high) -> DiffSidecar:
+    recorder = DiffRecorder(low, high)
+    frames = _frames(*(i / 24 for i in range(len(edge_maps))))
+    list(recorder.record(zip(frames, edge_maps)))
+    return recorder.sidecar()
+
+
+def test_sidecar_regroups_exactly_like_first_frame_grouping():
+    rng = np.random.default_rng(7)
+    for _ in range(40):
+        count = int(rng.integers(1, 60))
+        # slowly drifting maps with occasional jumps, so diffs to the first frame are not monotonic
+        base = rng.integers(0, 256, (4, 6)).astype(float)
+        edge_maps = []
+        for _ in range(count):
+            base = base + rng.normal(0, 6, base.shape) if rng.random() > 0.15 else rng.integers(0, 256, base.shape)
+            edge_maps.append(np.clip(base, 0, 255).astype(np.uint8))
+        sidecar = _recorded(edge_maps, 4.0, 40.0)
+        frames = _frames(*(i / 24 for i in range(count)))
+        for threshold in [4.0, 40.0, *rng.uniform(4.0, 40.0, 8)]:
+            assert sidecar.groups(threshold) == group_edge_maps(zip(frames, edge_maps), threshold)
+
+
+def test_sidecar_round_trips_through_file(tmp_path):
+    sidecar = _recorded([EDGES_A, EDGES_A, EDGES_B, EDGES_A], 4.0, 16.0)
+    sidecar.save(tmp_path / "003-diffs.npz")
+    loaded = DiffSidecar.load(tmp_path / "003-diffs.npz")
+    assert loaded.groups(8.0) == sidecar.groups(8.0)
+    assert [g.frame for g in loaded.groups(8.0)] == [Path("000001.jpg"), Path("000003.jpg"), Path("000004.jpg")]
+    assert (loaded.min_threshold, loaded.max_threshold) == (4.0, 16.0)
+
+
+def test_sidecar_remembers_how_its_frames_were_extracted(tmp_path):
+    recorder = DiffRecorder(4.0, 16.0, 2, "stream", [(60.0, 90.0)])
+    recorder.sidecar().save(tmp_path / "003-diffs.npz")
+    loaded = DiffSidecar.load(tmp_path / "003-diffs.npz")
+    assert loaded.recorded_with(2, "stream", [(60.0, 90.0)])
+    assert not loaded.recorded_with(1, "stream", [(60.0, 90.0)])
+    assert not loaded.recorded_with(2, "frames", [(60.0, 90.0)])
+    assert not loaded.recorded_with(2, "stream", [])
+    assert not loaded.recorded_with(2, "stream", [(60.0, 90.0)], decimate=True)
+    decimated = DiffRecorder(4.0, 16.0, 1, "stream", decimate=True).sidecar()
+    decimated.save(tmp_path / "003-diffs.npz")
+    assert DiffSidecar.load(tmp_path / "003-diffs.npz").recorded_with(1, "stream", [], decimate=True)
+    assert not DiffSidecar.load(tmp_path / "003-diffs.npz").recorded_with(1, "stream", [])
+
+
+def test_sidecar_rejects_thresholds_outside_recorded_range():
+    sidecar = _recorded([EDGES_A, EDGES_B], 4.0, 16.0)
+    with pytest.raises(ValueError, match="outside"):
+        sidecar.groups(20.0)
+
+
+def test_empty_sidecar_has_no_groups():
+    assert _recorded([], 4.0, 16.0).groups(8.0) == []
+
+
+def test_compute_groups_feeds_recorder():
+    recorder = DiffRecorder(4.0, 16.0)
+    with patch("subtitles_ocr.pipeline.filter.load_strips", side_effect=[STRIPS_A, STRIPS_A, STRIPS_B]):
+        groups = list(compute_groups(_frames(0.0, 1.0, 2.0), diff_threshold=8.0, recorder=recorder))
+    assert recorder.sidecar().groups(8.0) == groups
+
+
+def test_load_strips_decodes_jpeg_at_reduced_scale(tmp_path):
+    path = tmp_path / "frame.jpg"
+    Image.new("RGB", (160, 100), color=(200, 30, 30)).save(path)
+    assert load_strips(path).shape == (40, 160)
+    assert load_strips(path, scale=2).shape == (20, 80)
+    assert load_strips(path, scale=8).shape == (6, 20)
+
+
+def test_scaled_threshold_is_unchanged_at_full_resolution():
+    assert scaled_threshold(8.0, 1) == 8.0
+    assert scaled_threshold(8.0, 2) > 8.0
+
+
+def test_compute_groups_passes_decode_scale_and_scales_threshold():
+    frames = _frames(0.0, 1.0)
+    # edges of STRIPS_A vs STRIPS_B: diff ~127, above 100 but below 100 * gain at scale 2
+    with patch("subtitles_ocr.pipeline.filter.load_strips", side_effect=[STRIPS_A, STRIPS_B]) as mock_load:
+        groups = list(compute_groups(frames, diff_threshold=100.0, decode_scale=2))
+    assert mock_load.call_args.args == (Path("000002.jpg"), 2)
+    assert len(groups) == 1
+
+
+# Subtitles of the reference scene EDGE_DIFF_SCALE_GAIN is measured on
+_SUBTITLES = [
+    ["Where were you last night?"],
+    ["I told you, I was at work."],
+    [],
+    ["That's not what Sarah said,", "and you know it."],
+    ["- Who's there?", "- Open the door!"],
+]
+
+
+def _subtitle_frame(path: Path, lines: list[str], pan: int = 0) -> Path:
+    """A 1080p JPEG of a smooth scene panned by pan pixels, with lines as 54px subtitles with a 3px outline."""
+    y, x = np.mgrid[0:1080, pan:pan + 1920]
+    scene = np.clip(90 + 50 * np.sin(x / 170) * np.cos(y / 230), 0, 255).astype(np.uint8)
+    img = Image.fromarray(scene).convert("RGB")
+    if lines:
+        ImageDraw.Draw(img).multiline_text(
+            (960, 1026), "\n".join(lines), font=ImageFont.load_default(size=54), fill="white", anchor="md",
+            align="center", stroke_width=3, stroke_fill="black",
+        )
+    img.save(path, quality=90)
+    return path
+
+
+def test_scale_gain_is_the_mean_diff_ratio_of_rendered_subtitle_changes(tmp_path):
+    paths = [_subtitle_frame(tmp_path / f"{i}.jpg", lines) for i, lines in enumerate(_SUBTITLES)]
+    pairs = [(i, j) for i in range(len(paths)) for j in range(i + 1, len(paths))]
+    full = [compute_edge_map(path) for path in paths]
+    for scale in DECODE_SCALES:
+        scaled = [compute_edge_map(path, scale) for path in paths]
+        ratios = [edge_diff(scaled[i], scaled[j]) / edge_diff(full[i], full[j]) for i, j in pairs]
+        assert np.mean(ratios) == pytest.approx(EDGE_DIFF_SCALE_GAIN[scale], abs=0.02)
+
+
+def test_decode_scales_find_the_full_resolution_group_boundaries(tmp_path):
+    # Each subtitle held for 3 frames while the scene pans a pixel per frame
+    frames = [
+        Frame(path=_subtitle_frame(tmp_path / f"{i:06d}.jpg", _SUBTITLES[i // 3], pan=i), timestamp=float(i))
+        for i in range(3 * len(_SUBTITLES))
+    ]
+    for scale in DECODE_SCALES:
+        groups = list(compute_groups(frames, diff_threshold=1.5, decode_scale=scale))
+        assert [group.start_time for group in groups] == [0.0, 3.0, 6.0, 9.0, 12.0], scale
+
+
+def test_find_edges_matches_pillow_find_edges():
+    rng = np.random.default_rng(0)
+    for shape in [(1, 1), (2, 9), (3, 3), (24, 50)]:
+        gray = rng.integers(0, 256, shape, dtype=np.uint8)
+        expected = np.asarray(Image.fromarray(gray).filter(ImageFilter.FIND_EDGES))
+        assert np.array_equal(find_edges(gray), expected)
+
+
+def test_find_edges_batch_matches_single_frames():
+    rng = np.random.default_rng(1)
+    batch = rng.integers(0, 256, (5, 12, 30), dtype=np.uint8)
+    assert np.array_equal(find_edges(batch), np.stack([find_edges(gray) for gray in batch]))
+
+
+def test_edge_diff_is_mean_absolute_difference():
+    a = np.array([[0, 10], [200, 255]], dtype=np.uint8)
+    b = np.array([[5, 0], [255, 0]], dtype=np.uint8)
+    assert edge_diff(a, b) == (5 + 10 + 55 + 255) / 4
+
+
+def test_stack_strips_keeps_only_top_and_bottom_bands():
+    frame = Image.new("L", (10, 100), color=0)
+    frame.paste(Image.new("L", (10, 60), color=255), (0, 20))
+    strips = stack_strips(frame)
+    assert strips.size == (10, 40)
+    assert strips.getextrema() == (0, 0)
@@ -0,0 +1,56 @@
+# tests/test_fingerprint.py
+from pathlib import Path
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from subtitles_ocr.models import FrameAnalysis, FrameGroup, SubtitleElement
+from subtitles_ocr.pipeline.fingerprint import FingerprintConfig, TextMaskIndex, text_mask
+
+
+def _frame(tmp_path: Path, name: str, text: str | None, background: str = "flat") -> FrameGroup:
+    if background == "flat":
+        pixels = np.full((1080, 1920, 3), (40, 60, 90), np.uint8)
+    else:
+        pixels = np.tile(np.linspace(0, 200, 1920, dtype=np.uint8)[None, :, None], (1080, 1, 3))
+    img = Image.fromarray(pixels)
+    if text:
+        font = ImageFont.load_default(size=56)
+        ImageDraw.Draw(img).text((400, 980), text, font=font, fill="white", stroke_width=4, stroke_fill="black",
+                                 anchor="lm")
+    path = tmp_path / f"{name}.jpg"
+    img.save(path, quality=90)
+    return FrameGroup(start_time=0.0, end_time=1.0, frame=path)
+
+
+def test_same_subtitle_over_another_background_has_the_same_fingerprint(tmp_path):
+    config = FingerprintConfig()
+    flat = text_mask(_frame(tmp_path, "a", "Oui, c'est moi.").frame, config)
+    gradient = text_mask(_frame(tmp_path, "b", "Oui, c'est moi.", background="gradient").frame, config)
+    assert flat.fingerprint == gradient.fingerprint
+
+
+def test_frame_without_subtitle_has_no_mask(tmp_path):
+    assert text_mask(_frame(tmp_path, "a", None).frame, FingerprintConfig()) is None
+
+
+def test_index_finds_only_the_same_subtitle(tmp_path):
+    index = TextMaskIndex()
+    index.add(index.mask(_frame(tmp_path, "a", "Tu viens ?")), 0)
+    assert index.find(index.mask(_frame(tmp_path, "b", "Tu viens ?", background="gradient"))) == 0
+    assert index.find(index.mask(_frame(tmp_path, "c", "Tu viens !"))) is None
+    assert index.reused == 1
+
+
+def test_add_analyses_indexes_only_analyses_with_text(tmp_path):
+    index = TextMaskIndex()
+    group = _frame(tmp_path, "a", "Merci.")
+    empty = FrameAnalysis(start_time=0.0, end_time=1.0, elements=[])
+    done = FrameAnalysis(start_time=0.0, end_time=1.0, elements=[SubtitleElement(text="Merci.")])
+    index.add_analyses([(group, empty)])
+    assert index.find(index.mask(group)) is None
+    index.add_analyses([(group, done)])
+    assert index.find(index.mask(group)) == done
+
+
+def test_unreadable_frame_has_no_mask(tmp_path):
+    group = FrameGroup(start_time=0.0, end_time=1.0, frame=tmp_path / "missing.jpg")
+    assert TextMaskIndex().mask(group) is None
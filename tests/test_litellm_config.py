@@ -1,7 +1,7 @@
 import pytest
 import yaml
 from pathlib import Path
-from subtitles_ocr.litellm_config import get_workers_from_litellm
+from subtitles_ocr.litellm_config import get_backends_from_litellm, get_workers_from_litellm
 
 
 def _write_config(tmp_path: Path, model_list: list) -> Path:
@@ -142,3 +142,44 @@ def test_max_parallel_requests_must_be_positive(tmp_path):
     ])
     with pytest.raises(ValueError, match="invalid max_parallel_requests"):
         get_workers_from_litellm(config, "llava:7b")
+
+
+def test_backends_carry_the_model_name_their_server_knows(tmp_path):
+    config = _write_config(tmp_path, [
+        {
+            "model_name": "vision",
+            "litellm_params": {
+                "model": "ollama/qwen2.5vl:7b",
+                "api_base": "http://localhost:11434/v1/",
+                "max_parallel_requests": 4,
+            },
+        },
+        {
+            "model_name": "vision",
+            "litellm_params": {
+                "model": "ollama_chat/hf.co/org/model:Q4_K_M",
+                "api_base": "http://192.168.1.61:11434",
+                "max_parallel_requests": 2,
+            },
+        },
+        {
+            "model_name": "vision",
+            "litellm_params": {"api_base": "http://192.168.1.36:11434", "max_parallel_requests": 1},
+        },
+    ])
+    assert get_backends_from_litellm(config, "vision") == [
+        ("http://localhost:11434", 4, "qwen2.5vl:7b"),
+        ("http://192.168.1.61:11434", 2, "hf.co/org/model:Q4_K_M"),
+        ("http://192.168.1.36:11434", 1, None),
+    ]
+
+
+def test_backend_model_must_name_a_model(tmp_path):
+    config = _write_config(tmp_path, [
+        {
+            "model_name": "vision",
+            "litellm_params": {"model": "ollama/", "api_base": "http://localhost:11434", "max_parallel_requests": 1},
+        },
+    ])
+    with pytest.raises(ValueError, match="invalid model"):
+        get_backends_from_litellm(config, "vision")
@@ -0,0 +1,56 @@
+# tests/test_local_prefilter.py
+from pathlib import Path
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from subtitles_ocr.models import FrameGroup
+from subtitles_ocr.pipeline.local_prefilter import local_prefilter_groups
+
+
+def _frame(
+    tmp_path: Path, name: str, text: str | None = None, line_art: bool = False,
+    fill: tuple[int, int, int] = (255, 255, 255), outline: bool = True,
+    background: tuple[int, int, int] = (40, 60, 90),
+) -> FrameGroup:
+    img = Image.new("RGB", (960, 540), background)
+    draw = ImageDraw.Draw(img)
+    if line_art:
+        for x in range(0, 960, 16):
+            draw.rectangle((x, 0, x + 7, 540), fill=(235, 225, 210), outline=(20, 20, 30), width=2)
+    if text:
+        font = ImageFont.load_default(size=40)
+        draw.text((200, 460), text, font=font, fill=fill, stroke_width=3 if outline else 0, stroke_fill="black")
+    path = tmp_path / f"{name}.png"
+    img.save(path)
+    return FrameGroup(start_time=0.0, end_time=1.0, frame=path)
+
+
+def test_blank_strips_have_no_text(tmp_path):
+    assert list(local_prefilter_groups([_frame(tmp_path, "blank")])) == [False]
+
+
+def test_outlined_subtitle_line_is_text(tmp_path):
+    group = _frame(tmp_path, "text", text="Je ne sais pas ce que tu veux dire.")
+    assert list(local_prefilter_groups([group])) == [True]
+
+
+@pytest.mark.parametrize("fill", [(0, 255, 0), (255, 105, 180)])
+def test_colored_subtitle_line_is_left_to_the_model(tmp_path, fill):
+    group = _frame(tmp_path, "colored", text="Je ne sais pas ce que tu veux dire.", fill=fill)
+    assert list(local_prefilter_groups([group])) == [None]
+
+
+def test_subtitle_line_without_outline_over_a_light_scene_is_left_to_the_model(tmp_path):
+    group = _frame(
+        tmp_path, "plain", text="Je ne sais pas ce que tu veux dire.", fill=(20, 20, 20), outline=False,
+        background=(150, 170, 200),
+    )
+    assert list(local_prefilter_groups([group])) == [None]
+
+
+def test_line_art_across_the_strip_is_unsure(tmp_path):
+    assert list(local_prefilter_groups([_frame(tmp_path, "art", line_art=True)])) == [None]
+
+
+def test_unreadable_frame_is_unsure(tmp_path):
+    group = FrameGroup(start_time=0.0, end_time=1.0, frame=tmp_path / "missing.jpg")
+    assert list(local_prefilter_groups([group])) == [None]
@@ -1,8 +1,15 @@
 # tests/test_prefilter.py
+import io
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, patch
+import numpy as np
+import pytest
+from PIL import Image
 from subtitles_ocr.models import FrameGroup
-from subtitles_ocr.pipeline.prefilter import prefilter_groups
+from subtitles_ocr.pipeline.prefilter import (
+    PREFILTER_DECODING, THUMBNAIL_MAX_WIDTH, build_mosaic, parse_batch_response, parse_response, prefilter_groups,
+    strip_thumbnail,
+)
 from subtitles_ocr.pipeline.retry import RetryConfig
 from subtitles_ocr.vlm.prompt import PREFILTER_PROMPT
 
@@ -15,89 +22,102 @@ def _group(name: str = "a") -> FrameGroup:
     return FrameGroup(start_time=0.0, end_time=1.0, frame=Path(f"frames/{name}.jpg"))
 
 
+@pytest.fixture(autouse=True)
+def _thumbnails(monkeypatch):
+    monkeypatch.setattr("subtitles_ocr.pipeline.prefilter.strip_thumbnail", lambda path, max_width: b"thumb")
+
+
 def test_prefilter_prompt_is_defined():
     assert isinstance(PREFILTER_PROMPT, str)
     assert "has_text" in PREFILTER_PROMPT
 
 
 def test_has_text_true_returns_true():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": true}'
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": true}'
     result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [True]
 
 
 def test_has_text_false_returns_false():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": false}'
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": false}'
     result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [False]
 
 
 def test_has_text_string_true_returns_true():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": "true"}'
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": "true"}'
     result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [True]
 
 
 def test_has_text_string_false_returns_false():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": "false"}'
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": "false"}'
     result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [False]
 
 
 def test_has_text_string_mixed_case_returns_false():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": "False"}'
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": "False"}'
     result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [False]
 
 
+def test_nearly_json_answer_is_repaired():
+    client = AsyncMock()
+    client.analyze_image.return_value = "Sure! {'has_text': True} is my answer."
+    result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=_no_retry()))
+    assert result == [True]
+    client.analyze_image.assert_called_once()
+
+
 def test_invalid_json_yields_none_after_exhausting_retries():
-    client = MagicMock()
-    client.analyze.return_value = "not json"
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    client = AsyncMock()
+    client.analyze_image.return_value = "not json"
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=RetryConfig(max_attempts=2)))
     assert result == [None]
 
 
 def test_missing_field_yields_none():
-    client = MagicMock()
-    client.analyze.return_value = '{"result": "yes"}'
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"result": "yes"}'
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=RetryConfig(max_attempts=2)))
     assert result == [None]
 
 
 def test_unrecognised_string_yields_none():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": "yes"}'
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": "yes"}'
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=RetryConfig(max_attempts=2)))
     assert result == [None]
 
 
 def test_runtime_error_from_client_yields_none():
-    client = MagicMock()
-    client.analyze.side_effect = RuntimeError("network error")
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    client = AsyncMock()
+    client.analyze_image.side_effect = RuntimeError("network error")
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(prefilter_groups([_group("a"), _group("b")], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [None, None]
 
 
 def test_error_on_one_element_does_not_block_others():
-    client = MagicMock()
-    client.analyze.side_effect = [RuntimeError("fail"), '{"has_text": true}']
-    with patch("subtitles_ocr.pipeline.retry.time.sleep"):
+    client = AsyncMock()
+    client.analyze_image.side_effect = [RuntimeError("fail"), '{"has_text": true}']
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
         result = list(prefilter_groups([_group("a"), _group("b")], client, "p", workers=1, retry_config=_no_retry()))
     assert result == [None, True]
 
 
 def test_order_preserved_with_multiple_workers():
-    client = MagicMock()
-    client.analyze.side_effect = [
+    client = AsyncMock()
+    client.analyze_image.side_effect = [
         '{"has_text": false}',
         '{"has_text": true}',
         '{"has_text": false}',
@@ -109,22 +129,142 @@ def test_order_preserved_with_multiple_workers():
 
 
 def test_empty_groups_returns_empty():
-    client = MagicMock()
+    client = AsyncMock()
     result = list(prefilter_groups([], client, "p", workers=4, retry_config=_no_retry()))
     assert result == []
 
 
-def test_analyze_called_with_json_mode():
-    client = MagicMock()
-    client.analyze.return_value = '{"has_text": true}'
+def test_thumbnail_sent_with_has_text_schema():
+    client = AsyncMock()
+    client.analyze_image.return_value = '{"has_text": true}'
     group = _group()
     list(prefilter_groups([group], client, "prompt text", workers=1, retry_config=_no_retry()))
-    client.analyze.assert_called_once_with(group.frame, "prompt text", json_mode=True)
+    client.analyze_image.assert_called_once_with(
+        b"thumb", "prompt text", decoding=PREFILTER_DECODING, validate=parse_response,
+    )
+    assert PREFILTER_DECODING.schema["required"] == ["has_text"]
 
 
 def test_non_retryable_oserror_yields_none_without_retries():
-    client = MagicMock()
-    client.analyze.side_effect = OSError("no such file")
+    client = AsyncMock()
+    client.analyze_image.side_effect = OSError("no such file")
     result = list(prefilter_groups([_group()], client, "p", workers=1, retry_config=RetryConfig(max_attempts=10)))
     assert result == [None]
-    assert client.analyze.call_count == 1
+    assert client.analyze_image.call_count == 1
+
+
+def _frame_groups(tmp_path: Path, count: int) -> list[FrameGroup]:
+    groups = []
+    for i in range(count):
+        path = tmp_path / f"{i:06d}.jpg"
+        Image.new("RGB", (320, 180), (i * 40, 0, 0)).save(path)
+        groups.append(FrameGroup(start_time=float(i), end_time=float(i), frame=path))
+    return groups
+
+
+def test_build_mosaic_stacks_one_tile_per_group(tmp_path):
+    mosaic = Image.open(io.BytesIO(build_mosaic(_frame_groups(tmp_path, 3))))
+    assert mosaic.width == 320
+    assert mosaic.height >= 3 * 72  # 2 strips of 36px per tile, never upscaled
+
+
+
+def test_build_mosaic_of_text_free_tiles_draws_no_text(tmp_path):
+    # Plain tiles and plain separator bars only: every row is one color, no label glyphs anywhere
+    pixels = np.asarray(Image.open(io.BytesIO(build_mosaic(_frame_groups(tmp_path, 3)))).convert("RGB"), dtype=int)
+    assert (np.abs(pixels - pixels[:, :1]).max(axis=(1, 2)) <= 8).all()
+    separator_rows = (pixels[:, :, 0] > 200) & (pixels[:, :, 1] < 60) & (pixels[:, :, 2] > 200)
+    assert separator_rows.all(axis=1).sum() >= 2 * 4
+
+def test_build_mosaic_shrinks_tiles_to_the_tile_width(tmp_path):
+    mosaic = Image.open(io.BytesIO(build_mosaic(_frame_groups(tmp_path, 2), tile_width=160)))
+    assert mosaic.width < 320
+    assert mosaic.height < 2 * 72
+
+
+def test_strip_thumbnail_is_the_strips_shrunk_to_max_width(tmp_path):
+    path = tmp_path / "frame.jpg"
+    Image.new("RGB", (1920, 1080), "gray").save(path)
+    thumbnail = Image.open(io.BytesIO(strip_thumbnail(path, 480)))
+    assert thumbnail.format == "JPEG"
+    assert thumbnail.size == (480, 2 * round(1080 * 0.20) // 4)
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_strip_thumbnail_keeps_narrow_frames_at_full_size(tmp_path):
+    path = tmp_path / "frame.jpg"
+    Image.new("RGB", (320, 180), "gray").save(path)
+    assert Image.open(io.BytesIO(strip_thumbnail(path, THUMBNAIL_MAX_WIDTH))).width == 320
+
+
+def test_unreadable_frame_yields_none_without_a_request(tmp_path, monkeypatch):
+    monkeypatch.undo()
+    client = AsyncMock()
+    group = FrameGroup(start_time=0.0, end_time=1.0, frame=tmp_path / "missing.jpg")
+    result = list(prefilter_groups([group], client, "p", workers=1, retry_config=_no_retry()))
+    assert result == [None]
+    client.analyze_image.assert_not_called()
+
+
+def test_parse_batch_response_accepts_array_or_wrapped_array():
+    assert parse_batch_response("[true, false]", 2) == [True, False]
+    assert parse_batch_response('{"has_text": ["false", true]}', 2) == [False, True]
+
+
+def test_parse_batch_response_repairs_a_nearly_json_answer():
+    assert parse_batch_response("Answers: [True, False,]", 2) == [True, False]
+
+
+def test_parse_batch_response_rejects_wrong_length():
+    with pytest.raises(ValueError, match="2 answers"):
+        parse_batch_response("[true]", 2)
+
+
+def test_batch_answers_map_back_to_groups_in_order(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.side_effect = ["[true, false, true]", "[false, true]"]
+    groups = _frame_groups(tmp_path, 5)
+    result = list(prefilter_groups(groups, client, "p", workers=1, retry_config=_no_retry(), batch_size=3))
+    assert result == [True, False, True, False, True]
+    assert client.analyze_image.call_count == 2
+    assert "3 tiles" in client.analyze_image.call_args_list[0].args[1]
+    decoding = client.analyze_image.call_args_list[0].kwargs["decoding"]
+    assert decoding.schema["minItems"] == decoding.schema["maxItems"] == 3
+    assert decoding.max_tokens > PREFILTER_DECODING.max_tokens
+
+
+class _ValidatingClient:
+    """Answers in turn, checked with validate as OllamaClient does."""
+
+    def __init__(self, answers: list[str]):
+        self.answers = answers
+        self.images: list[bytes] = []
+
+    async def analyze_image(self, image_data, prompt="", system="", decoding=None, validate=None):
+        self.images.append(image_data)
+        answer = self.answers.pop(0)
+        if validate is not None:
+            validate(answer)
+        return answer
+
+
+@pytest.mark.parametrize("batch_answer", ["[true]", "Sure! Both tiles show text."])
+def test_malformed_batch_answer_falls_back_to_single_requests_at_once(tmp_path, batch_answer):
+    client = _ValidatingClient([batch_answer, '{"has_text": false}', '{"has_text": true}'])
+    groups = _frame_groups(tmp_path, 2)
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep") as sleep:
+        result = list(prefilter_groups(groups, client, "p", workers=1, retry_config=RetryConfig(), batch_size=2))
+    assert result == [False, True]
+    assert client.images[1:] == [b"thumb", b"thumb"]
+    sleep.assert_not_called()
+
+
+def test_batch_request_failing_every_attempt_yields_none(tmp_path):
+    client = AsyncMock()
+    client.analyze_image.side_effect = RuntimeError("server down")
+    groups = _frame_groups(tmp_path, 2)
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
+        result = list(prefilter_groups(groups, client, "p", workers=1, retry_config=RetryConfig(max_attempts=2),
+                                       batch_size=2))
+    assert result == [None, None]
+    assert client.analyze_image.call_count == 2
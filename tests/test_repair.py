@@ -0,0 +1,97 @@
+# tests/test_repair.py
+import asyncio
+import json
+import pytest
+from subtitles_ocr.pipeline.repair import Escalation, loads_repaired, repair_json
+from subtitles_ocr.pipeline.retry import MalformedAnswer
+from subtitles_ocr.vlm.client import DecodingConfig
+from subtitles_ocr.vlm.prompt import FORMAT_REMINDER
+
+
+def _repaired(raw: str) -> object:
+    text = repair_json(raw)
+    assert text is not None
+    return json.loads(text)
+
+
+def test_repair_drops_prose_and_fences_around_the_json():
+    assert _repaired('Here you go:\n```json\n{"subtitles": []}\n```\nHope it helps!') == {"subtitles": []}
+    assert _repaired('```json\n{"subtitles": []}') == {"subtitles": []}
+
+
+def test_repair_converts_single_quotes_keeping_apostrophes():
+    raw = "{'subtitles': [{'text': 'C'est l'heure \"pile\"', 'color': 'white'}]}"
+    assert _repaired(raw) == {"subtitles": [{"text": "C'est l'heure \"pile\"", "color": "white"}]}
+
+
+def test_repair_converts_python_literals_and_trailing_commas():
+    assert _repaired("{'has_text': True,}") == {"has_text": True}
+    assert _repaired("[True, False, None,]") == [True, False, None]
+
+
+def test_repair_escapes_line_breaks_in_strings():
+    assert _repaired('{"text": "Bonjour\nà tous"}') == {"text": "Bonjour\nà tous"}
+
+
+def test_cut_off_answer_keeps_its_complete_items():
+    raw = '{"subtitles": [{"text": "Bonjour"}, {"text": "Au rev'
+    assert _repaired(raw) == {"subtitles": [{"text": "Bonjour"}]}
+    assert _repaired('{"subtitles": [{"text": "Bonjour"}') == {"subtitles": [{"text": "Bonjour"}]}
+    assert _repaired("[true, false, tr") == [True, False]
+
+
+def test_cut_off_answer_without_a_complete_item_is_not_repaired():
+    assert repair_json('{"subtitles": [{"text": "Bonj') is None
+    assert repair_json('{"subtitles": [') is None
+
+
+def test_unrepairable_answers():
+    assert repair_json("not json at all") is None
+    assert repair_json('{"subtitles": [}') is None
+
+
+def test_loads_repaired_raises_the_original_error():
+    assert loads_repaired('{"has_text": true}') == {"has_text": True}
+    assert loads_repaired("{'has_text': false}") == {"has_text": False}
+    with pytest.raises(json.JSONDecodeError):
+        loads_repaired("no")
+
+
+def _answers(*answers):
+    calls = []
+
+    async def request(prompt: str, decoding: DecodingConfig) -> str:
+        calls.append((prompt, decoding))
+        answer = answers[len(calls) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+    return request, calls
+
+
+def test_malformed_answer_is_asked_again_rephrased():
+    request, calls = _answers(ValueError("bad"), ValueError("bad"), "ok")
+    decoding = DecodingConfig(max_tokens=16)
+    assert asyncio.run(Escalation("test").ask(request, "prompt", decoding)) == "ok"
+    assert calls == [
+        ("prompt", decoding),
+        ("prompt" + FORMAT_REMINDER, decoding),
+        ("prompt" + FORMAT_REMINDER, DecodingConfig(max_tokens=16, temperature=0.7)),
+    ]
+
+
+def test_answers_malformed_every_way_fail_for_good():
+    request, calls = _answers(*[ValueError("bad")] * 3)
+    with pytest.raises(MalformedAnswer) as raised:
+        asyncio.run(Escalation("test").ask(request, "prompt", DecodingConfig()))
+    assert len(calls) == 3
+    assert isinstance(raised.value.__cause__, ValueError)
+
+
+def test_escalation_resumes_where_it_was_after_another_error():
+    request, calls = _answers(ValueError("bad"), RuntimeError("empty"), "ok")
+    escalation = Escalation("test")
+    with pytest.raises(RuntimeError):
+        asyncio.run(escalation.ask(request, "prompt", DecodingConfig()))
+    assert asyncio.run(escalation.ask(request, "prompt", DecodingConfig())) == "ok"
+    assert [prompt for prompt, _ in calls] == ["prompt", "prompt" + FORMAT_REMINDER, "prompt" + FORMAT_REMINDER]
@@ -1,9 +1,15 @@
 # tests/test_retry.py
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 import pytest
 import logging
 from unittest.mock import patch, call
+import httpx
+from openai import APIConnectionError, RateLimitError
 from subtitles_ocr.pipeline.retry import (
-    RetryConfig, RetryExhausted, NonRetryable, with_retry,
+    RetryConfig, RetryCoordinator, RetryExhausted, NonRetryable, retry_after, with_retry, with_retry_async,
 )
 
 
@@ -131,3 +137,153 @@ def test_retry_exhausted_cause_is_original_error():
     assert exc_info.value.__cause__ is original
 
 
+# --- RetryCoordinator ---
+
+def _connection_error() -> APIConnectionError:
+    return APIConnectionError(request=httpx.Request("POST", "http://localhost"))
+
+
+def _rate_limited(headers: dict[str, str]) -> RateLimitError:
+    return RateLimitError(
+        message="rate limited",
+        response=httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://localhost")),
+        body=None,
+    )
+
+
+def _failing(errors: list[Exception], result: str = "ok"):
+    async def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+
+def test_retry_after_reads_seconds_milliseconds_and_dates():
+    assert retry_after(_rate_limited({"retry-after": "3"})) == 3.0
+    assert retry_after(_rate_limited({"retry-after-ms": "1500"})) == 1.5
+    in_30s = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < retry_after(_rate_limited({"retry-after": in_30s})) <= 30
+    assert retry_after(_rate_limited({"retry-after": "3600"})) is None
+    assert retry_after(_rate_limited({"retry-after": "soon"})) is None
+    assert retry_after(_rate_limited({})) is None
+    assert retry_after(ValueError("bad json")) is None
+
+
+def test_coordinator_jitters_backoff():
+    coordinator = RetryCoordinator(RetryConfig(max_attempts=5, budget=100), rng=random.Random(1))
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep") as mock_sleep:
+        with pytest.raises(RetryExhausted):
+            asyncio.run(with_retry_async(
+                _failing([ValueError()] * 5), RetryConfig(max_attempts=5), coordinator=coordinator,
+            ))
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert len(delays) == 4
+    assert all(0 <= delay <= 2 ** attempt for attempt, delay in enumerate(delays))
+    assert delays != [1.0, 2.0, 4.0, 8.0]
+
+
+def test_coordinator_honors_retry_after():
+    config = RetryConfig(max_attempts=3)
+    coordinator = RetryCoordinator(config)
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep") as mock_sleep:
+        result = asyncio.run(with_retry_async(
+            _failing([_rate_limited({"retry-after": "7"})]), config, coordinator=coordinator,
+        ))
+    assert result == "ok"
+    assert mock_sleep.call_args_list[0].args[0] == 7.0
+
+
+def test_coordinator_refuses_retries_past_the_stage_budget():
+    config = RetryConfig(max_attempts=10, budget=2, budget_ratio=0.0)
+    coordinator = RetryCoordinator(config)
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
+        assert asyncio.run(with_retry_async(_failing([ValueError()] * 2), config, coordinator=coordinator)) == "ok"
+        errors = [ValueError()] * 5
+        with pytest.raises(RetryExhausted, match="budget"):
+            asyncio.run(with_retry_async(_failing(errors), config, coordinator=coordinator))
+    assert len(errors) == 4  # one attempt, no retry
+    assert coordinator.retries == 2
+
+
+def test_budget_grows_with_the_requests_of_the_stage():
+    config = RetryConfig(budget=0, budget_ratio=0.5)
+    coordinator = RetryCoordinator(config)
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
+        for _ in range(4):
+            asyncio.run(with_retry_async(_failing([]), config, coordinator=coordinator))
+        assert asyncio.run(with_retry_async(_failing([ValueError()] * 2), config, coordinator=coordinator)) == "ok"
+    assert coordinator.retries == 2
+
+
+def test_failed_probes_do_not_use_up_attempts():
+    config = RetryConfig(max_attempts=3, breaker_threshold=2, probe_delay=0.01, max_probe_delay=0.02)
+    coordinator = RetryCoordinator(config)
+    errors = [_connection_error() for _ in range(5)]
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep"):
+        assert asyncio.run(with_retry_async(_failing(errors), config, coordinator=coordinator)) == "ok"
+    assert not coordinator.is_open
+
+
+def test_open_circuit_sends_one_probe_at_a_time_then_resumes_all_workers():
+    config = RetryConfig(max_attempts=3, breaker_threshold=2, probe_delay=0.01, max_probe_delay=0.02)
+    down_for = 9  # every worker fails once, then so does the first probe
+    calls = 0
+    in_flight_while_open = []
+    in_flight = 0
+
+    async def request():
+        nonlocal calls, in_flight
+        calls += 1
+        call_number = calls
+        in_flight += 1
+        if coordinator.is_open:
+            in_flight_while_open.append(in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        if call_number <= down_for:
+            raise _connection_error()
+        return "ok"
+
+    async def run_workers():
+        return await asyncio.gather(*(with_retry_async(request, config, coordinator=coordinator) for _ in range(8)))
+
+    coordinator = RetryCoordinator(config, rng=random.Random(0))
+    real_sleep = asyncio.sleep
+
+    async def no_wait(delay):
+        await real_sleep(0)
+
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep", side_effect=no_wait):
+        assert asyncio.run(run_workers()) == ["ok"] * 8
+    assert in_flight_while_open and max(in_flight_while_open) == 1
+    assert not coordinator.is_open
+
+
+def test_backend_that_never_recovers_fails_every_worker_once_open_too_long():
+    config = RetryConfig(max_attempts=3, breaker_threshold=2, probe_delay=0.01, max_probe_delay=0.02, max_open=0.1)
+    coordinator = RetryCoordinator(config)
+    calls = 0
+
+    async def request():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.001)
+        raise _connection_error()
+
+    async def run_workers():
+        return await asyncio.wait_for(asyncio.gather(
+            *(with_retry_async(request, config, coordinator=coordinator) for _ in range(4)), return_exceptions=True,
+        ), timeout=5)
+
+    real_sleep = asyncio.sleep
+
+    async def no_wait(delay):
+        await real_sleep(0)
+
+    with patch("subtitles_ocr.pipeline.retry.asyncio.sleep", side_effect=no_wait):
+        results = asyncio.run(run_workers())
+    assert all(isinstance(result, RetryExhausted) for result in results)
+    assert calls < 30
+    with pytest.raises(RetryExhausted, match="backend down"):
+        asyncio.run(with_retry_async(request, config, coordinator=coordinator))
@@ -0,0 +1,79 @@
+# tests/test_runner.py
+import asyncio
+import threading
+import time
+import pytest
+from subtitles_ocr.pipeline.runner import in_order, run_stage_unordered
+
+
+def test_in_order_restores_input_order():
+    async def process(delay: float) -> float:
+        await asyncio.sleep(delay)
+        return delay
+
+    assert list(in_order(run_stage_unordered([0.03, 0.0, 0.02, 0.01], process, concurrency=4))) == [0.03, 0.0, 0.02, 0.01]
+
+
+def test_concurrency_bounds_requests_in_flight():
+    in_flight = 0
+    peak = 0
+
+    async def process(item: int) -> int:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        return item
+
+    assert sorted(result for _, result in run_stage_unordered(range(50), process, concurrency=8)) == list(range(50))
+    assert peak == 8
+
+
+def test_hundreds_in_flight_on_one_thread():
+    threads = set()
+
+    async def process(item: int) -> int:
+        threads.add(threading.get_ident())
+        await asyncio.sleep(0.05)
+        return item
+
+    assert len(list(run_stage_unordered(range(300), process, concurrency=300))) == 300
+    assert len(threads) == 1
+    assert threading.get_ident() not in threads
+
+
+def test_exception_from_process_is_raised_to_the_caller():
+    async def process(item: int) -> int:
+        if item == 2:
+            raise KeyError(item)
+        return item
+
+    results = run_stage_unordered(range(4), process, concurrency=1)
+    assert next(results) == (0, 0)
+    assert next(results) == (1, 1)
+    with pytest.raises(KeyError):
+        next(results)
+
+
+def test_results_come_as_they_complete():
+    async def process(delay: float) -> float:
+        await asyncio.sleep(delay)
+        return delay
+
+    pairs = list(run_stage_unordered([0.2, 0.0, 0.1], process, concurrency=3))
+    assert [index for index, _ in pairs] == [1, 2, 0]
+
+
+def test_window_bounds_items_started_but_not_yet_consumed():
+    started = []
+
+    async def process(item: int) -> int:
+        started.append(item)
+        return item
+
+    results = run_stage_unordered(iter(range(100)), process, concurrency=2, window=4)
+    first, _ = next(results)
+    time.sleep(0.05)
+    assert len(started) <= 5
+    assert sorted([first] + [index for index, _ in results]) == list(range(100))
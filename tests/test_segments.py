@@ -0,0 +1,90 @@
+import random
+from functools import partial
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from subtitles_ocr.models import Frame
+from subtitles_ocr.pipeline.filter import compute_groups, frame_edge_maps, group_edge_maps
+from subtitles_ocr.pipeline.segments import (
+    compute_groups_segmented,
+    group_segment,
+    split_frames,
+    split_time_range,
+    stitch_segments,
+)
+
+_SHAPE = (10, 20)
+
+
+def _edges(level: int) -> np.ndarray:
+    return np.full(_SHAPE, level, dtype=np.uint8)
+
+
+def _frames(count: int) -> list[Frame]:
+    return [Frame(path=Path(f"{i + 1:06d}.jpg"), timestamp=i / 24) for i in range(count)]
+
+
+def _segmented(items: list[tuple[Frame, Image.Image]], cuts: list[int], threshold: float):
+    bounds = [0, *cuts, len(items)]
+    sources = [partial(iter, items[a:b]) for a, b in zip(bounds, bounds[1:])]
+    results = [group_segment(source, threshold) for source in sources]
+    return stitch_segments(results, sources, threshold)
+
+
+def test_split_time_range_covers_duration():
+    assert split_time_range(90.0, 3) == [(0.0, 30.0), (30.0, 60.0), (60.0, None)]
+
+
+def test_split_time_range_from_resume_point():
+    assert split_time_range(90.0, 2, start=30.0) == [(30.0, 60.0), (60.0, None)]
+
+
+def test_split_frames_balances_chunks():
+    chunks = split_frames(_frames(7), 3)
+    assert [len(c) for c in chunks] == [3, 2, 2]
+    assert sum(chunks, []) == _frames(7)
+
+
+def test_group_continuing_across_seam_is_merged():
+    frames = _frames(4)
+    items = list(zip(frames, [_edges(0)] * 4))
+    assert _segmented(items, [2], threshold=8.0) == group_edge_maps(items, 8.0)
+    assert len(_segmented(items, [2], threshold=8.0)) == 1
+
+
+def test_seam_repair_follows_first_frame_semantics():
+    # Drift of 5 per frame: sequential groups compare against the group's first frame,
+    # so a segment starting mid-drift would otherwise group differently.
+    frames = _frames(10)
+    items = list(zip(frames, [_edges(5 * i) for i in range(10)]))
+    expected = group_edge_maps(items, 8.0)
+    for cut in range(1, 10):
+        assert _segmented(items, [cut], threshold=8.0) == expected
+
+
+def test_random_sequences_match_sequential_grouping():
+    rng = random.Random(1234)
+    for _ in range(50):
+        count = rng.randint(1, 30)
+        levels = [rng.choice([0, 4, 9, 20, 60]) for _ in range(count)]
+        items = list(zip(_frames(count), [_edges(v) for v in levels]))
+        cuts = sorted(rng.sample(range(0, count + 1), k=min(3, count + 1)))
+        assert _segmented(items, cuts, threshold=8.0) == group_edge_maps(items, 8.0)
+
+
+def test_empty_segments_are_ignored():
+    frames = _frames(3)
+    items = list(zip(frames, [_edges(0), _edges(50), _edges(50)]))
+    assert _segmented(items, [0, 0, 3], threshold=8.0) == group_edge_maps(items, 8.0)
+
+
+def test_compute_groups_segmented_matches_compute_groups(tmp_path):
+    frames = []
+    for i, level in enumerate([0, 0, 255, 255, 255, 0, 0, 128, 128]):
+        frame = Image.new("L", (40, 40), 0)
+        frame.paste(Image.new("L", (20, 8), level), (10, 32))
+        path = tmp_path / f"{i + 1:06d}.png"
+        frame.save(path)
+        frames.append(Frame(path=path, timestamp=i / 24))
+    sources = [partial(frame_edge_maps, chunk) for chunk in split_frames(frames, 3)]
+    assert compute_groups_segmented(sources, 8.0, workers=2) == list(compute_groups(frames, 8.0))
@@ -1,7 +1,7 @@
 import pytest
 from pathlib import Path
 from subtitles_ocr.models import Frame
-from subtitles_ocr.pipeline.skip import parse_time, format_time, parse_skip_range, normalize_ranges, filter_frames
+from subtitles_ocr.pipeline.skip import parse_time, format_time, parse_skip_range, normalize_ranges, filter_frames, kept_windows
 
 
 class TestParseTime:
@@ -129,3 +129,21 @@ class TestFilterFrames:
         frames = [_frame(float(i)) for i in range(6)]
         result = filter_frames(frames, [(1.0, 2.0), (4.0, 5.0)])
         assert [f.timestamp for f in result] == [0.0, 3.0]
+
+
+class TestKeptWindows:
+    def test_no_ranges_keeps_everything(self):
+        assert kept_windows([]) == [(0.0, None)]
+
+    def test_leading_range_starts_after_it(self):
+        assert kept_windows([(0.0, 90.0)]) == [(90.0, None)]
+
+    def test_middle_ranges_split_windows(self):
+        assert kept_windows([(60.0, 90.0), (1300.0, 1390.0)]) == [
+            (0.0, 60.0), (90.0, 1300.0), (1390.0, None),
+        ]
+
+    def test_clipped_to_segment(self):
+        ranges = [(60.0, 90.0), (1300.0, 1390.0)]
+        assert kept_windows(ranges, start=80.0, end=700.0) == [(90.0, 700.0)]
+        assert kept_windows(ranges, start=1320.0, end=1380.0) == []
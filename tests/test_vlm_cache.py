@@ -0,0 +1,60 @@
+# tests/test_vlm_cache.py
+import threading
+from unittest.mock import patch
+from subtitles_ocr.vlm import cache as cache_module
+from subtitles_ocr.vlm.cache import InferenceCache, request_key
+
+
+def test_request_key_depends_on_every_field():
+    request = {"model": "m", "messages": [{"role": "user", "content": "a"}]}
+    assert request_key(request) == request_key(dict(reversed(request.items())))
+    assert request_key(request) != request_key({**request, "model": "other"})
+    assert request_key(request) != request_key({**request, "temperature": 0.0})
+
+
+def test_put_then_get_across_instances(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    first = InferenceCache(path)
+    first.put("k", "answer")
+    first.close()
+    second = InferenceCache(path)
+    assert second.get("k", "analyze") == "answer"
+    assert second.get("missing", "analyze") is None
+    stats = second.stats()["analyze"]
+    assert (stats.hits, stats.misses, stats.hit_rate) == (1, 1, 0.5)
+
+
+def test_a_key_is_served_again_until_invalidated(tmp_path):
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    cache.put("k", "bad answer")
+    assert cache.get("k", "s") == "bad answer"
+    assert cache.get("k", "s") == "bad answer"
+    cache.invalidate("k", "s")
+    assert cache.get("k", "s") is None
+    assert (cache.stats()["s"].hits, cache.stats()["s"].misses) == (1, 2)
+    cache.put("k", "good answer")
+    assert InferenceCache(tmp_path / "cache.sqlite").get("k", "s") == "good answer"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = InferenceCache(tmp_path / "cache.sqlite", max_entries=2)
+    with patch.object(cache_module.time, "time", side_effect=[1.0, 2.0, 3.0, 4.0]):
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a", "s")
+        cache.put("c", "3")
+    cache.close()
+    reopened = InferenceCache(tmp_path / "cache.sqlite")
+    assert len(reopened) == 2
+    assert reopened.get("b", "s") is None
+    assert reopened.get("a", "s") == "1"
+
+
+def test_concurrent_threads_share_one_cache(tmp_path):
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    threads = [threading.Thread(target=cache.put, args=(f"k{i}", str(i))) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 20
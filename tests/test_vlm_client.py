@@ -1,25 +1,36 @@
 # tests/test_vlm_client.py
+import asyncio
+import threading
 import pytest
 from pathlib import Path
-from unittest.mock import patch, MagicMock
-from subtitles_ocr.vlm.client import OllamaClient
+from unittest.mock import AsyncMock, patch, MagicMock
+from subtitles_ocr.vlm.cache import InferenceCache
+from subtitles_ocr.vlm.client import AnswerCutOff, DecodingConfig, OllamaClient
+from subtitles_ocr.vlm.concurrency import AdaptiveConcurrency, AdaptiveConfig
+from subtitles_ocr.vlm.router import Backend
 
 
-def _make_response(content: str | None) -> MagicMock:
+def _make_response(content: str | None, finish_reason: str = "stop") -> MagicMock:
     mock_choice = MagicMock()
     mock_choice.message.content = content
+    mock_choice.finish_reason = finish_reason
     mock_response = MagicMock()
     mock_response.choices = [mock_choice]
     return mock_response
 
 
-def test_analyze_passes_image_and_prompt():
+def _mock_openai(response: MagicMock | None = None) -> MagicMock:
     mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response("[]")
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai.chat.completions.create = AsyncMock(return_value=response)
+    return mock_openai
+
+
+def test_analyze_passes_image_and_prompt():
+    mock_openai = _mock_openai(_make_response("[]"))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", return_value=b"image_data"):
             client = OllamaClient(model="test-model")
-            result = client.analyze(Path("frame.jpg"), "my prompt")
+            result = asyncio.run(client.analyze(Path("frame.jpg"), "my prompt"))
 
     assert result == "[]"
     call_args = mock_openai.chat.completions.create.call_args
@@ -30,66 +41,62 @@ def test_analyze_passes_image_and_prompt():
 
 
 def test_analyze_returns_raw_string():
-    mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response('[{"text": "Bonjour"}]')
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai = _mock_openai(_make_response('[{"text": "Bonjour"}]'))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", return_value=b"image_data"):
             client = OllamaClient(model="test-model")
-            result = client.analyze(Path("frame.jpg"), "prompt")
+            result = asyncio.run(client.analyze(Path("frame.jpg"), "prompt"))
     assert result == '[{"text": "Bonjour"}]'
 
 
 def test_analyze_raises_runtime_error_on_none_content():
-    mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response(None)
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai = _mock_openai(_make_response(None))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", return_value=b"image_data"):
             client = OllamaClient(model="test-model")
             with pytest.raises(RuntimeError, match="no text content"):
-                client.analyze(Path("frame.jpg"), "prompt")
+                asyncio.run(client.analyze(Path("frame.jpg"), "prompt"))
 
 
 def test_analyze_propagates_oserror_from_read_bytes():
     mock_openai = MagicMock()
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", side_effect=OSError("no such file")):
             client = OllamaClient(model="test-model")
             with pytest.raises(OSError):
-                client.analyze(Path("missing.jpg"), "prompt")
+                asyncio.run(client.analyze(Path("missing.jpg"), "prompt"))
 
 
 def test_analyze_propagates_openai_exceptions():
     from openai import APIConnectionError
     import httpx
-    mock_openai = MagicMock()
+    mock_openai = _mock_openai()
     mock_openai.chat.completions.create.side_effect = APIConnectionError(
         request=httpx.Request("GET", "http://localhost")
     )
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", return_value=b"image_data"):
             client = OllamaClient(model="test-model")
             with pytest.raises(APIConnectionError):
-                client.analyze(Path("frame.jpg"), "prompt")
+                asyncio.run(client.analyze(Path("frame.jpg"), "prompt"))
 
 
 def test_analyze_with_system_sends_system_role_first():
-    mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response("{}")
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai = _mock_openai(_make_response("{}"))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", return_value=b"image_data"):
             client = OllamaClient(model="test-model")
-            client.analyze(Path("frame.jpg"), system="sys prompt")
+            asyncio.run(client.analyze(Path("frame.jpg"), system="sys prompt"))
     messages = mock_openai.chat.completions.create.call_args.kwargs["messages"]
     assert messages[0] == {"role": "system", "content": "sys prompt"}
 
 
 def test_analyze_with_system_user_message_contains_only_image():
-    mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response("{}")
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai = _mock_openai(_make_response("{}"))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         with patch.object(Path, "read_bytes", return_value=b"image_data"):
             client = OllamaClient(model="test-model")
-            client.analyze(Path("frame.jpg"), system="sys prompt")
+            asyncio.run(client.analyze(Path("frame.jpg"), system="sys prompt"))
     messages = mock_openai.chat.completions.create.call_args.kwargs["messages"]
     user_content = messages[1]["content"]
     assert len(user_content) == 1
@@ -97,11 +104,10 @@ def test_analyze_with_system_user_message_contains_only_image():
 
 
 def test_chat_returns_text_response():
-    mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response("Bonjour tout le monde")
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai = _mock_openai(_make_response("Bonjour tout le monde"))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         client = OllamaClient(model="test-model")
-        result = client.chat("prompt text", system="system text")
+        result = asyncio.run(client.chat("prompt text", system="system text"))
     assert result == "Bonjour tout le monde"
     messages = mock_openai.chat.completions.create.call_args.kwargs["messages"]
     assert messages[0] == {"role": "system", "content": "system text"}
@@ -109,24 +115,273 @@ def test_chat_returns_text_response():
 
 
 def test_chat_raises_runtime_error_on_empty_content():
-    mock_openai = MagicMock()
-    mock_openai.chat.completions.create.return_value = _make_response(None)
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    mock_openai = _mock_openai(_make_response(None))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         client = OllamaClient(model="test-model")
         with pytest.raises(RuntimeError, match="no text content"):
-            client.chat("prompt", system="system")
+            asyncio.run(client.chat("prompt", system="system"))
 
 
 def test_chat_propagates_openai_exceptions():
     from openai import RateLimitError
     import httpx
-    mock_openai = MagicMock()
+    mock_openai = _mock_openai()
     mock_openai.chat.completions.create.side_effect = RateLimitError(
         message="rate limited",
         response=httpx.Response(429, request=httpx.Request("POST", "http://localhost")),
         body=None,
     )
-    with patch("subtitles_ocr.vlm.client.OpenAI", return_value=mock_openai):
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
         client = OllamaClient(model="test-model")
         with pytest.raises(RateLimitError):
-            client.chat("prompt", system="system")
+            asyncio.run(client.chat("prompt", system="system"))
+
+
+def test_cached_answer_skips_the_server(tmp_path):
+    mock_openai = _mock_openai(_make_response("Bonjour"))
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        asyncio.run(OllamaClient(model="test-model", cache=cache, stage="reconcile").chat("prompt", system="system"))
+        client = OllamaClient(model="test-model", cache=cache, stage="reconcile")
+        assert asyncio.run(client.chat("prompt", system="system")) == "Bonjour"
+        asyncio.run(client.chat("other prompt", system="system"))
+    assert mock_openai.chat.completions.create.call_count == 2
+    stats = cache.stats()["reconcile"]
+    assert (stats.hits, stats.misses) == (1, 2)
+
+
+def test_cache_key_includes_the_image(tmp_path):
+    mock_openai = _mock_openai(_make_response("{}"))
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        client = OllamaClient(model="test-model", cache=cache)
+        asyncio.run(client.analyze_image(b"frame one", system="sys"))
+        asyncio.run(client.analyze_image(b"frame two", system="sys"))
+    assert mock_openai.chat.completions.create.call_count == 2
+    assert cache.stats()["test-model"].misses == 2
+
+
+def test_empty_answer_is_not_cached(tmp_path):
+    mock_openai = _mock_openai(_make_response(None))
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        with pytest.raises(RuntimeError):
+            asyncio.run(OllamaClient(model="test-model", cache=cache).chat("prompt", system="system"))
+    assert len(cache) == 0
+
+
+def test_answer_cut_off_at_max_tokens_fails_and_is_not_cached(tmp_path):
+    mock_openai = _mock_openai(_make_response('{"subtitles": [{"te', finish_reason="length"))
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        with pytest.raises(AnswerCutOff):
+            asyncio.run(OllamaClient(model="test-model", cache=cache).chat(
+                "prompt", system="system", decoding=DecodingConfig(max_tokens=8),
+            ))
+    assert len(cache) == 0
+
+
+
+def _json_object(answer: str) -> None:
+    if not answer.startswith("{"):
+        raise ValueError(f"not an object: {answer!r}")
+
+
+def test_answer_validate_rejects_is_not_cached(tmp_path):
+    mock_openai = _mock_openai(_make_response("Sure! Here it is"))
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        with pytest.raises(ValueError):
+            asyncio.run(OllamaClient(model="test-model", cache=cache).chat("prompt", system="s", validate=_json_object))
+    assert len(cache) == 0
+
+
+def test_cached_answer_validate_rejects_is_asked_again_and_replaced(tmp_path):
+    mock_openai = _mock_openai(_make_response("Sure! Here it is"))
+    cache = InferenceCache(tmp_path / "cache.sqlite")
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        client = OllamaClient(model="test-model", cache=cache, stage="prefilter")
+        # Cached by a run that did not check it
+        asyncio.run(client.chat("prompt", system="s"))
+        mock_openai.chat.completions.create.return_value = _make_response('{"has_text": false}')
+        assert asyncio.run(client.chat("prompt", system="s", validate=_json_object)) == '{"has_text": false}'
+        # Identical requests later in the run are served the valid answer
+        assert asyncio.run(client.chat("prompt", system="s", validate=_json_object)) == '{"has_text": false}'
+    assert mock_openai.chat.completions.create.call_count == 2
+    stats = cache.stats()["prefilter"]
+    assert (stats.hits, stats.misses) == (1, 2)
+
+def test_decoding_sets_schema_max_tokens_stop_and_temperature():
+    mock_openai = _mock_openai(_make_response('{"has_text": true}'))
+    schema = {"title": "prefilter", "type": "object"}
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        client = OllamaClient(model="test-model")
+        asyncio.run(client.analyze_image(
+            b"image", "p", decoding=DecodingConfig(schema=schema, max_tokens=16, stop=("\n\n",), temperature=0.7),
+        ))
+    kwargs = mock_openai.chat.completions.create.call_args.kwargs
+    assert kwargs["response_format"] == {"type": "json_schema", "json_schema": {"name": "prefilter", "schema": schema}}
+    assert kwargs["max_tokens"] == 16
+    assert kwargs["stop"] == ["\n\n"]
+    assert kwargs["temperature"] == 0.7
+
+
+def test_default_decoding_adds_no_request_parameters():
+    mock_openai = _mock_openai(_make_response("Bonjour"))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        asyncio.run(OllamaClient(model="test-model").chat("prompt", system="system"))
+    assert set(mock_openai.chat.completions.create.call_args.kwargs) == {"model", "messages"}
+
+
+def test_clients_share_one_connection_pool():
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI") as mock_openai:
+        OllamaClient(model="filter-model")
+        OllamaClient(model="analyze-model")
+    pools = [call.kwargs["http_client"] for call in mock_openai.call_args_list]
+    assert pools[0] is pools[1]
+
+
+def test_limiter_sees_completions_and_overloads():
+    from openai import RateLimitError
+    import httpx
+    mock_openai = _mock_openai()
+    mock_openai.chat.completions.create.side_effect = [
+        _make_response("ok"),
+        RateLimitError(
+            message="rate limited",
+            response=httpx.Response(429, request=httpx.Request("POST", "http://localhost")),
+            body=None,
+        ),
+    ]
+    limiter = AdaptiveConcurrency(AdaptiveConfig(initial=10))
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=mock_openai):
+        client = OllamaClient(model="test-model", limiter=limiter)
+        asyncio.run(client.chat("prompt", system="system"))
+        with pytest.raises(RateLimitError):
+            asyncio.run(client.chat("prompt", system="system"))
+    assert limiter.completed_requests == 1
+    assert limiter.limit == 7
+
+
+def test_backends_each_get_a_client_and_share_the_load():
+    servers = []
+    for answer in "ab":
+        async def create(*args, answer=answer, **kwargs):
+            await asyncio.sleep(0.01)
+            return _make_response(answer)
+        servers.append(_mock_openai())
+        servers[-1].chat.completions.create.side_effect = create
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", side_effect=servers) as mock_openai:
+        client = OllamaClient(model="test-model", backends=[Backend("http://a:11434", 1), Backend("http://b:11434", 1)])
+
+        async def two_at_once():
+            return await asyncio.gather(client.chat("p1", system="s"), client.chat("p2", system="s"))
+
+        answers = asyncio.run(two_at_once())
+    assert [call.kwargs["base_url"] for call in mock_openai.call_args_list] == ["http://a:11434/v1", "http://b:11434/v1"]
+    assert sorted(answers) == ["a", "b"]
+    assert [stats.completed for stats in client.router.stats] == [1, 1]
+
+
+def _server(answer: str, delay: float) -> MagicMock:
+    async def create(*args, **kwargs):
+        await asyncio.sleep(delay)
+        return _make_response(answer)
+    server = _mock_openai()
+    server.chat.completions.create.side_effect = create
+    return server
+
+
+def test_each_backend_is_sent_the_model_name_it_knows():
+    servers = [_server("ok", 0.01), _server("ok", 0.01)]
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", side_effect=servers):
+        client = OllamaClient(
+            model="vision", backends=[Backend("http://a:11434", 1, "qwen2.5vl:7b"), Backend("http://b:11434", 1)],
+        )
+
+        async def two_at_once():
+            return await asyncio.gather(client.chat("p1", system="s"), client.chat("p2", system="s"))
+
+        asyncio.run(two_at_once())
+    sent = [server.chat.completions.create.call_args.kwargs["model"] for server in servers]
+    assert sent == ["qwen2.5vl:7b", "vision"]
+
+
+def test_request_past_the_timeout_fails_as_a_timeout():
+    from openai import APITimeoutError
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", return_value=_server("late", 1.0)):
+        client = OllamaClient(model="test-model", timeout=0.01)
+        with pytest.raises(APITimeoutError):
+            asyncio.run(client.chat("prompt", system="system"))
+    assert client.router.stats[0].failed == 1
+
+
+def test_slow_request_is_hedged_on_another_backend():
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", side_effect=[_server("slow", 1.0), _server("fast", 0.0)]):
+        client = OllamaClient(
+            model="test-model", backends=[Backend("http://a:11434"), Backend("http://b:11434")], hedge=True,
+        )
+        for _ in range(client.latency.min_samples):
+            client.latency.add(0.01)
+        assert asyncio.run(client.chat("prompt", system="system")) == "fast"
+    assert (client.hedged, client.hedges_won) == (1, 1)
+    assert [stats.in_flight for stats in client.router.stats] == [0, 0]
+    assert [stats.completed for stats in client.router.stats] == [0, 1]
+
+
+
+def test_hedged_request_latency_counts_from_the_first_send():
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", side_effect=[_server("slow", 1.0), _server("fast", 0.0)]):
+        client = OllamaClient(
+            model="test-model", backends=[Backend("http://a:11434"), Backend("http://b:11434")], hedge=True,
+        )
+        for _ in range(client.latency.min_samples):
+            client.latency.add(0.05)
+        asyncio.run(client.chat("prompt", system="system"))
+    # Not the hedge's own few milliseconds: the p95 keeps up with slow requests instead of drifting down
+    assert client.latency._latencies[-1] >= 0.05
+
+
+def test_hedge_waits_for_a_limiter_slot_of_its_own():
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", side_effect=[_server("slow", 0.2), _server("fast", 0.0)]):
+        limiter = AdaptiveConcurrency(AdaptiveConfig(initial=1, maximum=1))
+        client = OllamaClient(
+            model="test-model", backends=[Backend("http://a:11434"), Backend("http://b:11434")], hedge=True,
+            limiter=limiter,
+        )
+        for _ in range(client.latency.min_samples):
+            client.latency.add(0.01)
+        assert asyncio.run(client.chat("prompt", system="system")) == "slow"
+    # The hedge only got a slot once the primary answered
+    assert (client.hedged, client.hedges_won) == (1, 0)
+
+def test_no_hedging_before_the_p95_is_known():
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI", side_effect=[_server("slow", 0.05), _server("fast", 0.0)]):
+        client = OllamaClient(
+            model="test-model", backends=[Backend("http://a:11434"), Backend("http://b:11434")], hedge=True,
+        )
+        assert asyncio.run(client.chat("prompt", system="system")) == "slow"
+    assert client.hedged == 0
+
+
+def test_hedging_needs_several_backends():
+    with patch("subtitles_ocr.vlm.client.AsyncOpenAI"):
+        assert not OllamaClient(model="test-model", hedge=True).hedge
+
+
+def test_cache_lookups_do_not_block_the_event_loop():
+    released = threading.Event()
+
+    class LockedCache:
+        def get(self, key: str, stage: str) -> str:
+            # Another job holding the cache file's lock until the loop lets the release through
+            return "cached" if released.wait(2) else "loop blocked"
+
+    async def lookup_while_the_loop_runs() -> str:
+        with patch("subtitles_ocr.vlm.client.AsyncOpenAI"):
+            lookup = asyncio.create_task(OllamaClient(model="test-model", cache=LockedCache()).chat("p", system="s"))
+        await asyncio.sleep(0.01)
+        released.set()
+        return await lookup
+
+    assert asyncio.run(lookup_while_the_loop_runs()) == "cached"
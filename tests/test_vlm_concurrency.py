@@ -0,0 +1,84 @@
+# tests/test_vlm_concurrency.py
+import asyncio
+from subtitles_ocr.vlm.concurrency import AdaptiveConcurrency, AdaptiveConfig
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _started(limiter: AdaptiveConcurrency) -> None:
+    async def hold() -> None:
+        async with limiter.slot():
+            pass
+    asyncio.run(hold())
+
+
+def _window(limiter: AdaptiveConcurrency, clock: Clock, duration: float, latency: float) -> None:
+    """Complete one window of requests spread over duration seconds."""
+    count = max(limiter.limit, limiter.config.min_window)
+    for _ in range(count):
+        clock.now += duration / count
+        limiter.completed(latency)
+
+
+def test_limit_grows_while_throughput_rises():
+    clock = Clock()
+    limiter = AdaptiveConcurrency(AdaptiveConfig(initial=4), clock=clock)
+    _started(limiter)
+    _window(limiter, clock, duration=1.0, latency=1.0)   # 4 req/s
+    assert limiter.limit == 5
+    _window(limiter, clock, duration=1.0, latency=1.0)   # 5 req/s
+    assert limiter.limit == 6
+    _window(limiter, clock, duration=1.2, latency=1.2)   # 6 in 1.2 s: no gain
+    assert limiter.limit == 6
+
+
+def test_latency_spike_cuts_the_limit():
+    clock = Clock()
+    limiter = AdaptiveConcurrency(AdaptiveConfig(initial=10), clock=clock)
+    _started(limiter)
+    _window(limiter, clock, duration=1.0, latency=0.5)
+    assert limiter.limit == 11
+    _window(limiter, clock, duration=1.0, latency=1.5)
+    assert limiter.limit == 8
+
+
+def test_overload_cuts_the_limit_once_per_window():
+    limiter = AdaptiveConcurrency(AdaptiveConfig(initial=10))
+    limiter.overloaded("RateLimitError")
+    limiter.overloaded("RateLimitError")
+    assert limiter.limit == 7
+
+
+def test_limit_stays_within_bounds():
+    limiter = AdaptiveConcurrency(AdaptiveConfig(initial=100, minimum=2, maximum=16))
+    assert limiter.limit == 16
+    for _ in range(10):
+        limiter.overloaded("InternalServerError")
+        limiter._decreased_this_window = False
+    assert limiter.limit == 2
+
+
+def test_slots_never_exceed_the_limit():
+    limiter = AdaptiveConcurrency(AdaptiveConfig(initial=3))
+    in_flight = 0
+    peak = 0
+
+    async def request() -> None:
+        nonlocal in_flight, peak
+        async with limiter.slot():
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+
+    async def main() -> None:
+        await asyncio.gather(*(request() for _ in range(20)))
+
+    asyncio.run(main())
+    assert peak == 3
@@ -0,0 +1,165 @@
+# tests/test_vlm_router.py
+import asyncio
+import httpx
+import pytest
+from openai import APIConnectionError
+from subtitles_ocr.vlm.router import Backend, BackendRouter, LatencyTracker, RouterConfig
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _connection_error() -> APIConnectionError:
+    return APIConnectionError(request=httpx.Request("POST", "http://localhost"))
+
+
+def _send(router: BackendRouter, error: Exception | None = None) -> int:
+    """Route one request, failing it with error; the index of the backend it went to."""
+    async def request() -> int:
+        async with router.backend() as index:
+            if error is not None:
+                raise error
+            return index
+    try:
+        return asyncio.run(request())
+    except Exception:
+        return -1
+
+
+def test_requests_go_to_the_least_busy_backend_for_its_limit():
+    router = BackendRouter([Backend("http://big", 2), Backend("http://small", 1)])
+    chosen = []
+
+    async def hold_slots() -> None:
+        entered = []
+        for _ in range(3):
+            slot = router.backend()
+            chosen.append(await slot.__aenter__())
+            entered.append(slot)
+        waiting = asyncio.create_task(router.backend().__aenter__())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()  # every backend is full
+        await entered[1].__aexit__(None, None, None)
+        chosen.append(await waiting)
+
+    asyncio.run(hold_slots())
+    assert chosen == [0, 1, 0, 1]
+
+
+def test_backend_failing_in_a_row_is_ejected_then_readmitted():
+    clock = Clock()
+    router = BackendRouter(
+        [Backend("http://a"), Backend("http://b")], RouterConfig(eject_after=2, eject_for=10.0), clock=clock,
+    )
+    # Both idle: ties go to the first backend
+    _send(router, _connection_error())
+    _send(router, _connection_error())
+    assert router.is_ejected(0)
+    assert router.stats[0].ejections == 1
+    assert _send(router) == 1
+    clock.now += 10.0
+    assert not router.is_ejected(0)
+    assert _send(router) == 0
+
+
+def test_failure_on_trial_ejects_twice_as_long():
+    clock = Clock()
+    router = BackendRouter(
+        [Backend("http://a"), Backend("http://b")], RouterConfig(eject_after=1, eject_for=10.0), clock=clock,
+    )
+    _send(router, _connection_error())
+    clock.now += 10.0
+    _send(router, _connection_error())  # re-admitted backend 0 fails at once
+    clock.now += 15.0
+    assert router.is_ejected(0)
+    clock.now += 5.0
+    assert not router.is_ejected(0)
+    assert _send(router) == 0
+    # Back for good: the next ejection is short again
+    _send(router, _connection_error())
+    clock.now += 10.0
+    assert not router.is_ejected(0)
+
+
+def test_other_errors_do_not_eject():
+    router = BackendRouter([Backend("http://a"), Backend("http://b")], RouterConfig(eject_after=1))
+    _send(router, ValueError("malformed answer"))
+    assert not router.is_ejected(0)
+
+
+def test_every_backend_ejected_uses_the_one_due_back_first():
+    clock = Clock()
+    router = BackendRouter(
+        [Backend("http://a"), Backend("http://b")], RouterConfig(eject_after=1, eject_for=10.0), clock=clock,
+    )
+    _send(router, _connection_error())
+    clock.now += 5.0
+    _send(router, _connection_error())
+    assert router.is_ejected(0) and router.is_ejected(1)
+    assert _send(router) == 0
+
+
+def test_stats_count_requests_and_throughput_per_backend():
+    clock = Clock()
+    router = BackendRouter([Backend("http://a")], clock=clock)
+
+    async def timed() -> None:
+        async with router.backend():
+            clock.now += 2.0
+
+    for _ in range(4):
+        asyncio.run(timed())
+    _send(router, _connection_error())
+    stats = router.stats[0]
+    assert (stats.completed, stats.failed, stats.in_flight) == (4, 1, 0)
+    assert stats.throughput == pytest.approx(0.5)
+
+
+def test_router_needs_a_backend():
+    with pytest.raises(ValueError):
+        BackendRouter([])
+
+
+def test_excluded_backend_is_skipped_even_when_least_busy():
+    router = BackendRouter([Backend("http://a"), Backend("http://b")])
+
+    async def pick() -> int:
+        async with router.backend(exclude=0) as index:
+            return index
+
+    assert asyncio.run(pick()) == 1
+
+
+def test_excluding_the_only_backend_fails():
+    router = BackendRouter([Backend("http://a")])
+
+    async def pick() -> None:
+        async with router.backend(exclude=0):
+            pass
+
+    with pytest.raises(ValueError):
+        asyncio.run(pick())
+
+
+def test_latency_p95_needs_enough_samples():
+    tracker = LatencyTracker(window=100, min_samples=20)
+    for latency in range(1, 20):
+        tracker.add(float(latency))
+    assert tracker.p95 is None
+    for latency in range(20, 101):
+        tracker.add(float(latency))
+    assert tracker.p95 == pytest.approx(95.05)
+
+
+def test_latency_p95_follows_recent_requests():
+    tracker = LatencyTracker(window=50, min_samples=20)
+    for _ in range(50):
+        tracker.add(10.0)
+    for _ in range(50):
+        tracker.add(1.0)
+    assert tracker.p95 == 1.0